@@ -1,22 +1,27 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
-from urllib.parse import quote
 import requests
 import json
 from urllib.parse import urljoin, urlencode
+from concurrent.futures import as_completed
 from dotenv import load_dotenv
 import os
 import openai
 from openai import OpenAI
-from it_llm import LLMService
-from maps_service import MapsService
-from llm import suggest_stops, parse_user_input
+from llm_service import LLMService
+from session_store import SessionStore
+import http_clients
+import upstream_scheduler
+from place_index import get_place_index, plain_request
+from maps_service import GeocodeBatch, MapsService
+from itinerary_pipeline import ItineraryPipeline
+from llm import suggest_stops, parse_user_input, suggestion_cache, suggestion_flights
 
 # Load environment variables from .env file
 load_dotenv()
 
 # Initialize OpenAI client
-client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"), http_client=http_clients.openai_http_client(), max_retries=0)
 
 # Verify environment variables are loaded
 if not os.getenv("GOOGLE_MAPS_KEY"):
@@ -26,19 +31,35 @@ app = Flask(__name__)
 CORS(app)
 
 # Initialize services
-llm_service = LLMService()
+# Itinerary state and chat memory are kept per client session; the model
+# and embeddings clients are shared by all sessions.
+_shared_llm_service = LLMService()
+llm_sessions = SessionStore(lambda: LLMService(
+    llm=_shared_llm_service.llm,
+    embeddings=_shared_llm_service.embeddings,
+    repair_llm=_shared_llm_service.repair_llm
+))
 maps_service = MapsService()
 
-OSRM_SERVER = "http://router.project-osrm.org"
+# Largest number of trips accepted by /generate_itineraries
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", 100))
+
+# Corridor width for answering /llm_chat from already known places
+PLACE_SEARCH_RADIUS_KM = float(os.getenv("PLACE_SEARCH_RADIUS_KM", 8))
+_background = upstream_scheduler.ContextThreadPoolExecutor(max_workers=2, thread_name_prefix="background")
+
+def get_session_id():
+    data = request.get_json(silent=True) or {}
+    return request.headers.get("X-Session-Id") or data.get("session_id") or "default"
+
+def route_options(data):
+    """Waypoint optimization options of a request body for get_route_data."""
+    return {"optimize": data.get("optimize"), "respect_times": bool(data.get("respect_times"))}
 
 def get_coordinates(location):
-    headers = {"User-Agent": "TripPlannerApp"}
-    encoded_location = quote(location)
-    nominatim_url = f"https://nominatim.openstreetmap.org/search?q={encoded_location}&format=json"
-    response = requests.get(nominatim_url, headers=headers)
-    if response.status_code == 200 and response.json():
-        location_data = response.json()[0]
-        return float(location_data["lat"]), float(location_data["lon"])
+    result = maps_service.geocode(location)
+    if result:
+        return result["lat"], result["lng"]
     return None
 
 @app.route("/generate_itinerary", methods=["POST"])
@@ -57,19 +78,25 @@ def generate_itinerary():
         return jsonify({"error": "Message is required"}), 400
 
     try:
-        # Generate itinerary using LLM
+        # Items are geocoded, and legs between finished stops fetched, while
+        # the model is still generating the rest of the itinerary
         print("Calling LLM service to generate itinerary...")
-        itinerary = llm_service.generate_itinerary(
-            user_request=user_request,
-            start_location=start_location,
-            end_location=end_location,
-            current_location=current_location
-        )
+        options = route_options(data)
+        pipeline = new_pipeline(options)
+        with llm_sessions.session(get_session_id()) as llm_service:
+            for item in llm_service.stream_itinerary(
+                user_request=user_request,
+                start_location=start_location,
+                end_location=end_location,
+                current_location=current_location
+            ):
+                pipeline.add(item)
+        itinerary = pipeline.items
         print(f"Generated itinerary: {itinerary}")
 
         # Get route data for the itinerary
         print("Getting route data...")
-        route_data = maps_service.get_route_data(itinerary)
+        route_data = pipeline.finish(**options)
         print(f"Route data: {route_data}")
         
         if "error" in route_data:
@@ -92,6 +119,115 @@ def generate_itinerary():
             "details": traceback.format_exc()
         }), 500
 
+@app.route("/generate_itineraries", methods=["POST"])
+def generate_itineraries():
+    """Generate itineraries and routes for many trips in one call.
+
+    Trips run concurrently and share geocodes; each gets its own result
+    (with an "error" key if it failed) in request order.
+    """
+    data = request.json or {}
+    trips = data.get("trips")
+    if not isinstance(trips, list) or not trips:
+        return jsonify({"error": "trips must be a non-empty list"}), 400
+    if len(trips) > MAX_BATCH_SIZE:
+        return jsonify({"error": f"At most {MAX_BATCH_SIZE} trips per request"}), 400
+
+    try:
+        # Upstream calls for the batch queue behind interactive requests
+        with upstream_scheduler.priority(upstream_scheduler.BATCH):
+            results = [None] * len(trips)
+            routes = {}
+            geocodes = GeocodeBatch(maps_service)
+            # Route building for a trip starts as soon as its itinerary is ready
+            for index, result in _shared_llm_service.generate_itinerary_batch(trips):
+                results[index] = result
+                if "error" not in result:
+                    routes[index] = maps_service.submit_route_data(
+                        result["itinerary"], geocodes, **route_options({**data, **trips[index]})
+                    )
+
+            for index, future in routes.items():
+                route_data = future.result()
+                if "error" in route_data:
+                    results[index] = {**results[index], "route": None, "error": route_data["error"]}
+                else:
+                    results[index] = {**results[index], "route": route_data}
+            return jsonify({"results": results})
+    except Exception as e:
+        print(f"Error generating itineraries: {str(e)}")
+        return jsonify({"error": f"Failed to generate itineraries: {str(e)}"}), 500
+
+def new_pipeline(options):
+    optimize = options.get("optimize")
+    if optimize is None:
+        optimize = maps_service.optimize_waypoints
+    # Legs prefetched in generation order are wasted if the stops get reordered
+    return ItineraryPipeline(maps_service, prefetch_legs=not optimize)
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def _marker_events(itinerary, pending, wait=False):
+    """Yield marker events for geocodes that have finished (all of them if wait)."""
+    futures = {future: index for index, future in pending.items()}
+    done = as_completed(futures) if wait else [f for f in futures if f.done()]
+    for future in done:
+        index = futures[future]
+        del pending[index]
+        coordinates = future.result()
+        marker = maps_service.build_marker(itinerary[index], *coordinates) if coordinates else None
+        yield _sse("marker", {"index": index, "marker": marker})
+
+@app.route("/generate_itinerary/stream", methods=["POST"])
+def generate_itinerary_stream():
+    data = request.json
+    user_request = data.get("user_request", "")
+    start_location = data.get("start_location")
+    end_location = data.get("end_location")
+    current_location = data.get("current_location")
+
+    if not user_request:
+        return jsonify({"error": "Message is required"}), 400
+
+    session_id = get_session_id()
+
+    def events():
+        options = route_options(data)
+        pipeline = new_pipeline(options)
+        itinerary = pipeline.items
+        pending = {}
+        try:
+            # Each item is sent as soon as the model finishes it and geocoded
+            # right away, so markers show up while the rest is generated.
+            with llm_sessions.session(session_id) as llm_service:
+                for item in llm_service.stream_itinerary(
+                    user_request=user_request,
+                    start_location=start_location,
+                    end_location=end_location,
+                    current_location=current_location
+                ):
+                    index = len(itinerary)
+                    pending[index] = pipeline.add(item)
+                    yield _sse("item", {"index": index, "item": item})
+                    yield from _marker_events(itinerary, pending)
+            yield from _marker_events(itinerary, pending, wait=True)
+
+            route_data = pipeline.finish(**options)
+            if "error" in route_data:
+                yield _sse("route", {"route": None, "error": route_data["error"]})
+            else:
+                yield _sse("route", {"route": route_data})
+        except Exception as e:
+            print(f"Error streaming itinerary: {str(e)}")
+            yield _sse("error", {"error": f"Failed to generate itinerary: {str(e)}"})
+        yield _sse("done", {"itinerary": itinerary})
+
+    return Response(events(), mimetype="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"
+    })
+
 @app.route("/update_itinerary", methods=["POST"])
 def update_itinerary():
     data = request.json
@@ -103,13 +239,14 @@ def update_itinerary():
 
     try:
         # Update itinerary using LLM
-        updated_itinerary = llm_service.update_itinerary(
-            user_request=user_request,
-            current_itinerary=current_itinerary
-        )
+        with llm_sessions.session(get_session_id()) as llm_service:
+            updated_itinerary = llm_service.update_itinerary(
+                user_request=user_request,
+                current_itinerary=current_itinerary
+            )
 
         # Get updated route data
-        route_data = maps_service.get_route_data(updated_itinerary)
+        route_data = maps_service.get_route_data(updated_itinerary, **route_options(data))
         
         if "error" in route_data:
             return jsonify({
@@ -125,6 +262,47 @@ def update_itinerary():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+def _place_to_suggestion(place, category):
+    """Shape an indexed place like an LLM place suggestion."""
+    if "worth_visiting" in place:
+        return {key: value for key, value in place.items() if key not in ("lat", "lng", "distance_km")}
+    rating = place.get("rating")
+    reviews = place.get("user_ratings_total")
+    return {
+        "name": place.get("name", "Unknown"),
+        "category": category,
+        "address": place.get("vicinity") or place.get("formatted_address", ""),
+        # Round trip off the route at ~60 km/h
+        "estimated_time_minutes": max(1, round(place.get("distance_km", 0) * 2)),
+        "description": f"{place.get('name', 'This place')} near your route",
+        "worth_visiting": f"Rated {rating} by {reviews} reviewers" if rating else "Close to your route"
+    }
+
+def known_places_along_route(start_location, end_location, stops, category, k=3):
+    """Places of category from the local place index along the route, as suggestions."""
+    if not start_location or not end_location:
+        return []
+    if isinstance(stops, str):
+        stops = [stops]
+    points = maps_service.corridor_points(start_location, end_location, stops or None)
+    places = get_place_index().query_near_polyline(points, category, PLACE_SEARCH_RADIUS_KM, k=k)
+    return [_place_to_suggestion(place, category) for place in places]
+
+def remember_suggestions(suggestions):
+    """Geocode LLM suggestions in the background and add them to the place index."""
+    def run():
+        index = get_place_index()
+        for suggestion in suggestions:
+            try:
+                geocoded = maps_service.geocode(suggestion["address"])
+                if geocoded:
+                    index.add(suggestion, suggestion["category"], geocoded["lat"], geocoded["lng"])
+            except Exception as e:
+                print(f"Error indexing suggestion {suggestion.get('name')}: {str(e)}")
+
+    with upstream_scheduler.priority(upstream_scheduler.BACKGROUND):
+        _background.submit(run)
+
 @app.route("/llm_chat", methods=["POST"])
 def llm_chat():
     data = request.json
@@ -136,14 +314,23 @@ def llm_chat():
     if not user_message:
         return jsonify({"error": "Message is required"}), 400
     try:
+        # Only messages naming a known category cost a route lookup, and only
+        # a plain "any gas stations?" is answered without the model
+        category = get_place_index().match_category(user_message)
+        known = known_places_along_route(start_location, end_location, stops, category) if category else []
+        if len(known) == 3 and plain_request(user_message, category):
+            return jsonify({"response": known})
+
         response = parse_user_input({
             "start": start_location,
             "end": end_location,
             "stops": stops,
             "message": user_message,
+            "known_places": known,
         })
-        print(response["suggestions"])
+        print(response.get("suggestions"))
         if response["success"]:
+            remember_suggestions(response["suggestions"])
             return jsonify({"response": response["suggestions"]})
         else:
             return jsonify({"response": "Sorry, I couldn't process your request."})
@@ -160,33 +347,66 @@ def get_route():
     if not start_location or not end_location:
         return jsonify({"error": "Start and End locations are required"}), 400
 
-    # Construct the Directions API request
-    base_url = "https://maps.googleapis.com/maps/api/directions/json"
-    api_key = os.getenv("GOOGLE_MAPS_KEY")
+    cache_key = maps_service.directions_cache.make_key(
+        [start_location, *stop_locations, end_location], mode="driving", source=maps_service.router.name
+    )
+    cached = maps_service.directions_cache.get(cache_key)
+    if cached is not None:
+        return jsonify(cached)
 
-   
-    if not api_key:
-        return jsonify({"error": "Google Maps API key not found in environment variables"}), 500
+    try:
+        # Same shape as a Directions API response, whichever router is configured
+        routes = maps_service.directions(start_location, end_location, waypoints=stop_locations or None)
+    except Exception as e:
+        print(f"Error fetching route: {str(e)}")
+        return jsonify({"error": "Failed to fetch route"}), 500
 
-    params = {
-        "origin": start_location,
-        "destination": end_location,
-        "key": api_key,
-    }
+    result = {"status": "OK" if routes else "ZERO_RESULTS", "routes": routes}
+    if routes:
+        maps_service.directions_cache.set(cache_key, result)
+    return jsonify(result)
+
+@app.route("/search_itinerary", methods=["POST"])
+def search_itinerary():
+    data = request.json
+    query = data.get("query", "")
+    k = int(data.get("k", 3))
+
+    if not query:
+        return jsonify({"error": "Query is required"}), 400
+
+    try:
+        with llm_sessions.session(get_session_id()) as llm_service:
+            return jsonify({"items": llm_service.search_itinerary(query, k)})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
 
-    if stop_locations:
-        # Format stops as a pipe-separated list
-        params["waypoints"] = "|".join(stop_locations)
+@app.route("/cache_stats", methods=["GET"])
+def cache_stats():
+    return jsonify({
+        "geocode": maps_service.geocode_cache.stats(),
+        "directions": maps_service.directions_cache.stats(),
+        "suggestions": suggestion_cache.stats(),
+        "sessions": llm_sessions.stats(),
+        "places": get_place_index().stats(),
+        "coordinates": maps_service.coordinate_trust.stats(),
+        "geocoder": maps_service.geocoder.stats(),
+        "in_flight": {
+            "suggestions": suggestion_flights.stats(),
+            "directions": maps_service.flights.stats(),
+            "geocode": maps_service.geocoder.flights.stats()
+        }
+    })
 
-    response = requests.get(base_url, params=params)
-    if response.status_code != 200:
-        return jsonify({"error": "Failed to fetch route from Google Maps API"}), 500
+@app.route("/upstream_stats", methods=["GET"])
+def upstream_stats():
+    return jsonify(upstream_scheduler.scheduler.stats())
 
-    return jsonify(response.json())
 @app.route("/clear_itinerary", methods=["POST"])
 def clear_itinerary():
     try:
-        llm_service.clear_itinerary()
+        with llm_sessions.session(get_session_id()) as llm_service:
+            llm_service.clear_itinerary()
         return jsonify({"message": "Itinerary cleared successfully"})
     except Exception as e:
         print(f"Error clearing itinerary: {str(e)}")
@@ -0,0 +1,41 @@
+"""ASGI entry point for serving many requests per process.
+
+    uvicorn asgi:asgi_app --port 5000
+
+The event loop holds client connections (including SSE streams) while the
+Flask handlers run on a large thread pool. Handlers spend nearly all their
+time waiting on OpenAI, Google Maps or Nominatim, whose shared connection
+pools in http_clients cap the real upstream concurrency.
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from asgiref.wsgi import WsgiToAsgi, WsgiToAsgiInstance
+
+from app import app
+
+_handler_pool = ThreadPoolExecutor(
+    max_workers=int(os.getenv("ASGI_THREADS", 256)),
+    thread_name_prefix="asgi"
+)
+
+
+class _ConcurrentWsgiInstance(WsgiToAsgiInstance):
+    # asgiref runs every WSGI call on one shared thread by default, which
+    # would serialize all requests; run them on the handler pool instead.
+    run_wsgi_app = sync_to_async(
+        WsgiToAsgiInstance.__dict__["run_wsgi_app"].func,
+        thread_sensitive=False,
+        executor=_handler_pool
+    )
+
+
+class ConcurrentWsgiToAsgi(WsgiToAsgi):
+    async def __call__(self, scope, receive, send):
+        await _ConcurrentWsgiInstance(self.wsgi_application, self.duplicate_header_limit)(
+            scope, receive, send
+        )
+
+
+asgi_app = ConcurrentWsgiToAsgi(app)
@@ -0,0 +1,135 @@
+import json
+import os
+from functools import lru_cache
+from typing import Dict, List, Optional
+
+try:
+    import tiktoken
+except ImportError:  # pragma: no cover - tiktoken ships with langchain_openai
+    tiktoken = None
+
+# Itinerary fields the model needs to read and reproduce; anything else the
+# frontend attaches (markers, UI flags, ...) is left out of prompts.
+ITINERARY_FIELDS = ("id", "type", "title", "description", "address", "location", "time", "duration")
+
+
+@lru_cache(maxsize=8)
+def _encoding(model: str):
+    """Load the tokenizer for model once; None if tiktoken or its data is unavailable."""
+    if tiktoken is None:
+        return None
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        # tiktoken downloads its vocabulary on first use, which fails offline
+        print(f"Falling back to estimated token counts: {str(e)}")
+        return None
+
+
+def count_tokens(text: str, model: str = "gpt-4") -> int:
+    """Count prompt tokens, estimating ~4 characters per token without tiktoken."""
+    if not text:
+        return 0
+    encoding = _encoding(model)
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text))
+
+
+def compact_itinerary(itinerary: Optional[List[Dict]]) -> str:
+    """Serialize an itinerary for a prompt with only the fields the model uses."""
+    compact = [
+        {field: item[field] for field in ITINERARY_FIELDS if item.get(field) not in (None, "")}
+        for item in itinerary or []
+        if isinstance(item, dict)
+    ]
+    return json.dumps(compact, separators=(",", ":"))
+
+
+def restore_fields(original: Optional[List[Dict]], updated: List[Dict]) -> List[Dict]:
+    """Copy fields compact_itinerary left out back onto updated items, matched by id.
+
+    A model that rewrites the itinerary from the compact form never saw
+    those fields, so it can't have meant to remove them.
+    """
+    by_id = {
+        str(item["id"]): item
+        for item in original or []
+        if isinstance(item, dict) and item.get("id") is not None
+    }
+    for item in updated:
+        source = by_id.get(str(item.get("id"))) if isinstance(item, dict) else None
+        if source is None:
+            continue
+        for field, value in source.items():
+            if field not in item:
+                item[field] = value
+    return updated
+
+
+class ChatHistory:
+    """Token-budgeted chat history for itinerary prompts.
+
+    The last keep_turns turns are kept verbatim. Older turns are folded into
+    a one-line summary of earlier requests, and the oldest parts of that
+    summary are dropped once the rendered history would exceed max_tokens.
+    """
+
+    def __init__(
+        self,
+        max_tokens: Optional[int] = None,
+        keep_turns: Optional[int] = None,
+        model: str = "gpt-4"
+    ):
+        self.max_tokens = int(max_tokens if max_tokens is not None else os.getenv("HISTORY_TOKEN_BUDGET", 600))
+        self.keep_turns = int(keep_turns if keep_turns is not None else os.getenv("MAX_HISTORY_TURNS", 10))
+        self.model = model
+        self.turns: List[tuple] = []
+        self.earlier_requests: List[str] = []
+
+    def add_turn(self, user_input: str, output: str):
+        self.turns.append((user_input, output))
+        while len(self.turns) > self.keep_turns:
+            self.earlier_requests.append(self.turns.pop(0)[0])
+        self._trim_summary(self.max_tokens)
+
+    def clear(self):
+        self.turns = []
+        self.earlier_requests = []
+
+    def _format_turn(self, turn: tuple) -> str:
+        return f"User: {turn[0]}\nAssistant: {turn[1]}"
+
+    def _format_summary(self, requests: List[str]) -> str:
+        if not requests:
+            return ""
+        return "Earlier requests: " + "; ".join(requests)
+
+    def _trim_summary(self, budget: int):
+        while self.earlier_requests and count_tokens(self._format_summary(self.earlier_requests), self.model) > budget:
+            self.earlier_requests.pop(0)
+
+    def render(self) -> str:
+        """Return the history as prompt text within the token budget."""
+        recent = []
+        used = 0
+        for index in range(len(self.turns) - 1, -1, -1):
+            text = self._format_turn(self.turns[index])
+            tokens = count_tokens(text, self.model)
+            if recent and used + tokens > self.max_tokens:
+                break
+            recent.insert(0, text)
+            used += tokens
+        # Recent turns that did not fit verbatim are summarized like older ones
+        requests = self.earlier_requests + [turn[0] for turn in self.turns[:len(self.turns) - len(recent)]]
+        budget = max(self.max_tokens - used, 0)
+        while requests and count_tokens(self._format_summary(requests), self.model) > budget:
+            requests = requests[1:]
+        summary = self._format_summary(requests)
+        return "\n".join(([summary] if summary else []) + recent) or "None"
+
+    def token_count(self) -> int:
+        return count_tokens(self.render(), self.model)
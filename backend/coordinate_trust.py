@@ -0,0 +1,150 @@
+"""Checks on coordinates supplied by the model.
+
+Itinerary items come with a "lat,lng" location next to their address, so a
+stop whose coordinates look right can be placed without a geocoding call.
+check() rejects coordinates that are out of range, far from what the
+geocode cache already knows about the address, or far from the
+neighbouring stops. A sample of the accepted ones is geocoded in the
+background to measure how often the model gets them wrong; the geocodes
+it fetches are cached, so later claims about the same address are held to
+the geocoder's answer.
+"""
+import os
+import random
+import threading
+from typing import Callable, Dict, Iterable, List, Optional
+
+import geometry
+from upstream_scheduler import BACKGROUND, ContextThreadPoolExecutor, priority
+
+Point = tuple
+
+
+def in_range(point: Point) -> bool:
+    """Valid latitude and longitude, and not the 0,0 placeholder models fall back to."""
+    lat, lng = point
+    return -90 <= lat <= 90 and -180 <= lng <= 180 and (lat, lng) != (0, 0)
+
+
+def distance_km(a: Point, b: Point) -> float:
+    return float(geometry.haversine(a[0], a[1], b[0], b[1])) / 1000
+
+
+def localities(address: str) -> List[str]:
+    """Broader forms of address, dropping one leading component at a time.
+
+    "1 Main St, Urbana, IL, USA" gives "Urbana, IL, USA" and "IL, USA";
+    the country on its own is too coarse to check against.
+    """
+    parts = [part.strip() for part in str(address).split(",") if part.strip()]
+    return [", ".join(parts[i:]) for i in range(1, len(parts) - 1)]
+
+
+class CoordinateTrust:
+    """Decides whether model-supplied coordinates can be used as they are.
+
+    known looks an address up in the geocode cache without fetching it;
+    geocode fetches it and is only called to verify samples.
+    """
+
+    def __init__(
+        self,
+        geocode: Callable[[str], Optional[Dict]],
+        known: Optional[Callable[[str], Optional[Dict]]] = None,
+        sample_rate: Optional[float] = None,
+        tolerance_km: Optional[float] = None,
+        max_area_km: Optional[float] = None,
+        max_neighbor_km: Optional[float] = None
+    ):
+        self.geocode = geocode
+        self.known = known or (lambda address: None)
+        # Share of accepted coordinates geocoded in the background
+        self.sample_rate = float(sample_rate if sample_rate is not None else os.getenv("COORDINATE_VERIFY_SAMPLE", 0.1))
+        # How far coordinates may be from the geocoded address itself
+        self.tolerance_km = float(tolerance_km if tolerance_km is not None else os.getenv("COORDINATE_TOLERANCE_KM", 1))
+        # ... and from the city or region the address is in
+        self.max_area_km = float(max_area_km if max_area_km is not None else os.getenv("COORDINATE_MAX_AREA_KM", 50))
+        # ... and from the closest neighbouring stop
+        self.max_neighbor_km = float(
+            max_neighbor_km if max_neighbor_km is not None else os.getenv("COORDINATE_MAX_NEIGHBOR_KM", 500)
+        )
+        self.accepted = 0
+        self.rejected = 0
+        self.verified = 0
+        self.mismatches = 0
+        self._lock = threading.Lock()
+        self._verify_pool = ContextThreadPoolExecutor(max_workers=1, thread_name_prefix="verify")
+
+    def _known_point(self, address: str) -> Optional[Point]:
+        result = self.known(address)
+        return (result["lat"], result["lng"]) if result else None
+
+    def check(self, point: Point, address: Optional[str] = None, neighbors: Iterable[Point] = ()) -> Optional[str]:
+        """Return why point can't be trusted, or None if it can."""
+        if not in_range(point):
+            return f"{point} is not a valid coordinate"
+        if address:
+            exact = self._known_point(address)
+            if exact is not None:
+                if distance_km(point, exact) > self.tolerance_km:
+                    return f"{point} is {distance_km(point, exact):.1f} km from {address}"
+            else:
+                for locality in localities(address):
+                    area = self._known_point(locality)
+                    if area is not None:
+                        if distance_km(point, area) > self.max_area_km:
+                            return f"{point} is {distance_km(point, area):.0f} km from {locality}"
+                        break
+        neighbors = [neighbor for neighbor in neighbors if neighbor is not None]
+        if neighbors:
+            nearest = min(distance_km(point, neighbor) for neighbor in neighbors)
+            if nearest > self.max_neighbor_km:
+                return f"{point} is {nearest:.0f} km from the nearest other stop"
+        return None
+
+    def accept(self, point: Point, address: Optional[str] = None, neighbors: Iterable[Point] = ()) -> bool:
+        """check() point, queueing a sampled verification if it passes."""
+        problem = self.check(point, address, neighbors)
+        with self._lock:
+            if problem:
+                self.rejected += 1
+            else:
+                self.accepted += 1
+        if problem:
+            print(f"Geocoding instead of using model coordinates: {problem}")
+            return False
+        if address and self.sample_rate > 0 and random.random() < self.sample_rate:
+            with priority(BACKGROUND):
+                self._verify_pool.submit(self.verify, point, address)
+        return True
+
+    def verify(self, point: Point, address: str) -> Optional[float]:
+        """Geocode address and record how far point is from it, in km."""
+        try:
+            geocoded = self.geocode(address)
+        except Exception as e:
+            print(f"Error verifying coordinates for {address}: {str(e)}")
+            return None
+        if not geocoded:
+            return None
+        error = distance_km(point, (geocoded["lat"], geocoded["lng"]))
+        with self._lock:
+            self.verified += 1
+            if error > self.tolerance_km:
+                self.mismatches += 1
+        if error > self.tolerance_km:
+            print(f"Model coordinates for {address} were {error:.1f} km off")
+        return error
+
+    def stats(self) -> Dict:
+        with self._lock:
+            checked = self.accepted + self.rejected
+            return {
+                "accepted": self.accepted,
+                "rejected": self.rejected,
+                "acceptance_rate": round(self.accepted / checked, 4) if checked else 0.0,
+                "sample_rate": self.sample_rate,
+                "verified": self.verified,
+                "mismatches": self.mismatches,
+                "mismatch_rate": round(self.mismatches / self.verified, 4) if self.verified else 0.0
+            }
@@ -0,0 +1,144 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+from cache import LRUCache
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "geocode_cache.sqlite3")
+DEFAULT_TTL = 30 * 24 * 60 * 60
+
+
+def normalize_address(address: str) -> str:
+    """Normalize an address so trivially different spellings share a cache key."""
+    text = str(address).strip().lower()
+    text = re.sub(r"[^\w\s,#-]", "", text)
+    text = re.sub(r"\s*,\s*", ", ", text)
+    text = re.sub(r"\s+", " ", text)
+    return text.strip(", ")
+
+
+class GeocodeCache:
+    """Two-tier geocode cache: an in-process LRU in front of a SQLite store.
+
+    Entries are keyed by (provider, normalized address) and expire after ttl
+    seconds in both tiers. Pass path="" to run memory-only.
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        maxsize: Optional[int] = None,
+        ttl: Optional[float] = None
+    ):
+        if path is None:
+            path = os.getenv("GEOCODE_CACHE_PATH", DEFAULT_CACHE_PATH)
+        self.ttl = float(ttl if ttl is not None else os.getenv("GEOCODE_CACHE_TTL", DEFAULT_TTL))
+        maxsize = int(maxsize if maxsize is not None else os.getenv("GEOCODE_CACHE_SIZE", 4096))
+        self.memory = LRUCache(maxsize=maxsize, ttl=self.ttl)
+        self.disk_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            try:
+                self._db = sqlite3.connect(path, check_same_thread=False)
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS geocodes ("
+                    "provider TEXT NOT NULL, address TEXT NOT NULL, "
+                    "result TEXT NOT NULL, expires_at REAL NOT NULL, "
+                    "PRIMARY KEY (provider, address))"
+                )
+                self._db.commit()
+            except sqlite3.Error as e:
+                print(f"Geocode cache disabled on-disk storage: {str(e)}")
+                self._db = None
+
+    def _read_disk(self, provider: str, key: str) -> Optional[Dict]:
+        if self._db is None:
+            return None
+        with self._lock:
+            row = self._db.execute(
+                "SELECT result, expires_at FROM geocodes WHERE provider = ? AND address = ?",
+                (provider, key)
+            ).fetchone()
+        if row is None or row[1] <= time.time():
+            return None
+        return json.loads(row[0])
+
+    def _write_disk(self, provider: str, key: str, result: Dict):
+        if self._db is None:
+            return
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO geocodes (provider, address, result, expires_at) "
+                "VALUES (?, ?, ?, ?)",
+                (provider, key, json.dumps(result), time.time() + self.ttl)
+            )
+            self._db.commit()
+
+    def get(self, address: str, provider: str = "google") -> Optional[Dict]:
+        key = normalize_address(address)
+        result = self.memory.get((provider, key))
+        if result is not None:
+            return result
+        result = self._read_disk(provider, key)
+        if result is not None:
+            self.disk_hits += 1
+            self.memory.set((provider, key), result)
+            return result
+        self.misses += 1
+        return None
+
+    def peek(self, address: str, provider: str = "google") -> Optional[Dict]:
+        """Cached result for address, if any, without counting a hit or miss."""
+        key = normalize_address(address)
+        result = self.memory.peek((provider, key))
+        if result is None:
+            result = self._read_disk(provider, key)
+        return result
+
+    def set(self, address: str, result: Dict, provider: str = "google"):
+        key = normalize_address(address)
+        self.memory.set((provider, key), result)
+        self._write_disk(provider, key, result)
+
+    def get_or_fetch(
+        self,
+        address: str,
+        fetch: Callable[[], Optional[Dict]],
+        provider: str = "google"
+    ) -> Optional[Dict]:
+        """Return a cached geocode or call fetch() and store its result.
+
+        Failed lookups (None) are not cached so they are retried next time.
+        """
+        result = self.get(address, provider)
+        if result is not None:
+            return result
+        result = fetch()
+        if result is not None:
+            self.set(address, result, provider)
+        return result
+
+    def clear(self):
+        self.memory.clear()
+        if self._db is not None:
+            with self._lock:
+                self._db.execute("DELETE FROM geocodes")
+                self._db.commit()
+
+    def stats(self) -> Dict:
+        hits = self.memory.hits + self.disk_hits
+        lookups = hits + self.misses
+        return {
+            "memory": self.memory.stats(),
+            "disk_enabled": self._db is not None,
+            "hits": hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0
+        }
@@ -0,0 +1,219 @@
+"""One geocoding entry point over several providers.
+
+Providers are tried in priority order (GEOCODER_PROVIDERS, default
+"google,nominatim"). Each has its own token bucket and circuit breaker, so
+a provider that is down is skipped until its breaker lets a trial call
+through, and one that errors fails over to the next.
+
+Slow answers are hedged: if the provider asked first hasn't answered by
+its own p95 latency, the request also goes to the next provider and the
+first answer wins. The hedge is only sent if that provider's rate limit
+has room right now, so hedging never queues behind Nominatim's 1 req/s.
+"""
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from geocode_cache import GeocodeCache, normalize_address
+from rate_limiter import CircuitBreaker, TokenBucket
+from singleflight import SingleFlight
+from upstream_scheduler import ContextThreadPoolExecutor
+
+# Latencies needed before a provider's p95 is used instead of the default hedge delay
+MIN_LATENCY_SAMPLES = 20
+
+
+class GeocodeProvider:
+    """A geocoding backend with its own rate limit, breaker and latency history."""
+
+    def __init__(
+        self,
+        name: str,
+        lookup: Callable[[str], Optional[Dict]],
+        limiter: TokenBucket,
+        breaker: Optional[CircuitBreaker] = None,
+        history: int = 200
+    ):
+        self.name = name
+        self.lookup = lookup
+        self.limiter = limiter
+        self.breaker = breaker or CircuitBreaker(
+            failure_threshold=int(os.getenv("GEOCODER_BREAKER_FAILURES", 5)),
+            reset_after=float(os.getenv("GEOCODER_BREAKER_RESET", 30))
+        )
+        self.latencies = deque(maxlen=history)
+        self.calls = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def call(self, address: str) -> Optional[Dict]:
+        """Look address up, recording the latency and the outcome for the breaker."""
+        started = time.monotonic()
+        with self._lock:
+            self.calls += 1
+        try:
+            result = self.lookup(address)
+        except Exception:
+            with self._lock:
+                self.errors += 1
+            self.breaker.record_failure()
+            raise
+        self.breaker.record_success()
+        with self._lock:
+            self.latencies.append(time.monotonic() - started)
+        return result
+
+    def p95(self) -> Optional[float]:
+        """95th percentile latency in seconds, or None until there are enough samples."""
+        with self._lock:
+            if len(self.latencies) < MIN_LATENCY_SAMPLES:
+                return None
+            return float(np.percentile(list(self.latencies), 95))
+
+    def stats(self) -> Dict:
+        p95 = self.p95()
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "errors": self.errors,
+                "breaker": self.breaker.state,
+                "p95_ms": round(p95 * 1000, 1) if p95 is not None else None
+            }
+
+
+class Geocoder:
+    """Cached, hedged geocoding with failover across providers."""
+
+    def __init__(
+        self,
+        providers: List[GeocodeProvider],
+        cache: Optional[GeocodeCache] = None,
+        hedge_delay: Optional[float] = None
+    ):
+        if not providers:
+            raise ValueError("Geocoder needs at least one provider")
+        self.providers = providers
+        self.cache = cache or GeocodeCache()
+        # Hedge delay for a provider without enough latency samples yet
+        self.hedge_delay = float(hedge_delay if hedge_delay is not None else os.getenv("GEOCODER_HEDGE_DELAY", 1.0))
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.failovers = 0
+        self.flights = SingleFlight()
+        self._lock = threading.Lock()
+        self._pool = ContextThreadPoolExecutor(
+            max_workers=int(os.getenv("GEOCODER_CONCURRENCY", 16)),
+            thread_name_prefix="geocoder"
+        )
+
+    def cached(self, address: str) -> Optional[Dict]:
+        """Any provider's cached result for address, without fetching or counting stats."""
+        for provider in self.providers:
+            result = self.cache.peek(address, provider=provider.name)
+            if result is not None:
+                return result
+        return None
+
+    def geocode(self, address: str) -> Optional[Dict]:
+        """{"lat", "lng", "formatted_address"} for address, or None if no provider finds it."""
+        result = self.cache.get(address, provider=self.providers[0].name)
+        if result is None and len(self.providers) > 1:
+            result = self.cached(address)
+        if result is not None:
+            return result
+        # Concurrent lookups of the same address share one provider call
+        return self.flights.do(normalize_address(address), self._fetch_and_store, address)
+
+    def _fetch_and_store(self, address: str) -> Optional[Dict]:
+        name, result = self._fetch(address)
+        if result is not None:
+            self.cache.set(address, result, provider=name)
+        return result
+
+    def _count(self, counter: str):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _fetch(self, address: str) -> Tuple[Optional[str], Optional[Dict]]:
+        """Ask providers for address; returns (provider name, result).
+
+        The first provider to answer without an error decides the result,
+        even if that answer is "not found".
+        """
+        remaining = list(self.providers)
+
+        def next_provider() -> Optional[GeocodeProvider]:
+            while remaining:
+                provider = remaining.pop(0)
+                if provider.breaker.allow():
+                    return provider
+            return None
+
+        # Future -> (provider, whether it was sent as a hedge)
+        pending: Dict[Future, Tuple[GeocodeProvider, bool]] = {}
+
+        def launch(provider: GeocodeProvider, hedge: bool = False):
+            pending[self._pool.submit(provider.call, address)] = (provider, hedge)
+
+        provider = next_provider()
+        if provider is None:
+            print(f"No geocoding provider available for {address}")
+            return None, None
+        provider.limiter.acquire()
+        launch(provider)
+        hedging = True
+        while pending:
+            delay = None
+            if hedging and remaining and len(pending) == 1:
+                waiting_on = next(iter(pending.values()))[0]
+                delay = waiting_on.p95() or self.hedge_delay
+            done, _ = wait(pending, timeout=delay, return_when=FIRST_COMPLETED)
+            if not done:
+                # Slower than usual: also ask the next provider if it is
+                # healthy and has room right now
+                hedging = False
+                if remaining[0].breaker.state == "closed" and remaining[0].limiter.try_acquire():
+                    launch(remaining.pop(0), hedge=True)
+                    self._count("hedges")
+                continue
+            for future in done:
+                provider, hedge = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    print(f"Error geocoding {address} with {provider.name}: {str(e)}")
+                    continue
+                if hedge:
+                    self._count("hedge_wins")
+                return provider.name, result
+            if not pending:
+                # Every request so far failed; fall back to the next provider
+                provider = next_provider()
+                if provider is not None:
+                    provider.limiter.acquire()
+                    launch(provider)
+                    self._count("failovers")
+        return None, None
+
+    def stats(self) -> Dict:
+        with self._lock:
+            totals = {"hedges": self.hedges, "hedge_wins": self.hedge_wins, "failovers": self.failovers}
+        return {**totals, "providers": {provider.name: provider.stats() for provider in self.providers}}
+
+
+def create_geocoder(
+    lookups: Dict[str, Callable[[str], Optional[Dict]]],
+    limiters: Dict[str, TokenBucket],
+    cache: Optional[GeocodeCache] = None
+) -> Geocoder:
+    """Build a Geocoder over the providers named in GEOCODER_PROVIDERS, in that order."""
+    names = [name.strip().lower() for name in os.getenv("GEOCODER_PROVIDERS", "google,nominatim").split(",") if name.strip()]
+    unknown = [name for name in names if name not in lookups]
+    if unknown:
+        raise ValueError(f"Unknown geocoding provider: {', '.join(unknown)}")
+    return Geocoder([GeocodeProvider(name, lookups[name], limiters[name]) for name in names], cache=cache)
@@ -0,0 +1,131 @@
+from typing import Iterable, Union
+
+import numpy as np
+import polyline
+
+EARTH_RADIUS_M = 6371000.0
+
+Points = Union[np.ndarray, Iterable]
+
+
+def as_points(points: Points) -> np.ndarray:
+    """Return points as a float (N, 2) array of (lat, lng)."""
+    array = np.asarray(points, dtype=float)
+    return array.reshape(-1, 2)
+
+
+def decode_polyline(encoded: str, precision: int = 5) -> np.ndarray:
+    """Decode a Google encoded polyline into an (N, 2) array without a Python loop per point.
+
+    Raises ValueError if encoded is truncated or isn't a polyline.
+    """
+    if not encoded:
+        return np.empty((0, 2))
+    try:
+        chunks = np.frombuffer(encoded.encode("ascii"), dtype=np.uint8).astype(np.int64) - 63
+    except UnicodeEncodeError:
+        raise ValueError("Invalid polyline: contains non-ASCII characters")
+    if ((chunks < 0) | (chunks > 0x3F)).any():
+        raise ValueError(f"Invalid polyline: character {encoded[int(np.argmax((chunks < 0) | (chunks > 0x3F)))]!r} out of range")
+    # A value ends at the first 5-bit chunk without the continuation bit
+    ends = np.flatnonzero(chunks < 0x20)
+    if not len(ends) or ends[-1] != len(chunks) - 1:
+        raise ValueError("Invalid polyline: truncated in the middle of a value")
+    if len(ends) % 2:
+        raise ValueError(f"Invalid polyline: {len(ends)} values do not form lat/lng pairs")
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    offsets = np.arange(len(chunks)) - np.repeat(starts, ends - starts + 1)
+    values = np.add.reduceat((chunks & 0x1F) << (5 * offsets), starts)
+    deltas = np.where(values & 1, ~(values >> 1), values >> 1)
+    return np.cumsum(deltas.reshape(-1, 2), axis=0) / 10 ** precision
+
+
+def encode_polyline(points: Points, precision: int = 5) -> str:
+    return polyline.encode([tuple(point) for point in as_points(points).tolist()], precision)
+
+
+def haversine(lat1, lng1, lat2, lng2) -> np.ndarray:
+    """Great-circle distance in meters; arguments broadcast like NumPy arrays."""
+    lat1, lng1, lat2, lng2 = (np.radians(np.asarray(value, dtype=float)) for value in (lat1, lng1, lat2, lng2))
+    h = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.clip(h, 0.0, 1.0)))
+
+
+def distances_to(points: Points, lat: float, lng: float) -> np.ndarray:
+    """Distance in meters from every point to (lat, lng)."""
+    points = as_points(points)
+    return haversine(points[:, 0], points[:, 1], lat, lng)
+
+
+def cumulative_distances(points: Points) -> np.ndarray:
+    """Distance in meters travelled along the polyline up to each point."""
+    points = as_points(points)
+    if len(points) == 0:
+        return np.empty(0)
+    segments = haversine(points[:-1, 0], points[:-1, 1], points[1:, 0], points[1:, 1])
+    return np.concatenate(([0.0], np.cumsum(segments)))
+
+
+def sample_indices(points: Points, num_samples: int) -> np.ndarray:
+    """Indices of num_samples route points spaced evenly by distance travelled."""
+    cumulative = cumulative_distances(points)
+    if num_samples <= 0 or len(cumulative) == 0:
+        return np.empty(0, dtype=int)
+    targets = np.arange(num_samples) * (cumulative[-1] / num_samples)
+    return np.minimum(np.searchsorted(cumulative, targets, side="left"), len(cumulative) - 1)
+
+
+def resample(points: Points, interval_m: float) -> np.ndarray:
+    """Interpolate points every interval_m meters along the polyline, keeping both ends."""
+    points = as_points(points)
+    cumulative = cumulative_distances(points)
+    if len(points) < 2 or cumulative[-1] == 0:
+        return points.copy()
+    targets = np.arange(0.0, cumulative[-1], interval_m)
+    if targets[-1] < cumulative[-1]:
+        targets = np.append(targets, cumulative[-1])
+    return np.column_stack((
+        np.interp(targets, cumulative, points[:, 0]),
+        np.interp(targets, cumulative, points[:, 1])
+    ))
+
+
+def douglas_peucker(points: Points, tolerance_m: float) -> np.ndarray:
+    """Simplify a polyline, dropping points closer than tolerance_m to the simplified line."""
+    points = as_points(points)
+    if len(points) < 3 or tolerance_m <= 0:
+        return points.copy()
+    # Work in local equirectangular meters; accurate enough at route scale
+    lat0 = np.radians(points[:, 0].mean())
+    xy = np.column_stack((
+        np.radians(points[:, 1]) * np.cos(lat0) * EARTH_RADIUS_M,
+        np.radians(points[:, 0]) * EARTH_RADIUS_M
+    ))
+    keep = np.zeros(len(points), dtype=bool)
+    keep[[0, -1]] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        segment = xy[last] - xy[first]
+        inner = xy[first + 1:last] - xy[first]
+        length = np.hypot(*segment)
+        if length == 0:
+            distances = np.hypot(inner[:, 0], inner[:, 1])
+        else:
+            distances = np.abs(segment[0] * inner[:, 1] - segment[1] * inner[:, 0]) / length
+        index = int(np.argmax(distances))
+        if distances[index] > tolerance_m:
+            split = first + 1 + index
+            keep[split] = True
+            stack.append((first, split))
+            stack.append((split, last))
+    return points[keep]
+
+
+def simplify_polyline(encoded: str, tolerance_m: float) -> str:
+    """Douglas-Peucker simplify an encoded polyline and re-encode it."""
+    if tolerance_m <= 0 or not encoded:
+        return encoded
+    return encode_polyline(douglas_peucker(decode_polyline(encoded), tolerance_m))
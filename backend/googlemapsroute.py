@@ -0,0 +1,126 @@
+import os
+from typing import Dict, List, Optional, Tuple
+
+import geometry
+import http_clients
+from place_index import get_place_index
+from upstream_scheduler import ContextThreadPoolExecutor
+
+DIRECTIONS_URL = "https://maps.googleapis.com/maps/api/directions/json"
+PLACES_URL = "https://maps.googleapis.com/maps/api/place/nearbysearch/json"
+
+# Ranking penalty (in rating points) per kilometre of round-trip detour
+DETOUR_WEIGHT_PER_KM = float(os.getenv("DETOUR_WEIGHT_PER_KM", 0.1))
+
+_places_pool = ContextThreadPoolExecutor(
+    max_workers=int(os.getenv("PLACES_CONCURRENCY", 8)),
+    thread_name_prefix="places"
+)
+
+
+def get_route(start: str, end: str) -> List[Tuple[float, float]]:
+    """Return the decoded overview polyline of the driving route, or [] if none."""
+    response = http_clients.google_maps.get(DIRECTIONS_URL, params={
+        "origin": start,
+        "destination": end,
+        "mode": "driving",
+        "key": os.getenv("GOOGLE_MAPS_KEY")
+    })
+    data = response.json()
+    if data.get("status") != "OK" or not data.get("routes"):
+        print(f"Error getting route: {data.get('status')}")
+        return []
+    points = geometry.decode_polyline(data["routes"][0]["overview_polyline"]["points"])
+    return [tuple(point) for point in points.tolist()]
+
+
+def sample_route_points(points: List[Tuple[float, float]], num_samples: int) -> List[Tuple[float, float]]:
+    """Pick num_samples points spaced evenly by distance travelled along the route.
+
+    Sampling by index would cluster samples where the polyline is dense
+    (cities) and leave long highway stretches uncovered.
+    """
+    if num_samples <= 0 or not points:
+        return []
+    if len(points) <= num_samples:
+        return list(points)
+    return [points[index] for index in geometry.sample_indices(points, num_samples)]
+
+
+def get_stops_nearby(lat: float, lng: float, stop_type: str, radius: int = 5000) -> List[Dict]:
+    """Return every Places result of stop_type within radius meters of (lat, lng)."""
+    response = http_clients.google_maps.get(PLACES_URL, params={
+        "location": f"{lat},{lng}",
+        "radius": radius,
+        "keyword": stop_type,
+        "key": os.getenv("GOOGLE_MAPS_KEY")
+    })
+    data = response.json()
+    if data.get("status") not in ("OK", "ZERO_RESULTS"):
+        print(f"Error searching places: {data.get('status')}")
+    return data.get("results", [])
+
+
+def get_stop_nearby(lat: float, lng: float, stop_type: str, radius: int = 5000) -> Optional[Dict]:
+    """Return the best-rated stop of stop_type near (lat, lng), or None."""
+    results = get_stops_nearby(lat, lng, stop_type, radius)
+    if not results:
+        return None
+    return max(results, key=lambda place: (place.get("rating", 0), place.get("user_ratings_total", 0)))
+
+
+def _detour_km(place: Dict, route_points) -> float:
+    location = place["geometry"]["location"]
+    # There and back again from the closest point on the route
+    return 2 * float(geometry.distances_to(route_points, location["lat"], location["lng"]).min()) / 1000
+
+
+def rank_stops(places: List[Dict], route_points: List[Tuple[float, float]]) -> List[Dict]:
+    """Deduplicate places by place_id and sort them by rating minus detour cost."""
+    route_points = geometry.as_points(route_points)
+    unique = {}
+    for place in places:
+        key = place.get("place_id") or (place.get("name"), place.get("vicinity"))
+        unique.setdefault(key, place)
+    ranked = []
+    for place in unique.values():
+        detour = _detour_km(place, route_points) if len(route_points) and "geometry" in place else 0.0
+        ranked.append({**place, "detour_km": round(detour, 2)})
+    ranked.sort(key=lambda place: place.get("rating", 0) - DETOUR_WEIGHT_PER_KM * place["detour_km"], reverse=True)
+    return ranked
+
+
+def find_stops_along_route(
+    start: str,
+    end: str,
+    stop_type: str,
+    num_samples: int = 5,
+    radius: int = 5000
+) -> Dict:
+    """Search for stops of stop_type around evenly spaced points of the route.
+
+    Sample points that already have fresh places of stop_type in the local
+    place index are answered from it. The Places lookups for the rest run
+    concurrently, so the search takes about as long as the slowest single
+    lookup, and their results are added to the index.
+    """
+    route = get_route(start, end)
+    if not route:
+        return {"error": "No route found", "stops": []}
+    samples = sample_route_points(route, num_samples)
+    index = get_place_index()
+    places = []
+    missing = []
+    for lat, lng in samples:
+        known = index.query_near_point(lat, lng, stop_type, radius / 1000)
+        if known:
+            places.extend(known)
+        else:
+            missing.append((lat, lng))
+    for result in _places_pool.map(lambda point: get_stops_nearby(point[0], point[1], stop_type, radius), missing):
+        index.add_places_results(result, stop_type)
+        places.extend(result)
+    return {
+        "samples": samples,
+        "stops": rank_stops(places, route)
+    }
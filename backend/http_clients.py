@@ -0,0 +1,152 @@
+import os
+import threading
+from typing import Callable, Optional
+
+import httpx
+import requests
+from geopy.adapters import BaseSyncAdapter, RequestsAdapter
+from requests.adapters import HTTPAdapter
+
+from upstream_scheduler import retryable_response, scheduler
+
+
+def over_query_limit(response) -> bool:
+    """Google Maps reports an exhausted quota as HTTP 200 with status OVER_QUERY_LIMIT."""
+    if getattr(response, "status_code", None) != 200:
+        return False
+    try:
+        body = response.json()
+    except ValueError:
+        return False
+    return isinstance(body, dict) and body.get("status") == "OVER_QUERY_LIMIT"
+
+
+class ScheduledAdapter(HTTPAdapter):
+    """HTTPAdapter whose requests are queued, rate-limited and retried by the upstream scheduler.
+
+    throttled_if spots quota errors the upstream reports in an otherwise
+    successful response; they pause the upstream's queue like a 429.
+    """
+
+    def __init__(self, key: str, throttled_if: Optional[Callable] = None, **kwargs):
+        self.key = key
+        self.throttled_if = throttled_if
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        return scheduler.call(
+            self.key,
+            super().send,
+            request,
+            retry_if=retryable_response,
+            retry_on=(requests.ConnectionError,),
+            throttled_if=self.throttled_if,
+            **kwargs
+        )
+
+
+class ScheduledTransport(httpx.BaseTransport):
+    """httpx transport that sends every request through the upstream scheduler."""
+
+    def __init__(self, key: str, transport: httpx.BaseTransport):
+        self.key = key
+        self.transport = transport
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        return scheduler.call(
+            self.key,
+            self.transport.handle_request,
+            request,
+            retry_if=retryable_response,
+            retry_on=(httpx.ConnectError, httpx.ConnectTimeout)
+        )
+
+    def close(self):
+        self.transport.close()
+
+
+class Upstream:
+    """Shared keep-alive connection pool for one upstream API.
+
+    The pool holds at most max_connections connections and blocks further
+    callers until one is free, which doubles as the upstream's concurrency
+    limit. Every request gets the upstream's timeout unless one is passed
+    and is scheduled and retried under the upstream's name.
+    """
+
+    def __init__(self, name: str, timeout: float, max_connections: int, throttled_if: Optional[Callable] = None):
+        self.name = name
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.session = requests.Session()
+        adapter = ScheduledAdapter(
+            name, throttled_if=throttled_if, pool_connections=4, pool_maxsize=max_connections, pool_block=True
+        )
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        kwargs.setdefault("timeout", self.timeout)
+        return self.session.get(url, **kwargs)
+
+
+class GeopyAdapter(RequestsAdapter):
+    """geopy adapter that sends requests over an Upstream's session.
+
+    geopy otherwise builds its own session, bypassing the upstream's pool
+    and the scheduler. The session is shared, so it is never closed here.
+    """
+
+    def __init__(self, upstream: Upstream, *, proxies=None, ssl_context=None):
+        BaseSyncAdapter.__init__(self, proxies=proxies, ssl_context=ssl_context)
+        self.session = upstream.session
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+    def __del__(self):
+        pass
+
+
+def _upstream(name: str, timeout: float, max_connections: int, throttled_if: Optional[Callable] = None) -> Upstream:
+    prefix = name.upper()
+    return Upstream(
+        name,
+        timeout=float(os.getenv(f"{prefix}_TIMEOUT", timeout)),
+        max_connections=int(os.getenv(f"{prefix}_MAX_CONNECTIONS", max_connections)),
+        throttled_if=throttled_if
+    )
+
+
+nominatim = _upstream("nominatim", timeout=10, max_connections=2)
+google_maps = _upstream("google_maps", timeout=10, max_connections=32, throttled_if=over_query_limit)
+# The scheduler owns Google Maps retries; googlemaps.Client only gets this
+# long to retry the 5xx answers the scheduler gave up on
+GOOGLE_MAPS_RETRY_TIMEOUT = float(os.getenv("GOOGLE_MAPS_RETRY_TIMEOUT", 5))
+osrm = _upstream("osrm", timeout=5, max_connections=32)
+
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", 60))
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", 64))
+
+_openai_client: Optional[httpx.Client] = None
+_openai_lock = threading.Lock()
+
+
+def openai_http_client() -> httpx.Client:
+    """Process-wide httpx client shared by every OpenAI and langchain client.
+
+    Its requests go through the upstream scheduler, which owns retries, so
+    clients using it should be created with max_retries=0.
+    """
+    global _openai_client
+    with _openai_lock:
+        if _openai_client is None:
+            limits = httpx.Limits(
+                max_connections=OPENAI_MAX_CONNECTIONS,
+                max_keepalive_connections=OPENAI_MAX_CONNECTIONS
+            )
+            _openai_client = httpx.Client(
+                timeout=httpx.Timeout(OPENAI_TIMEOUT, connect=5.0),
+                transport=ScheduledTransport("openai", httpx.HTTPTransport(limits=limits))
+            )
+        return _openai_client
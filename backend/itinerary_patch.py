@@ -0,0 +1,140 @@
+"""Itinerary edits as small lists of operations.
+
+Instead of re-emitting the whole itinerary for a one-stop change, the model
+returns operations that reference items by id:
+
+    {"op": "add", "item": {...}, "after": "3"}     # after null = at the start
+    {"op": "remove", "id": "4"}
+    {"op": "modify", "id": "2", "fields": {"time": "1:00 PM"}}
+    {"op": "move", "id": "5", "after": "1"}
+
+apply_patch() validates them against the itinerary and applies them in order.
+Added items and modified fields are checked against ITINERARY_ITEM_SCHEMA,
+like the items of a full rewrite.
+"""
+import copy
+from typing import Dict, List, Optional
+
+from llm_json import ITINERARY_ITEM_SCHEMA, Schema, validate_items
+
+OPERATIONS = ("add", "remove", "modify", "move")
+
+PATCH_OP_SCHEMA: Schema = {
+    "op": str,
+    "id?": str,
+    "after?": str,
+    "item?": dict,
+    "fields?": dict
+}
+
+
+# The item schema with every field optional, for checking modified fields
+ITEM_FIELDS_SCHEMA: Schema = {field.rstrip("?") + "?": expected for field, expected in ITINERARY_ITEM_SCHEMA.items()}
+
+
+class PatchError(ValueError):
+    """An operation can't be applied to the itinerary."""
+
+
+def _id(value) -> Optional[str]:
+    return None if value in (None, "") else str(value)
+
+
+def ensure_ids(itinerary: List[Dict]) -> List[Dict]:
+    """Give items without an id (or with a duplicate one) a fresh numeric id, in place."""
+    seen = set()
+    for item in itinerary:
+        item_id = _id(item.get("id"))
+        if item_id is None or item_id in seen:
+            item_id = next_id(itinerary, seen)
+        item["id"] = item_id
+        seen.add(item_id)
+    return itinerary
+
+
+def next_id(itinerary: List[Dict], taken=()) -> str:
+    numbers = [int(item_id) for item_id in {_id(item.get("id")) for item in itinerary} | set(taken)
+               if item_id is not None and item_id.isdigit()]
+    return str(max(numbers, default=0) + 1)
+
+
+def _position(itinerary: List[Dict], item_id: str) -> int:
+    for index, item in enumerate(itinerary):
+        if _id(item.get("id")) == item_id:
+            return index
+    raise PatchError(f"No item with id {item_id}")
+
+
+def _checked(item: Dict, schema: Schema) -> Dict:
+    """item coerced to schema; raises PatchError if any field is invalid."""
+    items, problems = validate_items([item], schema)
+    if problems:
+        raise PatchError(f"Invalid item: {'; '.join(problems)}")
+    return items[0]
+
+
+def _check_place(item: Dict):
+    if not (item.get("location") or item.get("address")):
+        raise PatchError(f"Item {item.get('id', '?')} needs a location or address")
+
+
+def _insert_after(itinerary: List[Dict], item: Dict, after: Optional[str]):
+    index = 0 if after is None else _position(itinerary, after) + 1
+    itinerary.insert(index, item)
+
+
+def apply_op(itinerary: List[Dict], op: Dict) -> List[Dict]:
+    """Apply one operation to itinerary in place."""
+    kind = op.get("op")
+    if kind not in OPERATIONS:
+        raise PatchError(f"Unknown operation {kind!r}")
+    item_id = _id(op.get("id"))
+    after = _id(op.get("after"))
+
+    if kind == "add":
+        item = op.get("item")
+        if not isinstance(item, dict):
+            raise PatchError("add needs an item")
+        item = _checked(item, ITINERARY_ITEM_SCHEMA)
+        _check_place(item)
+        if _id(item.get("id")) is None or any(_id(other.get("id")) == _id(item["id"]) for other in itinerary):
+            item["id"] = next_id(itinerary)
+        item["id"] = _id(item["id"])
+        _insert_after(itinerary, item, after)
+    elif item_id is None:
+        raise PatchError(f"{kind} needs an id")
+    elif kind == "remove":
+        del itinerary[_position(itinerary, item_id)]
+    elif kind == "modify":
+        fields = op.get("fields")
+        if not isinstance(fields, dict) or not fields:
+            raise PatchError("modify needs fields")
+        changes = {key: value for key, value in fields.items() if key != "id"}
+        required = [field for field in ITINERARY_ITEM_SCHEMA if not field.endswith("?")]
+        cleared = [field for field in required if field in changes and changes[field] in (None, "")]
+        if cleared:
+            raise PatchError(f"modify can't clear {', '.join(cleared)}")
+        index = _position(itinerary, item_id)
+        item = {**itinerary[index], **_checked(changes, ITEM_FIELDS_SCHEMA)}
+        _check_place(item)
+        itinerary[index] = item
+    elif kind == "move":
+        if after == item_id:
+            raise PatchError("Can't move an item after itself")
+        item = itinerary.pop(_position(itinerary, item_id))
+        _insert_after(itinerary, item, after)
+    return itinerary
+
+
+def apply_patch(itinerary: List[Dict], ops: List[Dict]) -> List[Dict]:
+    """Return a copy of itinerary with every operation applied.
+
+    Operations are validated as they are applied, each seeing the result of
+    the ones before it; any invalid operation raises PatchError and leaves
+    the original itinerary untouched.
+    """
+    patched = ensure_ids(copy.deepcopy(itinerary))
+    for op in ops:
+        apply_op(patched, op)
+    return patched
+
@@ -0,0 +1,83 @@
+import threading
+from concurrent.futures import Future
+from typing import Dict, List, Optional, Tuple
+
+from maps_service import MapsService
+
+_PENDING = object()
+
+
+class ItineraryPipeline:
+    """Geocodes items and fetches route legs while the itinerary is still being generated.
+
+    Each item added is geocoded right away. As soon as two consecutive
+    stops (ignoring stops that failed to geocode) both have coordinates,
+    the leg between them is fetched into the leg cache, so by the time the
+    model finishes only the last leg or two are left to fetch.
+    """
+
+    def __init__(self, maps_service: MapsService, prefetch_legs: bool = True):
+        self.maps_service = maps_service
+        self.prefetch_legs = prefetch_legs
+        self.items: List[Dict] = []
+        self._coordinates: List = []
+        self._legs: Dict[Tuple[str, str], Future] = {}
+        self._changed = threading.Condition()
+
+    def add(self, item: Dict) -> Future:
+        """Start geocoding item; the future yields (lat, lng) or None."""
+        with self._changed:
+            index = len(self.items)
+            self.items.append(item)
+            self._coordinates.append(_PENDING)
+            neighbors = self.maps_service._neighbor_claims(self.items, index)
+        future = self.maps_service.submit_resolve(item, neighbors)
+        future.add_done_callback(lambda done: self._resolved(index, done))
+        return future
+
+    def _resolved(self, index: int, future: Future):
+        try:
+            coordinates = future.result()
+        except Exception as e:
+            print(f"Error geocoding itinerary item {index}: {str(e)}")
+            coordinates = None
+        with self._changed:
+            self._coordinates[index] = coordinates
+            if self.prefetch_legs:
+                for pair in self._ready_legs():
+                    self._legs[pair] = self.maps_service.submit_leg(*pair)
+            self._changed.notify_all()
+
+    def _ready_legs(self) -> List[Tuple[str, str]]:
+        """Legs between resolved consecutive stops that haven't been requested yet."""
+        ready = []
+        previous = None
+        for coordinates in self._coordinates:
+            if coordinates is _PENDING:
+                previous = None
+            elif coordinates is not None:
+                waypoint = f"{coordinates[0]},{coordinates[1]}"
+                pair = (previous, waypoint)
+                if previous is not None and pair not in self._legs and pair not in ready:
+                    ready.append(pair)
+                previous = waypoint
+        return ready
+
+    def coordinates(self) -> List[Optional[tuple]]:
+        """Wait for every geocode and return the coordinates in item order."""
+        with self._changed:
+            self._changed.wait_for(lambda: all(c is not _PENDING for c in self._coordinates))
+            return list(self._coordinates)
+
+    def finish(self, **options) -> Dict:
+        """Wait for the geocodes and prefetched legs, then build the route data."""
+        coordinates = self.coordinates()
+        with self._changed:
+            legs = list(self._legs.values())
+        for leg in legs:
+            try:
+                leg.result()
+            except Exception as e:
+                # The route build fetches the leg again and reports the error
+                print(f"Error prefetching leg: {str(e)}")
+        return self.maps_service.get_route_data(self.items, coordinates, **options)
@@ -0,0 +1,72 @@
+import json
+from typing import Any, List
+
+
+class JSONArrayStream:
+    """Incremental parser for a JSON array of objects arriving in chunks.
+
+    feed() returns the top-level objects completed by each chunk, so callers
+    can act on the first itinerary item long before the model has finished
+    the whole array. Text before the opening bracket (prose, markdown fences)
+    is ignored.
+    """
+
+    def __init__(self):
+        self._buffer = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._item_start = None
+        self.started = False
+        self.finished = False
+        self.items: List[Any] = []
+
+    def feed(self, chunk: str) -> List[Any]:
+        completed = []
+        if self.finished or not chunk:
+            return completed
+        self._buffer += chunk
+        while self._pos < len(self._buffer):
+            char = self._buffer[self._pos]
+            self._pos += 1
+            if not self.started:
+                if char == "[":
+                    self.started = True
+                    self._depth = 1
+                continue
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+                continue
+            if char == '"':
+                self._in_string = True
+            elif char in "[{":
+                if self._depth == 1:
+                    self._item_start = self._pos - 1
+                self._depth += 1
+            elif char in "]}":
+                self._depth -= 1
+                if self._depth == 1 and self._item_start is not None:
+                    text = self._buffer[self._item_start:self._pos]
+                    self._item_start = None
+                    try:
+                        item = json.loads(text)
+                    except json.JSONDecodeError:
+                        continue
+                    self.items.append(item)
+                    completed.append(item)
+                elif self._depth == 0:
+                    self.finished = True
+                    break
+        # Keep only the part of the buffer that can still belong to an item
+        keep_from = self._item_start if self._item_start is not None else self._pos
+        self._buffer = self._buffer[keep_from:]
+        self._pos -= keep_from
+        if self._item_start is not None:
+            self._item_start = 0
+        return completed
@@ -1,11 +1,22 @@
-from openai import OpenAI
+from openai import BadRequestError, OpenAI
 from dotenv import load_dotenv
 import os
 import json
+from suggestion_cache import create_suggestion_cache
+from http_clients import openai_http_client
+from llm_json import SUGGESTION_SCHEMA, parse_with_repair
+from schemas import SUGGESTIONS_TOOL, structured_output_enabled, tool_arguments, tool_choice, tools_unsupported
+from singleflight import SingleFlight
 
 load_dotenv()
 
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"), http_client=openai_http_client(), max_retries=0)
+
+# Suggestions are generated at temperature 0, so identical (or, with the
+# semantic tier on, paraphrased) questions on a route can reuse the answer.
+suggestion_cache = create_suggestion_cache()
+# Identical questions asked while the first is still being answered wait for it
+suggestion_flights = SingleFlight()
 
 system_prompt = """You are a trip assistant helping a traveler find places along their route or near their location. When suggesting places, consider:
 - The type of place the user is looking for
@@ -31,75 +42,125 @@ Example response format:
 ]
 """
 
+places_guidance = """
+You are a trip assistant helping a traveler find places along their route or near their location. When suggesting places, consider:
+- The type of place the user is looking for
+- The maximum travel time if specified
+= type of request if looking for food, gas, etc. look for places that are close by user location for less time relevant requests you can look further
+= if looking for a route, look for places along the route
+- look at places that have good reviews and are popular
+- cost of the place the user want to visit
+- The current location or route
+- Relevance to the user's needs
+Try to find 3 different places.
+"""
+
+# Only needed when the model can't be given SUGGESTIONS_TOOL
+places_format = """
+You must return a JSON array of place suggestions. Each place must be a dictionary with exactly these keys:
+- "name": string, the name of the place
+- "category": string, type of place (e.g., restaurant, landmark, gas station)
+- "address": string, address of the place
+- "estimated_time_minutes": integer, estimated travel time in minutes
+- "description": string, brief description of the place
+- "worth_visiting": string, explanation of why it's worth visiting
+Your response must be valid JSON that can be parsed. Do not include any text outside the JSON array.
+Example response format:
+[
+    {
+        "name": "Sample Place",
+        "category": "restaurant",
+        "estimated_time_minutes": 15,
+        "address": "123 Sample St, Sample City, ST 12345",
+        "description": "A cozy Italian restaurant",
+        "worth_visiting": "Known for authentic pasta and great atmosphere"
+    }
+]
+"""
+
+_structured_places = structured_output_enabled()
+
+def _complete_places(prompt):
+    """Ask for place suggestions; returns the text holding the JSON array.
+
+    Uses the suggest_places tool when structured output is on, falling back
+    to the prose format for models that reject tool calls.
+    """
+    global _structured_places
+    if _structured_places:
+        try:
+            response = client.chat.completions.create(
+                model="gpt-4o-mini",
+                messages=[
+                    {"role": "system", "content": places_guidance},
+                    {"role": "user", "content": prompt}
+                ],
+                tools=[SUGGESTIONS_TOOL],
+                tool_choice=tool_choice(SUGGESTIONS_TOOL),
+                temperature=0.0,
+                max_tokens=500
+            )
+            message = response.choices[0].message
+            return tool_arguments(message) or message.content or ""
+        except BadRequestError as e:
+            if not tools_unsupported(e):
+                raise
+            print(f"Structured output unavailable, using prose prompts: {str(e)}")
+            _structured_places = False
+    response = client.chat.completions.create(
+        model="gpt-4o-mini",
+        messages=[
+            {"role": "system", "content": places_guidance + places_format},
+            {"role": "user", "content": prompt}
+        ],
+        temperature=0.0,
+        max_tokens=500
+    )
+    return response.choices[0].message.content
+
 def parse_user_input(data):
     try:
-        start = data.get("start", "unknown location")
-        end = data.get("end", "unknown location")
-        stops = data.get("stops","unknown location")
-        message = data.get("message", "")
-        system_prompt = """
-        You are a trip assistant helping a traveler find places along their route or near their location. When suggesting places, consider:
-        - The type of place the user is looking for
-        - The maximum travel time if specified
-        = type of request if looking for food, gas, etc. look for places that are close by user location for less time relevant requests you can look further
-        = if looking for a route, look for places along the route
-        - look at places that have good reviews and are popular
-        - cost of the place the user want to visit
-        - The current location or route
-        - Relevance to the user's needs
-        You must return a JSON array of place suggestions. Try to find 3 different places. Each place must be a dictionary with exactly these keys:
-        - "name": string, the name of the place
-        - "category": string, type of place (e.g., restaurant, landmark, gas station)
-        - "address": string, address of the place
-        - "estimated_time_minutes": integer, estimated travel time in minutes
-        - "description": string, brief description of the place
-        - "worth_visiting": string, explanation of why it's worth visiting
-        Your response must be valid JSON that can be parsed. Do not include any text outside the JSON array.
-        Example response format:
-        [
-            {
-                "name": "Sample Place",
-                "category": "restaurant",
-                "estimated_time_minutes": 15,
-                "address": "123 Sample St, Sample City, ST 12345",
-                "description": "A cozy Italian restaurant",
-                "worth_visiting": "Known for authentic pasta and great atmosphere"
-            }
-        ]
-        """
-        prompt = f"I am driving from {start} to {end}, with {stops} on the way. I want to know if {message}"
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.0,
-            max_tokens=500
-        )
-        suggestions = parse_llm_response(response.choices[0].message.content)
+        cached = suggestion_cache.get(data)
+        if cached is not None:
+            return {"success": True, "suggestions": cached}
+
+        suggestions = suggestion_flights.do(suggestion_cache.make_key(data), _suggest, data)
         return {"success": True, "suggestions": suggestions}
     except Exception as e:
         print(f"Error in suggest_stops: {str(e)}")
         return {"success": False, "error": "Failed to generate suggestions", "details": str(e)}
     
 
+def _suggest(data):
+    start = data.get("start", "unknown location")
+    end = data.get("end", "unknown location")
+    stops = data.get("stops","unknown location")
+    message = data.get("message", "")
+    prompt = f"I am driving from {start} to {end}, with {stops} on the way. I want to know if {message}"
+    known = [
+        {"name": place.get("name"), "category": place.get("category"), "address": place.get("address")}
+        for place in data.get("known_places") or []
+    ]
+    if known:
+        prompt += f"\nPlaces already known to be near the route, to suggest if they fit the request: {json.dumps(known)}"
+    suggestions = parse_llm_response(_complete_places(prompt))
+    suggestion_cache.set(data, suggestions)
+    return suggestions
+
+def _repair(prompt):
+    response = client.chat.completions.create(
+        model=os.getenv("REPAIR_MODEL", "gpt-4o-mini"),
+        messages=[{"role": "user", "content": prompt}],
+        temperature=0.0,
+        max_tokens=700
+    )
+    return response.choices[0].message.content
+
 def parse_llm_response(response_text):
+    """Extract the suggestions from a model reply; raises ValueError if none are usable."""
     try:
-        suggestions = json.loads(response_text)
-        required_keys = {"name", "category", "estimated_time_minutes", "address", "description", "worth_visiting"}
-        
-        if not isinstance(suggestions, list):
-            raise ValueError("Response is not a list")
-        for suggestion in suggestions:
-            if not isinstance(suggestion, dict):
-                raise ValueError("Suggestion is not a dictionary")
-            if not all(key in suggestion for key in required_keys):
-                raise ValueError(f"Suggestion missing required keys: {required_keys - set(suggestion.keys())}")
-        return suggestions
-    except json.JSONDecodeError:
-        raise ValueError("Failed to parse response as JSON")
-    except Exception as e:
+        return parse_with_repair(response_text, _repair, SUGGESTION_SCHEMA)
+    except ValueError as e:
         raise ValueError(f"Error parsing response: {str(e)}")
 
 def suggest_stops(data):
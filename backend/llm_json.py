@@ -0,0 +1,234 @@
+"""Extraction of JSON arrays from LLM output.
+
+Models wrap JSON in markdown fences, add prose around it, leave trailing
+commas or get cut off by max_tokens. parse_json_array() copes with all of
+these and validates each item against a small schema; parse_with_repair()
+additionally gives a cheap model one chance to fix output that still
+can't be used.
+"""
+import json
+import re
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from json_stream import JSONArrayStream
+
+# Field name -> expected type; "?" suffix marks an optional field
+Schema = Dict[str, type]
+
+ITINERARY_ITEM_SCHEMA: Schema = {
+    "id?": str,
+    "type?": str,
+    "title?": str,
+    "description": str,
+    "address?": str,
+    "location?": str,
+    "time?": str,
+    "duration?": str
+}
+
+SUGGESTION_SCHEMA: Schema = {
+    "name": str,
+    "category": str,
+    "address": str,
+    "estimated_time_minutes": int,
+    "description": str,
+    "worth_visiting": str
+}
+
+
+class LLMJSONError(ValueError):
+    """The text holds no usable JSON array."""
+
+
+def strip_fences(text: str) -> str:
+    """Return the contents of the first ``` fenced block, or text unchanged."""
+    match = re.search(r"```[\w-]*\s*\n?(.*?)(```|$)", text, re.DOTALL)
+    return match.group(1) if match else text
+
+
+def _remove_trailing_commas(text: str) -> str:
+    out = []
+    in_string = escaped = False
+    for char in text:
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in "]}":
+            # Drop a comma (and whitespace) right before a closing bracket
+            while out and out[-1].isspace():
+                out.pop()
+            if out and out[-1] == ",":
+                out.pop()
+        out.append(char)
+    return "".join(out)
+
+
+def _unwrap(value: Any) -> Optional[List]:
+    """Accept an array, an object wrapping one array, or a single item object."""
+    if isinstance(value, list):
+        return value
+    if isinstance(value, dict):
+        lists = [item for item in value.values() if isinstance(item, list)]
+        if len(lists) == 1:
+            return lists[0]
+        return [value]
+    return None
+
+
+def extract_array(text: str) -> Tuple[List, bool]:
+    """Pull the outermost JSON array out of model output.
+
+    Returns (items, truncated), where truncated is True if the array was
+    cut off and only its complete items were kept.
+    """
+    text = _remove_trailing_commas(strip_fences(text or "").strip())
+    try:
+        items = _unwrap(json.loads(text))
+        if items is not None:
+            return items, False
+    except json.JSONDecodeError:
+        pass
+
+    start = text.find("[")
+    brace = text.find("{")
+    if start == -1 or (brace != -1 and brace < start):
+        # An object (possibly wrapping the array) comes first
+        end = text.rfind("}")
+        if brace != -1 and end > brace:
+            try:
+                items = _unwrap(json.loads(text[brace:end + 1]))
+                if items is not None:
+                    return items, False
+            except json.JSONDecodeError:
+                pass
+        if start == -1:
+            raise LLMJSONError("No JSON array found in response")
+
+    parser = JSONArrayStream()
+    parser.feed(text[start:])
+    if not parser.items:
+        raise LLMJSONError("No complete items found in response")
+    return parser.items, not parser.finished
+
+
+def _coerce(value: Any, expected: type) -> Any:
+    if isinstance(value, expected) and not (expected is int and isinstance(value, bool)):
+        return value
+    if expected is str and isinstance(value, (int, float)):
+        return str(value)
+    if expected is str:
+        # Coordinates given as {"lat", "lng"} or [lat, lng] become "lat,lng"
+        if isinstance(value, dict) and "lat" in value and ("lng" in value or "lon" in value):
+            value = [value["lat"], value.get("lng", value.get("lon"))]
+        if isinstance(value, (list, tuple)) and len(value) == 2 \
+                and all(isinstance(part, (int, float)) and not isinstance(part, bool) for part in value):
+            return f"{value[0]},{value[1]}"
+    if expected is int:
+        if isinstance(value, float):
+            return int(round(value))
+        match = re.search(r"\d+", str(value)) if isinstance(value, str) else None
+        if match:
+            return int(match.group())
+    raise ValueError(f"expected {expected.__name__}, got {type(value).__name__}")
+
+
+def validate_items(items: List, schema: Schema) -> Tuple[List[Dict], List[str]]:
+    """Check each item against schema, coercing simple type mismatches.
+
+    Returns (valid items, problems). Items with a bad required field are
+    left out; a bad optional field is only dropped from its item.
+    """
+    valid, problems = [], []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            problems.append(f"item {index} is not an object")
+            continue
+        item = dict(item)
+        errors = []
+        for field, expected in schema.items():
+            name = field.rstrip("?")
+            if name not in item or item[name] is None:
+                if not field.endswith("?"):
+                    errors.append(f"missing {name}")
+                continue
+            try:
+                item[name] = _coerce(item[name], expected)
+            except ValueError as e:
+                if field.endswith("?"):
+                    problems.append(f"item {index}: dropped {name} ({e})")
+                    del item[name]
+                else:
+                    errors.append(f"{name}: {e}")
+        if errors:
+            problems.append(f"item {index}: {', '.join(errors)}")
+        else:
+            valid.append(item)
+    return valid, problems
+
+
+def parse_json_array(
+    text: str,
+    schema: Optional[Schema] = None,
+    check: Optional[Callable[[Dict], Optional[str]]] = None
+) -> List[Dict]:
+    """Extract, repair and validate a JSON array of items from model output.
+
+    check can reject items the schema can't express by returning a
+    problem string. Raises LLMJSONError if no valid item is left.
+    """
+    items, truncated = extract_array(text)
+    problems = []
+    if schema is not None:
+        items, problems = validate_items(items, schema)
+    if check is not None:
+        checked = []
+        for item in items:
+            problem = check(item)
+            if problem:
+                problems.append(problem)
+            else:
+                checked.append(item)
+        items = checked
+    if problems:
+        print(f"Dropped invalid items or fields from LLM response: {'; '.join(problems)}")
+    if truncated:
+        print(f"LLM response was truncated; kept {len(items)} complete items")
+    if not items:
+        raise LLMJSONError("; ".join(problems) or "Response contains no items")
+    return items
+
+
+REPAIR_PROMPT = """The following output was supposed to be a JSON array of objects with the fields {fields}, but it could not be used ({error}).
+Return only the corrected JSON array, with no other text.
+
+{text}"""
+
+
+def repair_prompt(text: str, error: str, schema: Optional[Schema] = None) -> str:
+    fields = ", ".join(field.rstrip("?") for field in schema) if schema else "of the original request"
+    return REPAIR_PROMPT.format(fields=fields, error=error, text=text)
+
+
+def parse_with_repair(
+    text: str,
+    repair: Callable[[str], str],
+    schema: Optional[Schema] = None,
+    check: Optional[Callable[[Dict], Optional[str]]] = None
+) -> List[Dict]:
+    """parse_json_array, retrying once on repair(prompt)'s answer if it fails."""
+    try:
+        return parse_json_array(text, schema, check)
+    except LLMJSONError as e:
+        print(f"Repairing LLM response: {e}")
+        try:
+            repaired = repair(repair_prompt(text, str(e), schema))
+        except Exception as repair_error:
+            print(f"Error repairing LLM response: {str(repair_error)}")
+            raise e
+        return parse_json_array(repaired, schema, check)
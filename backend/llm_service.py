@@ -7,29 +7,60 @@ from langchain_openai import ChatOpenAI, OpenAIEmbeddings
 from langchain_community.chat_models import ChatOllama
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_community.vectorstores import FAISS
-from langchain.memory import ConversationBufferMemory
 
+import copy
 import os
 import json
-from typing import List, Dict, Optional
+import openai
+from itertools import chain
+from typing import Iterator, List, Dict, Optional, Tuple
+
+from http_clients import openai_http_client
+from chat_history import ChatHistory, compact_itinerary, restore_fields
+from json_stream import JSONArrayStream
+from llm_json import ITINERARY_ITEM_SCHEMA, LLMJSONError, extract_array, parse_with_repair, validate_items
+from itinerary_patch import PATCH_OP_SCHEMA, PatchError, apply_patch, ensure_ids
+from schemas import ITINERARY_TOOL, PATCH_TOOL, structured_output_enabled, tool_arguments, tool_choice, tools_unsupported
+from vector_index import HashingEmbedder, ItineraryIndex
+
+
+def _check_place(item: Dict) -> Optional[str]:
+    if not item.get("location") and not item.get("address"):
+        return f"item {item.get('id', '?')}: missing location and address"
 
 
 class LLMService:
-    def __init__(self):
-        self.llm = ChatOpenAI(
+    def __init__(self, llm=None, embeddings=None, max_history_turns: Optional[int] = None, repair_llm=None):
+        # Sessions share the model and embeddings clients and only keep their own state
+        self.llm = llm or ChatOpenAI(
             model="gpt-4",
             temperature=0.7,
-            api_key=os.getenv("OPENAI_API_KEY")
+            api_key=os.getenv("OPENAI_API_KEY"),
+            http_client=openai_http_client(),
+            max_retries=0
         )
-        self.output_parser = StrOutputParser()
-        self.embeddings = OpenAIEmbeddings()
-        self.memory = ConversationBufferMemory(
-            memory_key="chat_history",
-            return_messages=True
+        # Cheap model given one chance to fix unparseable output
+        self.repair_llm = repair_llm or ChatOpenAI(
+            model=os.getenv("REPAIR_MODEL", "gpt-4o-mini"),
+            temperature=0,
+            api_key=os.getenv("OPENAI_API_KEY"),
+            http_client=openai_http_client(),
+            max_retries=0
         )
+        self.output_parser = StrOutputParser()
+        if embeddings is None:
+            embeddings = HashingEmbedder() if os.getenv("EMBEDDINGS_PROVIDER") == "local" else OpenAIEmbeddings(http_client=openai_http_client(), max_retries=0)
+        self.embeddings = embeddings
+        self.history = ChatHistory(keep_turns=max_history_turns)
         self.current_itinerary = None
-        self.vector_store = None
+        self.vector_index = None
+        if os.getenv("VECTOR_INDEX_ENABLED", "true").lower() != "false":
+            self.vector_index = ItineraryIndex(self.embeddings)
+        # Structured mode has the model call ITINERARY_TOOL instead of
+        # following a format described in the prompt
+        self.structured_output = structured_output_enabled()
+        # Patch mode asks for a few edit operations instead of the whole itinerary
+        self.patch_updates = os.getenv("ITINERARY_UPDATE_MODE", "patch").lower() == "patch"
 
         self.itinerary_template = """
         You are a travel planning assistant. Create a detailed itinerary based on the following request:
@@ -38,7 +69,9 @@ class LLMService:
         Start Location: {start_location}
         End Location: {end_location}
         Current Location: {current_location}
-        
+        """
+
+        self.itinerary_format = """
         Generate a JSON array of itinerary items. Each item should have:
         - id: unique identifier
         - type: activity type (e.g., "transportation", "attraction", "food", "accommodation")
@@ -68,66 +101,304 @@ class LLMService:
         4. If removing activities, maintain the flow and timing of the remaining activities
         5. If modifying times, only adjust the affected activities and maintain the overall schedule
         6. Preserve all IDs, types, and other metadata for unchanged activities
-        
+        """
+
+        self.update_format = """
         Return the updated itinerary as a JSON array with the same structure.
         Make sure to maintain the same format and include all required fields.
         """
 
+        self.patch_format = """
+        Do not repeat the itinerary. Return only the changes, as a JSON array of operations:
+        - {{"op": "add", "item": {{...new item with the usual fields...}}, "after": "<id>"}} (no "after" adds it first)
+        - {{"op": "remove", "id": "<id>"}}
+        - {{"op": "modify", "id": "<id>", "fields": {{...only the changed fields...}}}}
+        - {{"op": "move", "id": "<id>", "after": "<id>"}}
+        Return an empty array if nothing needs to change.
+        """
+
+        self.structured_patch_format = """
+        Call edit_itinerary with only the operations needed; do not repeat unchanged items.
+        """
+
+        self.structured_format = """
+        Call save_itinerary with the complete itinerary. Give every item a full street address.
+        """
+
     def _update_vector_store(self, itinerary: List[Dict]):
-        """Update the vector store with the current itinerary"""
-        if itinerary:
-            # Convert itinerary to text for embedding
-            itinerary_text = json.dumps(itinerary, indent=2)
-            # Create or update vector store
-            self.vector_store = FAISS.from_texts([itinerary_text], self.embeddings)
-            self.current_itinerary = itinerary
-        else:
-            self.vector_store = None
-            self.current_itinerary = None
+        """Track the current itinerary and queue changed items for embedding"""
+        self.current_itinerary = itinerary or None
+        if self.vector_index is not None:
+            # Only new or changed items are embedded, off the request path
+            self.vector_index.update(itinerary)
 
-    def generate_itinerary(
+    def search_itinerary(self, query: str, k: int = 3) -> List[Dict]:
+        """Return the itinerary items most relevant to query"""
+        if self.vector_index is None:
+            return []
+        return self.vector_index.search(query, k)
+
+    def _itinerary_values(
         self,
         user_request: str,
         start_location: Optional[str] = None,
         end_location: Optional[str] = None,
         current_location: Optional[Dict] = None
-    ) -> List[Dict]:
-        # Clear memory if this is a new itinerary request
+    ) -> Dict:
+        # Clear history if this is a new itinerary request
         if not self.current_itinerary:
-            self.memory.clear()
-        
-        prompt = ChatPromptTemplate.from_template(self.itinerary_template)
-        messages = prompt.format_messages(
-            user_request=user_request,
-            start_location=start_location or "Not specified",
-            end_location=end_location or "Not specified",
-            current_location=json.dumps(current_location) if current_location else "Not specified"
+            self.history.clear()
+
+        values = self._format_itinerary_values(user_request, start_location, end_location, current_location)
+
+        # Add to history
+        self.history.add_turn(user_request, "Generating new itinerary")
+        return values
+
+    def _format_itinerary_values(
+        self,
+        user_request: str,
+        start_location: Optional[str] = None,
+        end_location: Optional[str] = None,
+        current_location: Optional[Dict] = None
+    ) -> Dict:
+        return {
+            "user_request": user_request,
+            "start_location": start_location or "Not specified",
+            "end_location": end_location or "Not specified",
+            "current_location": json.dumps(current_location) if current_location else "Not specified"
+        }
+
+    def _messages(self, template: str, prose_format: str, values: Dict, structured: bool, structured_format=None):
+        prompt = ChatPromptTemplate.from_template(
+            template + ((structured_format or self.structured_format) if structured else prose_format)
         )
-        
-        # Add to memory
-        self.memory.save_context({"input": user_request}, {"output": "Generating new itinerary"})
-        
-        response = self.llm.invoke(messages)
-        text = response.content if hasattr(response, 'content') else str(response)
+        return prompt.format_messages(**values)
+
+    def _structured_llm(self, tool: Dict = ITINERARY_TOOL):
+        return self.llm.bind_tools([tool], tool_choice=tool_choice(tool))
+
+    def _disable_structured_output(self, error: Exception):
+        print(f"Structured output unavailable, using prose prompts: {str(error)}")
+        self.structured_output = False
+
+    def _response_text(self, response, structured: bool) -> str:
+        if structured:
+            arguments = tool_arguments(response)
+            if arguments:
+                return arguments
+        return response.content if hasattr(response, 'content') else str(response)
+
+    def _complete(
+        self,
+        template: str,
+        prose_format: str,
+        values: Dict,
+        tool: Dict = ITINERARY_TOOL,
+        structured_format: Optional[str] = None
+    ) -> str:
+        """Run a prompt and return the text holding the JSON array.
+
+        In structured mode that's the arguments of the model's call to
+        tool. Models without tool calling switch this service to prose
+        mode, where the format is described in the prompt.
+        """
+        if self.structured_output:
+            try:
+                messages = self._messages(template, prose_format, values, True, structured_format)
+                response = self._structured_llm(tool).invoke(messages)
+                return self._response_text(response, True)
+            except (NotImplementedError, openai.BadRequestError) as e:
+                if not tools_unsupported(e):
+                    raise
+                self._disable_structured_output(e)
+        response = self.llm.invoke(self._messages(template, prose_format, values, False))
+        return self._response_text(response, False)
+
+    def _repair(self, prompt: str) -> str:
+        response = self.repair_llm.invoke(prompt)
+        return response.content if hasattr(response, 'content') else str(response)
+
+    def _parse_itinerary(self, text: str) -> List[Dict]:
+        """Extract and validate itinerary items, asking the repair model once if needed.
+
+        Raises LLMJSONError if nothing usable comes back.
+        """
+        items = parse_with_repair(text, self._repair, ITINERARY_ITEM_SCHEMA, _check_place)
+        for index, item in enumerate(items):
+            item.setdefault("id", str(index + 1))
+        return items
+
+    def _check_streamed_item(self, item, index: int) -> Optional[Dict]:
+        """Apply _parse_itinerary's checks to one streamed item; None if it can't be used."""
+        items, problems = validate_items([item], ITINERARY_ITEM_SCHEMA)
+        if items:
+            problem = _check_place(items[0])
+            if problem:
+                problems.append(problem)
+                items = []
+        if problems:
+            print(f"Streamed item {index}: {'; '.join(problems)}")
+        if not items:
+            return None
+        items[0].setdefault("id", str(index + 1))
+        return items[0]
+
+    def _fallback_itinerary(self) -> List[Dict]:
+        return [
+            {
+                "id": "1",
+                "type": "attraction",
+                "title": "Sample Activity",
+                "description": "A sample activity for your trip",
+                "location": "Times Square, New York, NY",
+                "time": "10:00 AM",
+                "duration": "2 hours"
+            }
+        ]
+
+    def generate_itinerary(
+        self,
+        user_request: str,
+        start_location: Optional[str] = None,
+        end_location: Optional[str] = None,
+        current_location: Optional[Dict] = None
+    ) -> List[Dict]:
+        values = self._itinerary_values(user_request, start_location, end_location, current_location)
+        text = self._complete(self.itinerary_template, self.itinerary_format, values)
         
         try:
-            itinerary = json.loads(text)
+            itinerary = self._parse_itinerary(text)
             self._update_vector_store(itinerary)
             return itinerary
-        except json.JSONDecodeError as e:
+        except LLMJSONError as e:
             print(f"Error parsing LLM response: {e}")
             print(f"Raw response: {text}")
-            return [
-                {
-                    "id": "1",
-                    "type": "attraction",
-                    "title": "Sample Activity",
-                    "description": "A sample activity for your trip",
-                    "location": "Times Square, New York, NY",
-                    "time": "10:00 AM",
-                    "duration": "2 hours"
-                }
-            ]
+            return self._fallback_itinerary()
+
+    def generate_itinerary_batch(
+        self,
+        trips: List[Dict],
+        max_concurrency: Optional[int] = None
+    ) -> Iterator[Tuple[int, Dict]]:
+        """Generate itineraries for many independent trips at once.
+
+        Each trip is a dict with user_request and optional start_location,
+        end_location and current_location. At most max_concurrency LLM calls
+        (BATCH_CONCURRENCY, default 8) run at a time. Yields (index, result)
+        in completion order, where result is {"itinerary": [...]} or
+        {"error": "..."}. Batch trips don't touch this session's history or
+        current itinerary.
+        """
+        if max_concurrency is None:
+            max_concurrency = int(os.getenv("BATCH_CONCURRENCY", 8))
+        indexes = []
+        values = []
+        for index, trip in enumerate(trips):
+            if not isinstance(trip, dict) or not trip.get("user_request"):
+                yield index, {"error": "user_request is required"}
+                continue
+            indexes.append(index)
+            values.append(self._format_itinerary_values(
+                trip["user_request"],
+                trip.get("start_location"),
+                trip.get("end_location"),
+                trip.get("current_location")
+            ))
+        if not values:
+            return
+
+        structured = self.structured_output
+        model = self.llm
+        if structured:
+            try:
+                model = self._structured_llm()
+            except NotImplementedError as e:
+                self._disable_structured_output(e)
+                structured = False
+        inputs = [
+            self._messages(self.itinerary_template, self.itinerary_format, trip_values, structured)
+            for trip_values in values
+        ]
+        for position, response in model.batch_as_completed(
+            inputs, config={"max_concurrency": max_concurrency}, return_exceptions=True
+        ):
+            index = indexes[position]
+            if structured and isinstance(response, openai.BadRequestError) and tools_unsupported(response):
+                # This model can't call tools; redo the trip with the prose prompt
+                self._disable_structured_output(response)
+                try:
+                    response = self.llm.invoke(
+                        self._messages(self.itinerary_template, self.itinerary_format, values[position], False)
+                    )
+                except Exception as e:
+                    response = e
+            if isinstance(response, Exception):
+                print(f"Error generating itinerary {index}: {str(response)}")
+                yield index, {"error": f"Failed to generate itinerary: {str(response)}"}
+                continue
+            text = self._response_text(response, structured)
+            try:
+                itinerary = self._parse_itinerary(text)
+            except LLMJSONError as e:
+                print(f"Error parsing LLM response for itinerary {index}: {e}")
+                yield index, {"error": "Could not parse the generated itinerary"}
+                continue
+            yield index, {"itinerary": itinerary}
+
+    def _stream_text(self, template: str, prose_format: str, values: Dict) -> Iterator[str]:
+        """Yield the itinerary text as it arrives; tool call arguments in structured mode."""
+        if self.structured_output:
+            try:
+                # Tool-calling errors surface on the first chunk, before anything is yielded
+                chunks = iter(self._structured_llm().stream(self._messages(template, prose_format, values, True)))
+                first = next(chunks, None)
+            except (NotImplementedError, openai.BadRequestError) as e:
+                if not tools_unsupported(e):
+                    raise
+                self._disable_structured_output(e)
+            else:
+                for chunk in chain([first] if first is not None else [], chunks):
+                    arguments = "".join(call.get("args") or "" for call in getattr(chunk, "tool_call_chunks", []))
+                    yield arguments or tool_arguments(chunk) or chunk.content
+                return
+        for chunk in self.llm.stream(self._messages(template, prose_format, values, False)):
+            yield chunk.content if hasattr(chunk, 'content') else str(chunk)
+
+    def stream_itinerary(
+        self,
+        user_request: str,
+        start_location: Optional[str] = None,
+        end_location: Optional[str] = None,
+        current_location: Optional[Dict] = None
+    ) -> Iterator[Dict]:
+        """Generate an itinerary, yielding each item as soon as the model completes it."""
+        values = self._itinerary_values(user_request, start_location, end_location, current_location)
+        parser = JSONArrayStream()
+        text = ""
+        itinerary = []
+        for content in self._stream_text(self.itinerary_template, self.itinerary_format, values):
+            text += content
+            for item in parser.feed(content):
+                item = self._check_streamed_item(item, len(itinerary))
+                if item is not None:
+                    itinerary.append(item)
+                    yield item
+
+        if not itinerary:
+            # Nothing usable streamed out (e.g. an object wrapper); parse the
+            # whole text instead, with the repair model's help if needed
+            try:
+                itinerary = self._parse_itinerary(text)
+            except LLMJSONError as e:
+                print(f"Error parsing streamed LLM response: {e}")
+                print(f"Raw response: {text}")
+                for item in self._fallback_itinerary():
+                    yield item
+                return
+            for item in itinerary:
+                yield item
+        self._update_vector_store(itinerary)
 
     def update_itinerary(
         self,
@@ -135,23 +406,33 @@ class LLMService:
         current_itinerary: List[Dict]
     ) -> List[Dict]:
         if not self.current_itinerary:
-            return self.generate_itinerary(user_request)
+            if not current_itinerary:
+                return self.generate_itinerary(user_request)
+            # A new or evicted session edits the itinerary the client sent
+            self.current_itinerary = current_itinerary
             
-        # Add to memory
-        self.memory.save_context({"input": user_request}, {"output": "Updating itinerary"})
-        
-        prompt = ChatPromptTemplate.from_template(self.update_template)
-        messages = prompt.format_messages(
-            user_request=user_request,
-            current_itinerary=json.dumps(current_itinerary),
-            chat_history=self.memory.buffer
-        )
+        # Add to history
+        self.history.add_turn(user_request, "Updating itinerary")
+
+        if self.patch_updates:
+            # Items need ids for the operations to refer to
+            current_itinerary = ensure_ids(copy.deepcopy(current_itinerary))
+            updated_itinerary = self._patch_itinerary(user_request, current_itinerary)
+            if updated_itinerary is not None:
+                self._update_vector_store(updated_itinerary)
+                return updated_itinerary
+        else:
+            # Ids let fields left out of the prompt be restored afterwards
+            current_itinerary = ensure_ids(copy.deepcopy(current_itinerary))
         
-        response = self.llm.invoke(messages)
-        text = response.content if hasattr(response, 'content') else str(response)
+        text = self._complete(self.update_template, self.update_format, {
+            "user_request": user_request,
+            "current_itinerary": compact_itinerary(current_itinerary),
+            "chat_history": self.history.render()
+        })
         
         try:
-            updated_itinerary = json.loads(text)
+            updated_itinerary = restore_fields(current_itinerary, self._parse_itinerary(text))
             # Verify that only requested changes were made
             if len(updated_itinerary) != len(current_itinerary):
                 print("Warning: Itinerary length changed unexpectedly")
@@ -166,15 +447,38 @@ class LLMService:
             
             self._update_vector_store(updated_itinerary)
             return updated_itinerary
-        except json.JSONDecodeError as e:
+        except LLMJSONError as e:
             print(f"Error parsing LLM response: {e}")
             print(f"Raw response: {text}")
             return current_itinerary
 
+    def _patch_itinerary(self, user_request: str, current_itinerary: List[Dict]) -> Optional[List[Dict]]:
+        """Ask the model for edit operations and apply them.
+
+        Returns None if the operations can't be parsed or applied, so the
+        caller can fall back to a full rewrite. Unchanged items keep their
+        exact content, so their geocodes and route legs stay cached.
+        """
+        text = self._complete(self.update_template, self.patch_format, {
+            "user_request": user_request,
+            "current_itinerary": compact_itinerary(current_itinerary),
+            "chat_history": self.history.render()
+        }, tool=PATCH_TOOL, structured_format=self.structured_patch_format)
+        try:
+            items, _ = extract_array(text)
+            ops, problems = validate_items(items, PATCH_OP_SCHEMA)
+            if problems:
+                raise PatchError("; ".join(problems))
+            return apply_patch(current_itinerary, ops)
+        except (LLMJSONError, PatchError) as e:
+            print(f"Could not apply itinerary patch, rewriting the itinerary instead: {e}")
+            print(f"Raw response: {text}")
+            return None
+
     def clear_itinerary(self):
-        """Clear the current itinerary and memory"""
+        """Clear the current itinerary and chat history"""
         self._update_vector_store(None)
-        self.memory.clear()
+        self.history.clear()
         return []
 
 
@@ -1,16 +1,124 @@
 import os
 import googlemaps
+import numpy as np
+import threading
+from concurrent.futures import Future
 from typing import Dict, List, Optional, Union
 from geopy.geocoders import Nominatim
-from geopy.exc import GeocoderTimedOut
+from cache import LRUCache
+from geocode_cache import GeocodeCache
+from rate_limiter import TokenBucket
+from route_cache import DirectionsCache, quantize_location
+from singleflight import SingleFlight
+from upstream_scheduler import ContextThreadPoolExecutor
+import geometry
+import http_clients
+import coordinate_trust
+import geocoder
+import route_optimizer
+import routing
 
 class MapsService:
-    def __init__(self):
+    def __init__(
+        self,
+        geocode_cache: Optional[GeocodeCache] = None,
+        directions_cache: Optional[DirectionsCache] = None,
+        router=None
+    ):
         api_key = os.getenv("GOOGLE_MAPS_KEY")
         if not api_key:
             raise ValueError("Google Maps API key not found in environment variables")
-        self.gmaps = googlemaps.Client(key=api_key)
-        self.geolocator = Nominatim(user_agent="trip_planner")
+        # Reuse the shared keep-alive pool and timeouts for Google Maps calls.
+        # Its adapter already retries and pauses on OVER_QUERY_LIMIT, so the
+        # client's own retries are kept short and off for quota errors.
+        self.gmaps = googlemaps.Client(
+            key=api_key,
+            timeout=http_clients.google_maps.timeout,
+            requests_session=http_clients.google_maps.session,
+            retry_timeout=http_clients.GOOGLE_MAPS_RETRY_TIMEOUT,
+            retry_over_query_limit=False
+        )
+        # Directions come from the router picked by ROUTER (see routing.py)
+        self.router = router or routing.create_router(self.gmaps, geocode=self._to_point)
+        # Identical directions requests in flight at once share one router call
+        self.flights = SingleFlight()
+        # Nominatim calls share the upstream's pool and go through the scheduler
+        self.geolocator = Nominatim(
+            user_agent="trip_planner",
+            timeout=http_clients.nominatim.timeout,
+            adapter_factory=lambda **kwargs: http_clients.GeopyAdapter(http_clients.nominatim, **kwargs)
+        )
+        self.geocode_cache = geocode_cache or GeocodeCache()
+        self.directions_cache = directions_cache or DirectionsCache()
+        # Model-supplied coordinates that pass its checks skip geocoding
+        self.coordinate_trust = coordinate_trust.CoordinateTrust(
+            geocode=lambda address: self.geocode(address),
+            known=lambda address: self.geocoder.cached(address)
+        )
+        self.leg_cache = DirectionsCache(maxsize=int(os.getenv("LEG_CACHE_SIZE", 4096)))
+        # Above this many uncached legs a single multi-waypoint request is cheaper
+        self.max_leg_fetches = int(os.getenv("MAX_LEG_FETCHES", 3))
+        # Polylines sent to the frontend are simplified to this many meters
+        self.simplify_tolerance = float(os.getenv("ROUTE_SIMPLIFY_TOLERANCE_M", 5))
+        # Reorder stops (keeping the first and last) to shorten the drive
+        self.optimize_waypoints = os.getenv("OPTIMIZE_WAYPOINTS", "false").lower() == "true"
+        # Distance Matrix calls are billed per element, so by default waypoint
+        # ordering relies on cached legs and straight-line estimates only
+        self.matrix_api_enabled = os.getenv("DISTANCE_MATRIX_ENABLED", "false").lower() == "true"
+        # Calls per second allowed per geocoding provider; Nominatim's usage
+        # policy caps clients at one request per second.
+        self.rate_limiters = {
+            "google": TokenBucket(float(os.getenv("GOOGLE_GEOCODE_QPS", 10))),
+            "nominatim": TokenBucket(float(os.getenv("NOMINATIM_QPS", 1)))
+        }
+        # Geocoding providers in priority order, with failover and hedging
+        self.geocoder = geocoder.create_geocoder(
+            {
+                "google": lambda address: self._google_geocode(address),
+                "nominatim": lambda address: self._nominatim_geocode(address)
+            },
+            self.rate_limiters,
+            cache=self.geocode_cache
+        )
+        self._geocode_pool = ContextThreadPoolExecutor(
+            max_workers=int(os.getenv("GEOCODE_CONCURRENCY", 8)),
+            thread_name_prefix="geocode"
+        )
+        self._leg_pool = ContextThreadPoolExecutor(max_workers=self.max_leg_fetches or 1, thread_name_prefix="leg")
+        # Distance Matrix cells, keyed by quantized origin and destination
+        self.matrix_cache = LRUCache(
+            maxsize=int(os.getenv("MATRIX_CACHE_SIZE", 20000)),
+            ttl=float(os.getenv("DIRECTIONS_CACHE_TTL", 6 * 60 * 60))
+        )
+        self.matrix_precision = int(os.getenv("MATRIX_CACHE_PRECISION", 4))
+        self._matrix_pool = ContextThreadPoolExecutor(
+            max_workers=int(os.getenv("MATRIX_CONCURRENCY", 4)),
+            thread_name_prefix="matrix"
+        )
+        self._route_pool = ContextThreadPoolExecutor(
+            max_workers=int(os.getenv("ROUTE_CONCURRENCY", 8)),
+            thread_name_prefix="route"
+        )
+
+    def directions(
+        self,
+        origin: str,
+        destination: str,
+        waypoints: Optional[List[str]] = None,
+        mode: str = "driving",
+        alternatives: bool = False
+    ) -> List[Dict]:
+        """Directions from the router; concurrent identical requests share one call.
+
+        Requests are identical if they would share a directions cache entry.
+        The routes returned may be shared between callers, so don't modify them.
+        """
+        key = ("directions", self.router.name) + self.directions_cache.make_key(
+            [origin, *(waypoints or []), destination], mode=mode, alternatives=alternatives
+        )
+        return self.flights.do(
+            key, self.router.directions, origin, destination, waypoints=waypoints, mode=mode, alternatives=alternatives
+        )
 
     def get_route(
         self,
@@ -18,9 +126,16 @@ class MapsService:
         end_location: str,
         waypoints: Optional[List[str]] = None
     ) -> Dict:
+        cache_key = self.directions_cache.make_key(
+            [start_location, *(waypoints or []), end_location], mode="driving"
+        )
+        cached = self.directions_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
         try:
             # Get directions
-            directions_result = self.gmaps.directions(
+            directions_result = self.directions(
                 start_location,
                 end_location,
                 waypoints=waypoints,
@@ -42,7 +157,7 @@ class MapsService:
             total_duration = sum(leg["duration"]["value"] for leg in legs)
 
             # Format the response
-            return {
+            result = {
                 "error": None,
                 "route": {
                     "total_distance": total_distance,
@@ -68,6 +183,8 @@ class MapsService:
                     ]
                 }
             }
+            self.directions_cache.set(cache_key, result)
+            return result
 
         except Exception as e:
             return {
@@ -75,6 +192,23 @@ class MapsService:
                 "route": None
             }
 
+    def corridor_points(
+        self,
+        start_location: str,
+        end_location: str,
+        waypoints: Optional[List[str]] = None
+    ) -> List[tuple]:
+        """Return (lat, lng) points along the driving route, one per direction step."""
+        result = self.get_route(start_location, end_location, waypoints)
+        if result["error"] or not result["route"]:
+            return []
+        points = []
+        for leg in result["route"]["legs"]:
+            for step in leg["steps"]:
+                points.append((step["start_location"]["lat"], step["start_location"]["lng"]))
+            points.append((leg["end_location"]["lat"], leg["end_location"]["lng"]))
+        return points
+
     def _format_location(self, location: Union[str, Dict]) -> str:
         """Convert location to a format suitable for Google Maps API."""
         if isinstance(location, dict):
@@ -84,101 +218,499 @@ class MapsService:
                 return location['formatted_address']
         return str(location)
 
-    def get_route_data(self, itinerary: List[Dict]) -> Dict:
+    def _parse_coordinates(self, location: str) -> Optional[tuple]:
+        """Return (lat, lng) if location is a "lat,lng" string, else None."""
+        parts = location.split(",")
+        if len(parts) != 2:
+            return None
+        try:
+            return float(parts[0]), float(parts[1])
+        except ValueError:
+            return None
+
+    def _google_geocode(self, address: str) -> Optional[Dict]:
+        geocode_result = self.gmaps.geocode(address)
+        if not geocode_result:
+            return None
+        return {
+            "lat": geocode_result[0]["geometry"]["location"]["lat"],
+            "lng": geocode_result[0]["geometry"]["location"]["lng"],
+            "formatted_address": geocode_result[0].get("formatted_address", address)
+        }
+
+    def _nominatim_geocode(self, address: str) -> Optional[Dict]:
+        location = self.geolocator.geocode(address)
+        if not location:
+            return None
+        return {
+            "lat": location.latitude,
+            "lng": location.longitude,
+            "formatted_address": location.address
+        }
+
+    def geocode(self, address: str) -> Optional[Dict]:
+        """Geocode an address through the geocode cache and the provider failover chain."""
+        return self.geocoder.geocode(address)
+
+    def _claimed_coordinates(self, item: Dict) -> Optional[tuple]:
+        """The (lat, lng) the item itself gives, if its location is a "lat,lng" string."""
+        location = item.get("location") or item.get("address")
+        return self._parse_coordinates(location) if isinstance(location, str) else None
+
+    def _neighbor_claims(self, itinerary: List[Dict], index: int) -> List[tuple]:
+        """Claimed coordinates of the stops right before and after itinerary[index]."""
+        neighbors = itinerary[max(0, index - 1):index] + itinerary[index + 1:index + 2]
+        return [point for point in map(self._claimed_coordinates, neighbors) if point is not None]
+
+    def _resolve_item(self, item: Dict, neighbors: List[tuple] = ()) -> Optional[tuple]:
+        """Return (lat, lng) for an itinerary item, or None if it can't be located.
+
+        Coordinates given by the item are used as they are if they pass the
+        coordinate trust checks against its address and neighbors;
+        otherwise the address is geocoded.
+        """
+        location = item.get("location") or item.get("address")
+        if not location:
+            return None
+        try:
+            coordinates = self._claimed_coordinates(item)
+            if coordinates:
+                address = item.get("address")
+                if not isinstance(address, str) or self._parse_coordinates(address):
+                    address = None
+                if self.coordinate_trust.accept(coordinates, address, neighbors):
+                    return coordinates
+                if not address:
+                    # Nothing to geocode; the model's guess is all there is
+                    return coordinates if coordinate_trust.in_range(coordinates) else None
+                location = address
+            geocoded = self.geocode(self._format_location(location))
+            if not geocoded:
+                return None
+            return geocoded["lat"], geocoded["lng"]
+        except Exception as e:
+            print(f"Error processing location {location}: {str(e)}")
+            return None
+
+    def resolve_itinerary(self, itinerary: List[Dict]) -> List[Optional[tuple]]:
+        """Geocode every itinerary item concurrently, keeping itinerary order."""
+        neighbors = [self._neighbor_claims(itinerary, index) for index in range(len(itinerary))]
+        if len(itinerary) <= 1:
+            return [self._resolve_item(item, near) for item, near in zip(itinerary, neighbors)]
+        return list(self._geocode_pool.map(self._resolve_item, itinerary, neighbors))
+
+    def submit_resolve(self, item: Dict, neighbors: List[tuple] = ()) -> Future:
+        """Start geocoding one itinerary item in the background; the future yields (lat, lng) or None."""
+        return self._geocode_pool.submit(self._resolve_item, item, neighbors)
+
+    def _location_key(self, item: Dict) -> Optional[str]:
+        location = item.get("location") or item.get("address")
+        if not location:
+            return None
+        return " ".join(self._format_location(location).lower().split())
+
+    def submit_route_data(self, itinerary: List[Dict], geocodes: Optional["GeocodeBatch"] = None, **options) -> Future:
+        """Build route data for an itinerary in the background, resolving locations through geocodes if given."""
+        def run():
+            coordinates = geocodes.resolve(itinerary) if geocodes is not None else None
+            return self.get_route_data(itinerary, coordinates, **options)
+
+        return self._route_pool.submit(run)
+
+    def build_marker(self, item: Dict, lat: float, lng: float) -> Dict:
+        return {
+            "position": {
+                "lat": lat,
+                "lng": lng
+            },
+            "title": item.get("title", "Stop"),
+            "description": item.get("description", ""),
+            "type": item.get("type", "stop")
+        }
+
+    def get_route_data(
+        self,
+        itinerary: List[Dict],
+        coordinates: Optional[List[Optional[tuple]]] = None,
+        optimize: Optional[bool] = None,
+        respect_times: bool = False
+    ) -> Dict:
+        """Route through the itinerary's stops.
+
+        With optimize, stops between the first and last are visited in the
+        order that minimizes driving time (honouring their time fields if
+        respect_times) and "waypoint_order" lists the itinerary indexes
+        in the order driven.
+        """
         waypoints = []
         markers = []
-        
+        located = []
+
         # First, geocode all locations to ensure we have coordinates
-        for item in itinerary:
-            location = item.get("location") or item.get("address")
-            if location:
+        if coordinates is None:
+            coordinates = self.resolve_itinerary(itinerary)
+        for index, (item, point) in enumerate(zip(itinerary, coordinates)):
+            if not point:
+                continue
+            lat, lng = point
+            waypoints.append(f"{lat},{lng}")
+            markers.append(self.build_marker(item, lat, lng))
+            located.append(index)
+
+        if len(waypoints) < 2:
+            return {"error": "Not enough waypoints to create a route"}
+
+        if optimize if optimize is not None else self.optimize_waypoints:
+            stops = [itinerary[index] for index in located]
+            order = self.optimize_order(waypoints, stops if respect_times else None)
+            waypoints = [waypoints[i] for i in order]
+            markers = [markers[i] for i in order]
+            located = [located[i] for i in order]
+            route = self._route_for_waypoints(waypoints, markers)
+            return route if "error" in route else {**route, "waypoint_order": located}
+        return self._route_for_waypoints(waypoints, markers)
+
+    # Distance Matrix API limits per request
+    MATRIX_MAX_ORIGINS = 25
+    MATRIX_MAX_DESTINATIONS = 25
+    MATRIX_MAX_ELEMENTS = 100
+
+    def _to_point(self, location: Union[str, Dict, tuple]) -> Optional[tuple]:
+        if isinstance(location, (tuple, list)) and len(location) == 2:
+            return float(location[0]), float(location[1])
+        if isinstance(location, dict) and "lat" in location and "lng" in location:
+            return float(location["lat"]), float(location["lng"])
+        coordinates = self._parse_coordinates(location) if isinstance(location, str) else None
+        if coordinates:
+            return coordinates
+        geocoded = self.geocode(self._format_location(location))
+        return (geocoded["lat"], geocoded["lng"]) if geocoded else None
+
+    def _matrix_key(self, origin: tuple, destination: tuple) -> tuple:
+        return (
+            quantize_location(origin, self.matrix_precision),
+            quantize_location(destination, self.matrix_precision),
+            "driving"
+        )
+
+    def _matrix_tiles(self, missing: List[tuple]) -> List[tuple]:
+        """Split missing (row, column) cells into requests within the API limits.
+
+        Rows missing the same columns share requests, so cells that aren't
+        needed (such as each stop to itself) are never paid for.
+        """
+        groups: Dict[tuple, List[int]] = {}
+        for row in sorted({row for row, _ in missing}):
+            groups.setdefault(tuple(sorted(column for r, column in missing if r == row)), []).append(row)
+        tiles = []
+        for columns, rows in groups.items():
+            columns = list(columns)
+            for c in range(0, len(columns), self.MATRIX_MAX_DESTINATIONS):
+                column_chunk = columns[c:c + self.MATRIX_MAX_DESTINATIONS]
+                row_size = max(1, min(self.MATRIX_MAX_ORIGINS, self.MATRIX_MAX_ELEMENTS // len(column_chunk)))
+                for r in range(0, len(rows), row_size):
+                    tiles.append((rows[r:r + row_size], column_chunk))
+        return tiles
+
+    def _fetch_matrix_tile(self, origins: List[tuple], destinations: List[tuple]) -> List[List[Dict]]:
+        response = self.gmaps.distance_matrix(
+            [f"{lat},{lng}" for lat, lng in origins],
+            [f"{lat},{lng}" for lat, lng in destinations],
+            mode="driving"
+        )
+        return [row["elements"] for row in response["rows"]]
+
+    def travel_time_matrix(
+        self,
+        origins: List[Union[str, Dict, tuple]],
+        destinations: List[Union[str, Dict, tuple]],
+        use_api: bool = True
+    ) -> Dict:
+        """Driving durations (seconds) and distances (meters) from every origin to every destination.
+
+        Cells are served from the matrix cache by quantized coordinates;
+        the rest are fetched from the Distance Matrix API in as few calls as
+        its per-request limits allow, run concurrently. Cells the API can't
+        answer (or all of them without use_api) get a straight-line
+        estimate and are marked in "estimated". Unroutable pairs are inf.
+        """
+        origin_points = [self._to_point(location) for location in origins]
+        destination_points = [self._to_point(location) for location in destinations]
+        shape = (len(origins), len(destinations))
+        durations = np.full(shape, np.nan)
+        distances = np.full(shape, np.nan)
+        missing = []
+        for i, origin in enumerate(origin_points):
+            for j, destination in enumerate(destination_points):
+                if origin is None or destination is None:
+                    durations[i, j] = distances[i, j] = np.inf
+                    continue
+                key = self._matrix_key(origin, destination)
+                if key[0] == key[1]:
+                    # Same place; not worth a paid matrix element
+                    durations[i, j] = distances[i, j] = 0
+                    continue
+                cell = self.matrix_cache.get(key)
+                if cell is None:
+                    missing.append((i, j))
+                else:
+                    durations[i, j], distances[i, j] = cell
+
+        if missing and use_api:
+            tiles = self._matrix_tiles(missing)
+            futures = [
+                self._matrix_pool.submit(
+                    self._fetch_matrix_tile,
+                    [origin_points[i] for i in rows],
+                    [destination_points[j] for j in columns]
+                )
+                for rows, columns in tiles
+            ]
+            for (rows, columns), future in zip(tiles, futures):
                 try:
-                    # Try to parse coordinates if they're in lat,lng format
-                    if isinstance(location, str) and "," in location:
-                        lat, lng = map(float, location.split(","))
-                    else:
-                        # If not in lat,lng format, geocode the address
-                        geocode_result = self.gmaps.geocode(location)
-                        if not geocode_result:
-                            continue
-                        lat = geocode_result[0]["geometry"]["location"]["lat"]
-                        lng = geocode_result[0]["geometry"]["location"]["lng"]
-                    
-                    waypoints.append(f"{lat},{lng}")
-                    markers.append({
-                        "position": {
-                            "lat": lat,
-                            "lng": lng
-                        },
-                        "title": item.get("title", "Stop"),
-                        "description": item.get("description", ""),
-                        "type": item.get("type", "stop")
-                    })
+                    elements = future.result()
                 except Exception as e:
-                    print(f"Error processing location {location}: {str(e)}")
+                    print(f"Error fetching distance matrix: {str(e)}")
                     continue
+                for i, row in zip(rows, elements):
+                    for j, element in zip(columns, row):
+                        if element.get("status") == "OK":
+                            cell = (element["duration"]["value"], element["distance"]["value"])
+                        elif element.get("status") == "ZERO_RESULTS":
+                            cell = (np.inf, np.inf)
+                        else:
+                            continue
+                        durations[i, j], distances[i, j] = cell
+                        self.matrix_cache.set(self._matrix_key(origin_points[i], destination_points[j]), cell)
 
-        if len(waypoints) < 2:
-            return {"error": "Not enough waypoints to create a route"}
+        estimated = np.isnan(durations)
+        if estimated.any():
+            rows, columns = np.nonzero(estimated)
+            origin_array = geometry.as_points([origin_points[i] for i in rows])
+            destination_array = geometry.as_points([destination_points[j] for j in columns])
+            meters = geometry.haversine(
+                origin_array[:, 0], origin_array[:, 1], destination_array[:, 0], destination_array[:, 1]
+            ) * route_optimizer.ROAD_FACTOR
+            distances[rows, columns] = meters
+            durations[rows, columns] = meters / (route_optimizer.DEFAULT_SPEED_KMH * 1000 / 3600)
+        return {"durations": durations, "distances": distances, "estimated": estimated}
 
-        try:
-            # Get directions between waypoints
-            directions = self.gmaps.directions(
-                waypoints[0],
-                waypoints[-1],
-                waypoints=waypoints[1:-1] if len(waypoints) > 2 else None,
-                mode="driving",
-                alternatives=False
-            )
+    def travel_matrix(self, waypoints: List[str]) -> np.ndarray:
+        """Driving seconds between every pair of waypoints.
 
-            if not directions:
-                return {"error": "Could not generate route"}
+        Pairs whose leg is in the leg cache use its duration, the rest come
+        from travel_time_matrix.
+        """
+        matrix = self.travel_time_matrix(waypoints, waypoints, use_api=self.matrix_api_enabled)["durations"]
+        for i, origin in enumerate(waypoints):
+            matrix[i, i] = 0.0
+            for j, destination in enumerate(waypoints):
+                if i != j:
+                    leg = self.leg_cache.get(self._leg_key(origin, destination))
+                    if leg is not None:
+                        matrix[i, j] = leg["duration"]["value"]
+        return matrix
 
-            # Extract route information
-            route = directions[0]
-            legs = route["legs"]
-            
-            # Create a simplified route representation
-            simplified_route = {
-                "overview_polyline": route["overview_polyline"]["points"],
-                "markers": markers,
-                "bounds": route["bounds"],
-                "legs": [
-                    {
-                        "start_location": leg["start_location"],
-                        "end_location": leg["end_location"],
-                        "distance": leg["distance"],
-                        "duration": leg["duration"],
-                        "steps": [
-                            {
-                                "start_location": step["start_location"],
-                                "end_location": step["end_location"],
-                                "polyline": step["polyline"]["points"]
-                            }
-                            for step in leg["steps"]
-                        ]
-                    }
-                    for leg in legs
-                ]
-            }
+    def optimize_order(self, waypoints: List[str], items: Optional[List[Dict]] = None) -> List[int]:
+        """Visiting order for "lat,lng" waypoints with the first and last pinned.
+
+        If items (one per waypoint) are given, their time and duration
+        fields become time windows and service times.
+        """
+        matrix = self.travel_matrix(waypoints)
+        if not items:
+            return route_optimizer.optimize_order(matrix)
+        return route_optimizer.optimize_order(
+            matrix,
+            route_optimizer.time_windows([item.get("time") for item in items]),
+            [route_optimizer.parse_duration(item.get("duration")) for item in items]
+        )
 
-            return simplified_route
+    def _route_for_waypoints(self, waypoints: List[str], markers: List[Dict]) -> Dict:
+        cache_key = self.directions_cache.make_key(waypoints, mode="driving", alternatives=False)
+        cached = self.directions_cache.get(cache_key)
+        if cached is not None:
+            # Markers carry the itinerary text, so only the route itself is cached
+            return {**cached, "markers": markers}
+
+        try:
+            route = self._build_route(waypoints)
+            if route is None:
+                return {"error": "Could not generate route"}
+
+            self.directions_cache.set(cache_key, route)
+            return {**route, "markers": markers}
 
         except Exception as e:
             print(f"Error generating route: {str(e)}")
             return {"error": str(e)}
 
+    def _simplify_leg(self, leg: Dict) -> Dict:
+        return {
+            "start_location": leg["start_location"],
+            "end_location": leg["end_location"],
+            "distance": leg["distance"],
+            "duration": leg["duration"],
+            "steps": [
+                {
+                    "start_location": step["start_location"],
+                    "end_location": step["end_location"],
+                    "polyline": geometry.simplify_polyline(step["polyline"]["points"], self.simplify_tolerance)
+                }
+                for step in leg["steps"]
+            ]
+        }
+
+    def _leg_key(self, origin: str, destination: str) -> tuple:
+        return self.leg_cache.make_key([origin, destination], mode="driving")
+
+    def submit_leg(self, origin: str, destination: str) -> Future:
+        """Fetch the leg between two "lat,lng" waypoints into the leg cache in the background."""
+        cached = self.leg_cache.get(self._leg_key(origin, destination))
+        if cached is not None:
+            future = Future()
+            future.set_result(cached)
+            return future
+        return self._leg_pool.submit(self._fetch_leg, origin, destination)
+
+    def _fetch_leg(self, origin: str, destination: str) -> Optional[Dict]:
+        directions = self.directions(origin, destination, mode="driving", alternatives=False)
+        if not directions:
+            return None
+        leg = self._simplify_leg(directions[0]["legs"][0])
+        self.leg_cache.set(self._leg_key(origin, destination), leg)
+        return leg
+
+    def _stitch_legs(self, legs: List[Dict]) -> Dict:
+        """Join per-leg routes into one route with merged bounds and polyline."""
+        parts = [geometry.decode_polyline(step["polyline"]) for leg in legs for step in leg["steps"]]
+        parts = [part for part in parts if len(part)]
+        if parts:
+            points = np.concatenate(parts)
+            # Drop the point each step shares with the end of the previous one
+            keep = np.ones(len(points), dtype=bool)
+            keep[1:] = np.any(points[1:] != points[:-1], axis=1)
+            points = points[keep]
+        else:
+            points = geometry.as_points([
+                (location["lat"], location["lng"])
+                for leg in legs
+                for location in (leg["start_location"], leg["end_location"])
+            ])
+        north, east = points.max(axis=0)
+        south, west = points.min(axis=0)
+        return {
+            "overview_polyline": geometry.encode_polyline(geometry.douglas_peucker(points, self.simplify_tolerance)),
+            "bounds": {
+                "northeast": {"lat": float(north), "lng": float(east)},
+                "southwest": {"lat": float(south), "lng": float(west)}
+            },
+            "legs": legs
+        }
+
+    def _build_route(self, waypoints: List[str]) -> Optional[Dict]:
+        """Build a route leg by leg, fetching only legs missing from the leg cache.
+
+        After an itinerary edit only the legs whose endpoints changed are
+        missing. When more than max_leg_fetches legs are missing (e.g. a new
+        trip) the whole route is fetched in one call and split into legs.
+        """
+        pairs = list(zip(waypoints, waypoints[1:]))
+        legs = [self.leg_cache.get(self._leg_key(origin, destination)) for origin, destination in pairs]
+        missing = [i for i, leg in enumerate(legs) if leg is None]
+
+        if not missing:
+            return self._stitch_legs(legs)
+
+        if len(missing) <= self.max_leg_fetches:
+            fetched = list(self._leg_pool.map(lambda i: self._fetch_leg(*pairs[i]), missing))
+            if any(leg is None for leg in fetched):
+                return None
+            for i, leg in zip(missing, fetched):
+                legs[i] = leg
+            return self._stitch_legs(legs)
+
+        # Get directions between waypoints
+        directions = self.directions(
+            waypoints[0],
+            waypoints[-1],
+            waypoints=waypoints[1:-1] if len(waypoints) > 2 else None,
+            mode="driving",
+            alternatives=False
+        )
+        if not directions:
+            return None
+
+        route = directions[0]
+        legs = [self._simplify_leg(leg) for leg in route["legs"]]
+        for (origin, destination), leg in zip(pairs, legs):
+            self.leg_cache.set(self._leg_key(origin, destination), leg)
+        return {
+            "overview_polyline": geometry.simplify_polyline(route["overview_polyline"]["points"], self.simplify_tolerance),
+            "bounds": route["bounds"],
+            "legs": legs
+        }
+
+    def invalidate_routes(self, location=None) -> int:
+        """Forget cached directions, legs and travel times through location, or all of them.
+
+        An address also matches entries keyed by its cached geocode, since
+        routes are usually requested between resolved coordinates.
+        Returns the number of entries removed.
+        """
+        if location is None:
+            removed = self.directions_cache.invalidate() + self.leg_cache.invalidate() + len(self.matrix_cache)
+            self.matrix_cache.clear()
+            return removed
+        forms = [location]
+        known = self.geocoder.cached(location) if isinstance(location, str) else None
+        if known:
+            forms.append((known["lat"], known["lng"]))
+        removed = 0
+        for form in forms:
+            removed += self.directions_cache.invalidate(form) + self.leg_cache.invalidate(form)
+        points = {quantize_location(form, self.matrix_precision) for form in forms}
+        for key in self.matrix_cache.keys():
+            if key[0] in points or key[1] in points:
+                self.matrix_cache.pop(key)
+                removed += 1
+        return removed
+
     def geocode_address(self, address: str) -> Dict:
         try:
-            location = self.geolocator.geocode(address)
-            if location:
-                return {
-                    "lat": location.latitude,
-                    "lng": location.longitude,
-                    "formatted_address": location.address
-                }
+            result = self.geocode(address)
+            if result:
+                return result
             return {"error": "Could not geocode address"}
-        except GeocoderTimedOut:
-            return {"error": "Geocoding timed out"}
         except Exception as e:
-            return {"error": str(e)} 
\ No newline at end of file
+            return {"error": str(e)}
+
+
+class GeocodeBatch:
+    """Geocode lookups shared by every itinerary of one batch request.
+
+    Each distinct location is looked up once, even while its first lookup
+    is still in flight for another itinerary of the batch.
+    """
+
+    def __init__(self, maps_service: MapsService):
+        self.maps_service = maps_service
+        self._futures: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    def resolve(self, itinerary: List[Dict]) -> List[Optional[tuple]]:
+        futures = []
+        for index, item in enumerate(itinerary):
+            key = self.maps_service._location_key(item)
+            with self._lock:
+                future = self._futures.get(key) if key is not None else None
+                if future is None:
+                    future = self.maps_service.submit_resolve(item, self.maps_service._neighbor_claims(itinerary, index))
+                    if key is not None:
+                        self._futures[key] = future
+            futures.append(future)
+        return [future.result() for future in futures]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._futures)
@@ -0,0 +1,255 @@
+import json
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+import geometry
+
+DEFAULT_INDEX_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "place_index.sqlite3")
+DEFAULT_TTL = 7 * 24 * 60 * 60
+# Grid cell size in degrees of latitude (~5.5 km)
+DEFAULT_CELL_DEG = 0.05
+
+
+def normalize_category(category: str) -> str:
+    return re.sub(r"\s+", " ", re.sub(r"[^\w\s]", " ", str(category or "").lower())).strip()
+
+
+# Words that don't narrow down what kind of place is wanted
+FILLER_WORDS = frozenset(
+    "a along an any are around best can closest could find for get good i is me my near nearby nearest "
+    "need on one or place please route show some stop the there to way we where want what".split()
+)
+
+
+def _words(text: str) -> set:
+    """Normalized words of text, with plural s dropped."""
+    return {
+        word[:-1] if len(word) > 3 and word.endswith("s") and not word.endswith("ss") else word
+        for word in normalize_category(text).split()
+    }
+
+
+def plain_request(text: str, category: str) -> bool:
+    """True if text asks for category and nothing more specific, e.g. "any gas stations nearby?"."""
+    return not _words(text) - _words(category) - FILLER_WORDS
+
+
+class PlaceIndex:
+    """Local spatial index of places seen in earlier Places/LLM results.
+
+    Places are bucketed into a fixed lat/lng grid held in memory and
+    persisted to SQLite. Queries only touch the cells around the query
+    points, so nearest-place lookups along a corridor need no API call.
+    Places older than ttl seconds are dropped from the cells a query
+    touches, and from the whole index by a sweep at most every
+    sweep_interval seconds as places are added.
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        ttl: Optional[float] = None,
+        cell_deg: float = DEFAULT_CELL_DEG,
+        sweep_interval: Optional[float] = None
+    ):
+        if path is None:
+            path = os.getenv("PLACE_INDEX_PATH", DEFAULT_INDEX_PATH)
+        self.ttl = float(ttl if ttl is not None else os.getenv("PLACE_INDEX_TTL", DEFAULT_TTL))
+        self.cell_deg = cell_deg
+        self.sweep_interval = float(sweep_interval if sweep_interval is not None else min(self.ttl, 60 * 60))
+        self._last_sweep = time.time()
+        self._cells: Dict[tuple, Dict[str, Dict]] = {}
+        self._place_cells: Dict[str, tuple] = {}
+        self._categories: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            try:
+                self._db = sqlite3.connect(path, check_same_thread=False)
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS places ("
+                    "key TEXT PRIMARY KEY, category TEXT NOT NULL, "
+                    "lat REAL NOT NULL, lng REAL NOT NULL, "
+                    "data TEXT NOT NULL, updated_at REAL NOT NULL)"
+                )
+                self._db.commit()
+                self._load()
+            except sqlite3.Error as e:
+                print(f"Place index disabled on-disk storage: {str(e)}")
+                self._db = None
+
+    def _cell(self, lat: float, lng: float) -> tuple:
+        return (math.floor(lat / self.cell_deg), math.floor(lng / self.cell_deg))
+
+    def _load(self):
+        cutoff = time.time() - self.ttl
+        self._db.execute("DELETE FROM places WHERE updated_at < ?", (cutoff,))
+        self._db.commit()
+        for key, category, lat, lng, data, updated_at in self._db.execute(
+            "SELECT key, category, lat, lng, data, updated_at FROM places"
+        ):
+            self._insert({
+                "key": key, "category": category, "lat": lat, "lng": lng,
+                "place": json.loads(data), "updated_at": updated_at
+            })
+
+    def _insert(self, record: Dict):
+        key = record["key"]
+        if key in self._place_cells:
+            self._remove(key)
+        cell = self._cell(record["lat"], record["lng"])
+        self._cells.setdefault(cell, {})[key] = record
+        self._place_cells[key] = cell
+        self._categories[record["category"]] = self._categories.get(record["category"], 0) + 1
+
+    def _remove(self, key: str):
+        record = self._cells[self._place_cells.pop(key)].pop(key)
+        self._categories[record["category"]] -= 1
+        if not self._categories[record["category"]]:
+            del self._categories[record["category"]]
+
+    def prune(self) -> int:
+        """Drop expired places from memory and disk; returns how many were dropped from memory."""
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            expired = [
+                key for cell in self._cells.values() for key, record in cell.items()
+                if record["updated_at"] < cutoff
+            ]
+            for key in expired:
+                self._remove(key)
+            self._cells = {cell: records for cell, records in self._cells.items() if records}
+            self._last_sweep = time.time()
+            if self._db is not None:
+                self._db.execute("DELETE FROM places WHERE updated_at < ?", (cutoff,))
+                self._db.commit()
+        return len(expired)
+
+    def add(self, place: Dict, category: str, lat: float, lng: float):
+        """Store a place found by a Places search or an LLM suggestion."""
+        category = normalize_category(category)
+        key = place.get("place_id") or f"{category}|{normalize_category(place.get('name'))}|{lat:.4f},{lng:.4f}"
+        record = {
+            "key": key, "category": category, "lat": float(lat), "lng": float(lng),
+            "place": place, "updated_at": time.time()
+        }
+        with self._lock:
+            self._insert(record)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO places (key, category, lat, lng, data, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (key, category, record["lat"], record["lng"], json.dumps(place), record["updated_at"])
+                )
+                self._db.commit()
+            sweep_due = time.time() - self._last_sweep >= self.sweep_interval
+        if sweep_due:
+            self.prune()
+
+    def add_places_results(self, results: List[Dict], category: str):
+        """Store raw Google Places results."""
+        for place in results:
+            location = place.get("geometry", {}).get("location")
+            if location:
+                self.add(place, category, location["lat"], location["lng"])
+
+    def categories(self) -> List[str]:
+        with self._lock:
+            return [category for category, count in self._categories.items() if count]
+
+    def match_category(self, text: str) -> Optional[str]:
+        """Return the longest known category all of whose words appear in text, if any."""
+        words = _words(text)
+        matches = [category for category in self.categories() if _words(category) <= words]
+        return max(matches, key=lambda category: len(category.split()), default=None)
+
+    def _candidates(self, points: np.ndarray, category: str, radius_km: float) -> List[Dict]:
+        cutoff = time.time() - self.ttl
+        ring_lat = int(math.ceil(radius_km / 111.0 / self.cell_deg))
+        cells = set()
+        for lat, lng in points.tolist():
+            row, col = self._cell(lat, lng)
+            ring_lng = int(math.ceil(radius_km / (111.0 * max(math.cos(math.radians(lat)), 0.01)) / self.cell_deg))
+            for d_row in range(-ring_lat, ring_lat + 1):
+                for d_col in range(-ring_lng, ring_lng + 1):
+                    cells.add((row + d_row, col + d_col))
+        candidates = []
+        with self._lock:
+            for cell in cells:
+                records = self._cells.get(cell)
+                if not records:
+                    continue
+                for key, record in list(records.items()):
+                    if record["updated_at"] < cutoff:
+                        self._remove(key)
+                    elif record["category"] == category:
+                        candidates.append(record)
+                if not records:
+                    del self._cells[cell]
+        return candidates
+
+    def query_near_polyline(
+        self,
+        points,
+        category: str,
+        radius_km: float = 5.0,
+        k: int = 5
+    ) -> List[Dict]:
+        """Return up to k places of category within radius_km of the polyline, nearest first.
+
+        Each result is the stored place plus "lat", "lng" and "distance_km".
+        """
+        points = geometry.as_points(points)
+        if len(points) == 0:
+            return []
+        if len(points) > 1:
+            # Sample finely enough that no stretch of the corridor is skipped
+            points = geometry.resample(points, max(radius_km * 1000 / 2, 100))
+        candidates = self._candidates(points, normalize_category(category), radius_km)
+        if not candidates:
+            return []
+        positions = np.array([(record["lat"], record["lng"]) for record in candidates])
+        distances = geometry.haversine(
+            positions[:, None, 0], positions[:, None, 1], points[None, :, 0], points[None, :, 1]
+        ).min(axis=1) / 1000
+        order = np.argsort(distances)
+        return [
+            {**candidates[i]["place"], "lat": candidates[i]["lat"], "lng": candidates[i]["lng"],
+             "distance_km": round(float(distances[i]), 2)}
+            for i in order[:k]
+            if distances[i] <= radius_km
+        ]
+
+    def query_near_point(self, lat: float, lng: float, category: str, radius_km: float = 5.0, k: int = 5) -> List[Dict]:
+        return self.query_near_polyline([(lat, lng)], category, radius_km, k)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._place_cells)
+
+    def stats(self) -> Dict:
+        return {
+            "places": len(self),
+            "categories": len(self.categories()),
+            "disk_enabled": self._db is not None
+        }
+
+
+_default_index: Optional[PlaceIndex] = None
+_default_lock = threading.Lock()
+
+
+def get_place_index() -> PlaceIndex:
+    """Process-wide index shared by the stop search and /llm_chat."""
+    global _default_index
+    with _default_lock:
+        if _default_index is None:
+            _default_index = PlaceIndex()
+        return _default_index
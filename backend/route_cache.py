@@ -0,0 +1,80 @@
+import os
+from typing import Dict, List, Optional, Union
+
+from cache import LRUCache
+from geocode_cache import normalize_address
+
+
+def quantize_location(location: Union[str, Dict, tuple, list], precision: int) -> str:
+    """Turn a waypoint into a stable key component.
+
+    Coordinates (as "lat,lng", a {"lat", "lng"} dict or a pair) are rounded to
+    precision decimal places; anything else is treated as an address.
+    """
+    lat = lng = None
+    if isinstance(location, dict) and "lat" in location and "lng" in location:
+        lat, lng = location["lat"], location["lng"]
+    elif isinstance(location, (tuple, list)) and len(location) == 2:
+        lat, lng = location
+    elif isinstance(location, str):
+        parts = location.split(",")
+        if len(parts) == 2:
+            try:
+                lat, lng = float(parts[0]), float(parts[1])
+            except ValueError:
+                pass
+    if lat is None:
+        if isinstance(location, dict):
+            location = location.get("formatted_address", location)
+        return normalize_address(location)
+    return f"{round(float(lat), precision):.{precision}f},{round(float(lng), precision):.{precision}f}"
+
+
+class DirectionsCache:
+    """Size-bounded cache of simplified directions payloads.
+
+    Keys are built from the ordered waypoint sequence (coordinates rounded to
+    `precision` decimals), the travel mode and any extra request options.
+    """
+
+    def __init__(
+        self,
+        maxsize: Optional[int] = None,
+        precision: Optional[int] = None,
+        ttl: Optional[float] = None
+    ):
+        maxsize = int(maxsize if maxsize is not None else os.getenv("DIRECTIONS_CACHE_SIZE", 512))
+        ttl = float(ttl if ttl is not None else os.getenv("DIRECTIONS_CACHE_TTL", 6 * 60 * 60))
+        self.precision = int(precision if precision is not None else os.getenv("DIRECTIONS_CACHE_PRECISION", 5))
+        self.routes = LRUCache(maxsize=maxsize, ttl=ttl or None)
+
+    def make_key(self, waypoints: List, mode: str = "driving", **options) -> tuple:
+        points = tuple(quantize_location(point, self.precision) for point in waypoints)
+        extra = tuple(sorted((name, str(value)) for name, value in options.items() if value is not None))
+        return (mode, points, extra)
+
+    def get(self, key: tuple) -> Optional[Dict]:
+        return self.routes.get(key)
+
+    def set(self, key: tuple, route: Dict):
+        self.routes.set(key, route)
+
+    def invalidate(self, location=None) -> int:
+        """Drop cached routes that pass through location, or every route if None.
+
+        Returns the number of entries removed.
+        """
+        if location is None:
+            count = len(self.routes)
+            self.routes.clear()
+            return count
+        point = quantize_location(location, self.precision)
+        removed = 0
+        for key in self.routes.keys():
+            if point in key[1]:
+                self.routes.pop(key)
+                removed += 1
+        return removed
+
+    def stats(self) -> Dict:
+        return self.routes.stats()
@@ -0,0 +1,191 @@
+import os
+import re
+from itertools import permutations
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+import geometry
+
+# Straight-line distance is scaled by this to approximate road distance
+ROAD_FACTOR = 1.3
+DEFAULT_SPEED_KMH = float(os.getenv("ESTIMATED_SPEED_KMH", 50))
+# Largest number of stops solved exactly; Held-Karp is O(n^2 2^n)
+EXACT_MAX_STOPS = int(os.getenv("OPTIMIZER_EXACT_MAX_STOPS", 10))
+# Seconds of cost per second of arriving after a stop's time window
+LATE_PENALTY = 10.0
+
+Window = Optional[Tuple[float, float]]
+
+
+def estimate_matrix(points, speed_kmh: float = DEFAULT_SPEED_KMH) -> np.ndarray:
+    """Estimated driving seconds between every pair of (lat, lng) points."""
+    points = geometry.as_points(points)
+    meters = geometry.haversine(points[:, None, 0], points[:, None, 1], points[None, :, 0], points[None, :, 1])
+    return meters * ROAD_FACTOR / (speed_kmh * 1000 / 3600)
+
+
+def parse_time(text) -> Optional[float]:
+    """Seconds after midnight for times like "10:00 AM", "9am" or "14:30", else None."""
+    match = re.search(r"(\d{1,2})(?::(\d{2}))?\s*([ap])\.?m?\.?\b", str(text or ""), re.IGNORECASE)
+    if match:
+        hours = int(match.group(1)) % 12 + (12 if match.group(3).lower() == "p" else 0)
+    else:
+        match = re.search(r"\b(\d{1,2}):(\d{2})\b", str(text or ""))
+        if not match:
+            return None
+        hours = int(match.group(1))
+    if hours > 23:
+        return None
+    return hours * 3600 + int(match.group(2) or 0) * 60
+
+
+def parse_duration(text) -> float:
+    """Seconds for durations like "2 hours", "1.5 hrs" or "45 minutes"; 0 if unknown."""
+    text = str(text or "").lower()
+    total = 0.0
+    for value, unit in re.findall(r"(\d+(?:\.\d+)?)\s*(h|hr|hrs|hour|hours|m|min|mins|minute|minutes)\b", text):
+        total += float(value) * (3600 if unit.startswith("h") else 60)
+    return total
+
+
+def time_windows(times: Sequence, slack_minutes: float = 30) -> List[Window]:
+    """Turn item time fields into (earliest, latest) windows of +/- slack_minutes."""
+    windows = []
+    for text in times:
+        start = parse_time(text)
+        windows.append(None if start is None else (start - slack_minutes * 60, start + slack_minutes * 60))
+    return windows
+
+
+def route_cost(
+    order: Sequence[int],
+    matrix: np.ndarray,
+    windows: Optional[Sequence[Window]] = None,
+    service: Optional[Sequence[float]] = None
+) -> float:
+    """Total travel seconds of visiting stops in order.
+
+    With windows, the schedule is simulated instead: waiting for a window
+    to open counts as time spent and arriving late is penalized.
+    """
+    if windows is None or not any(windows):
+        return float(sum(matrix[a, b] for a, b in zip(order, order[1:])))
+    service = service if service is not None else [0.0] * len(matrix)
+    first = windows[order[0]]
+    clock = start = first[0] if first else 0.0
+    late = 0.0
+    for previous, stop in zip(order, order[1:]):
+        clock += service[previous] + matrix[previous, stop]
+        window = windows[stop]
+        if window:
+            clock = max(clock, window[0])
+            late += max(0.0, clock - window[1])
+    return clock - start + LATE_PENALTY * late
+
+
+def held_karp(matrix: np.ndarray) -> List[int]:
+    """Exact shortest path from stop 0 to stop n-1 through every other stop."""
+    n = len(matrix)
+    if n <= 3:
+        return list(range(n))
+    inner = n - 2
+    full = (1 << inner) - 1
+    cost = np.full((1 << inner, inner), np.inf)
+    parent = np.full((1 << inner, inner), -1, dtype=int)
+    for j in range(inner):
+        cost[1 << j, j] = matrix[0, j + 1]
+    for subset in range(1, full + 1):
+        for j in range(inner):
+            if not subset & (1 << j) or cost[subset, j] == np.inf:
+                continue
+            for k in range(inner):
+                if subset & (1 << k):
+                    continue
+                extended = subset | (1 << k)
+                candidate = cost[subset, j] + matrix[j + 1, k + 1]
+                if candidate < cost[extended, k]:
+                    cost[extended, k] = candidate
+                    parent[extended, k] = j
+    last = int(np.argmin(cost[full] + matrix[1:-1, n - 1]))
+    order, subset = [], full
+    while last != -1:
+        order.append(last + 1)
+        subset, last = subset & ~(1 << last), parent[subset, last]
+    return [0] + order[::-1] + [n - 1]
+
+
+def nearest_neighbor(matrix: np.ndarray) -> List[int]:
+    """Greedy path from stop 0 to stop n-1, always driving to the closest unvisited stop."""
+    n = len(matrix)
+    order = [0]
+    remaining = set(range(1, n - 1))
+    while remaining:
+        nearest = min(remaining, key=lambda stop: matrix[order[-1], stop])
+        order.append(nearest)
+        remaining.remove(nearest)
+    return order + [n - 1] if n > 1 else order
+
+
+def improve(order: List[int], cost) -> List[int]:
+    """2-opt and Or-opt local search keeping the first and last stop pinned.
+
+    cost maps an order to its cost; moves are applied while any improves it.
+    """
+    best, best_cost = list(order), cost(order)
+    improved = True
+    while improved:
+        improved = False
+        # 2-opt: reverse a stretch of the path
+        for i in range(1, len(best) - 2):
+            for j in range(i + 1, len(best) - 1):
+                candidate = best[:i] + best[i:j + 1][::-1] + best[j + 1:]
+                candidate_cost = cost(candidate)
+                if candidate_cost < best_cost - 1e-9:
+                    best, best_cost, improved = candidate, candidate_cost, True
+        # Or-opt: move a run of one to three stops elsewhere
+        for length in (1, 2, 3):
+            for i in range(1, len(best) - length):
+                segment = best[i:i + length]
+                rest = best[:i] + best[i + length:]
+                for j in range(1, len(rest)):
+                    if j == i:
+                        continue
+                    candidate = rest[:j] + segment + rest[j:]
+                    candidate_cost = cost(candidate)
+                    if candidate_cost < best_cost - 1e-9:
+                        best, best_cost, improved = candidate, candidate_cost, True
+                        break
+    return best
+
+
+def optimize_order(
+    matrix,
+    windows: Optional[Sequence[Window]] = None,
+    service: Optional[Sequence[float]] = None
+) -> List[int]:
+    """Best visiting order of stops 0..n-1 with the first and last stop pinned.
+
+    matrix[i, j] is the travel time from stop i to stop j. Without time
+    windows small problems are solved exactly and larger ones with
+    nearest-neighbor plus 2-opt/Or-opt. With windows, small problems are
+    enumerated and larger ones use the local search on the simulated
+    schedule, seeded with the stops in time order.
+    """
+    matrix = np.asarray(matrix, dtype=float)
+    n = len(matrix)
+    if n <= 3:
+        return list(range(n))
+    if windows is None or not any(windows):
+        if n <= EXACT_MAX_STOPS:
+            return held_karp(matrix)
+        return improve(nearest_neighbor(matrix), lambda order: route_cost(order, matrix))
+
+    def cost(order):
+        return route_cost(order, matrix, windows, service)
+
+    if n <= 8:
+        return min(([0, *middle, n - 1] for middle in permutations(range(1, n - 1))), key=cost)
+    # Timed stops in time order, then the untimed ones
+    seed = sorted(range(1, n - 1), key=lambda stop: (windows[stop][0] if windows[stop] else float("inf"), stop))
+    return improve([0, *seed, n - 1], cost)
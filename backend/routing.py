@@ -0,0 +1,240 @@
+"""Pluggable routing providers.
+
+Every router answers directions() with a list of routes in the Google
+Directions format (legs, steps, polylines, bounds), so callers don't care
+which one is configured. ROUTER picks one per deployment:
+
+- google (default): Google Directions API
+- osrm: a self-hosted OSRM server at OSRM_SERVER
+- recorded: responses recorded as JSON files in ROUTER_RECORDINGS, for
+  offline runs and load tests
+"""
+import hashlib
+import json
+import os
+from typing import Callable, Dict, List, Optional, Union
+
+import geometry
+import http_clients
+import route_optimizer
+
+DEFAULT_RECORDINGS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "recorded_routes")
+
+Location = Union[str, Dict, tuple]
+
+
+def parse_point(location: Location) -> Optional[tuple]:
+    """(lat, lng) for a pair, {"lat", "lng"} dict or "lat,lng" string, else None."""
+    if isinstance(location, (tuple, list)) and len(location) == 2:
+        return float(location[0]), float(location[1])
+    if isinstance(location, dict) and "lat" in location and "lng" in location:
+        return float(location["lat"]), float(location["lng"])
+    parts = str(location).split(",")
+    if len(parts) == 2:
+        try:
+            return float(parts[0]), float(parts[1])
+        except ValueError:
+            pass
+    return None
+
+
+def _latlng(point) -> Dict:
+    return {"lat": float(point[0]), "lng": float(point[1])}
+
+
+def _distance(meters: float) -> Dict:
+    return {"text": f"{meters / 1000:.1f} km", "value": int(round(meters))}
+
+
+def _duration(seconds: float) -> Dict:
+    return {"text": f"{max(1, round(seconds / 60))} mins", "value": int(round(seconds))}
+
+
+def _bounds(points) -> Dict:
+    points = geometry.as_points(points)
+    north, east = points.max(axis=0)
+    south, west = points.min(axis=0)
+    return {"northeast": _latlng((north, east)), "southwest": _latlng((south, west))}
+
+
+class GoogleRouter:
+    """Directions from the Google Maps client."""
+
+    name = "google"
+
+    def __init__(self, client):
+        self.client = client
+
+    def directions(
+        self,
+        origin: Location,
+        destination: Location,
+        waypoints: Optional[List[Location]] = None,
+        mode: str = "driving",
+        alternatives: bool = False
+    ) -> List[Dict]:
+        return self.client.directions(origin, destination, waypoints=waypoints, mode=mode, alternatives=alternatives)
+
+
+class OSRMRouter:
+    """Directions from an OSRM server, converted to the Google format.
+
+    OSRM only routes between coordinates, so addresses go through
+    geocode first.
+    """
+
+    name = "osrm"
+    PROFILES = {"driving": "driving", "walking": "foot", "bicycling": "bike"}
+
+    def __init__(self, server: Optional[str] = None, geocode: Optional[Callable[[Location], Optional[tuple]]] = None):
+        self.server = (server or os.getenv("OSRM_SERVER", "http://router.project-osrm.org")).rstrip("/")
+        self.geocode = geocode
+
+    def _point(self, location: Location) -> Optional[tuple]:
+        point = parse_point(location)
+        if point is None and self.geocode:
+            point = self.geocode(location)
+        return point
+
+    def _step(self, step: Dict, end: tuple) -> Dict:
+        maneuver = step["maneuver"]
+        instruction = " ".join(part for part in (maneuver.get("type"), maneuver.get("modifier")) if part)
+        if step.get("name"):
+            instruction += f" onto {step['name']}"
+        lng, lat = maneuver["location"]
+        return {
+            "html_instructions": instruction[:1].upper() + instruction[1:],
+            "distance": _distance(step["distance"]),
+            "duration": _duration(step["duration"]),
+            "start_location": _latlng((lat, lng)),
+            "end_location": _latlng(end),
+            "polyline": {"points": step["geometry"]}
+        }
+
+    def directions(
+        self,
+        origin: Location,
+        destination: Location,
+        waypoints: Optional[List[Location]] = None,
+        mode: str = "driving",
+        alternatives: bool = False
+    ) -> List[Dict]:
+        points = [self._point(location) for location in [origin, *(waypoints or []), destination]]
+        if any(point is None for point in points):
+            return []
+        coordinates = ";".join(f"{lng},{lat}" for lat, lng in points)
+        response = http_clients.osrm.get(
+            f"{self.server}/route/v1/{self.PROFILES.get(mode, 'driving')}/{coordinates}",
+            params={"overview": "full", "steps": "true", "geometries": "polyline", "alternatives": str(alternatives).lower()}
+        )
+        data = response.json()
+        if data.get("code") != "Ok":
+            print(f"Error getting OSRM route: {data.get('code')}")
+            return []
+
+        routes = []
+        for route in data["routes"]:
+            legs = []
+            for index, leg in enumerate(route["legs"]):
+                steps = leg["steps"]
+                step_ends = [tuple(reversed(step["maneuver"]["location"])) for step in steps[1:]] + [points[index + 1]]
+                legs.append({
+                    "start_location": _latlng(points[index]),
+                    "end_location": _latlng(points[index + 1]),
+                    "distance": _distance(leg["distance"]),
+                    "duration": _duration(leg["duration"]),
+                    "steps": [self._step(step, end) for step, end in zip(steps, step_ends)]
+                })
+            routes.append({
+                "legs": legs,
+                "overview_polyline": {"points": route["geometry"]},
+                "bounds": _bounds(geometry.decode_polyline(route["geometry"]))
+            })
+        return routes
+
+
+class RecordedRouter:
+    """Replays directions recorded as one JSON file per request.
+
+    With a source router, requests missing from the recordings are sent to
+    it and its answer recorded. Without one, missing requests between
+    coordinates get a straight-line route, so load tests run with no
+    network at all.
+    """
+
+    name = "recorded"
+
+    def __init__(self, path: Optional[str] = None, source=None):
+        self.path = path or os.getenv("ROUTER_RECORDINGS", DEFAULT_RECORDINGS_PATH)
+        self.source = source
+
+    def _file(self, origin, destination, waypoints, mode, alternatives) -> str:
+        request = json.dumps([origin, destination, waypoints or [], mode, alternatives], sort_keys=True, default=str)
+        return os.path.join(self.path, hashlib.sha1(request.encode("utf-8")).hexdigest() + ".json")
+
+    def _straight_line(self, locations: List[Location]) -> List[Dict]:
+        points = [parse_point(location) for location in locations]
+        if any(point is None for point in points):
+            return []
+        legs = []
+        for start, end in zip(points, points[1:]):
+            meters = float(geometry.haversine(start[0], start[1], end[0], end[1])) * route_optimizer.ROAD_FACTOR
+            seconds = meters / (route_optimizer.DEFAULT_SPEED_KMH * 1000 / 3600)
+            legs.append({
+                "start_location": _latlng(start),
+                "end_location": _latlng(end),
+                "distance": _distance(meters),
+                "duration": _duration(seconds),
+                "steps": [{
+                    "html_instructions": "Head to destination",
+                    "distance": _distance(meters),
+                    "duration": _duration(seconds),
+                    "start_location": _latlng(start),
+                    "end_location": _latlng(end),
+                    "polyline": {"points": geometry.encode_polyline([start, end])}
+                }]
+            })
+        return [{"legs": legs, "overview_polyline": {"points": geometry.encode_polyline(points)}, "bounds": _bounds(points)}]
+
+    def directions(
+        self,
+        origin: Location,
+        destination: Location,
+        waypoints: Optional[List[Location]] = None,
+        mode: str = "driving",
+        alternatives: bool = False
+    ) -> List[Dict]:
+        path = self._file(origin, destination, waypoints, mode, alternatives)
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            pass
+        if self.source is None:
+            return self._straight_line([origin, *(waypoints or []), destination])
+
+        routes = self.source.directions(origin, destination, waypoints=waypoints, mode=mode, alternatives=alternatives)
+        os.makedirs(self.path, exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(routes, f)
+        return routes
+
+
+def create_router(gmaps_client=None, geocode: Optional[Callable[[Location], Optional[tuple]]] = None):
+    """Build the router selected by ROUTER.
+
+    ROUTER_RECORD_FROM (google or osrm) makes the recorded router fill in
+    missing recordings from that provider.
+    """
+    def provider(name):
+        if name == "osrm":
+            return OSRMRouter(geocode=geocode)
+        if name == "google":
+            return GoogleRouter(gmaps_client)
+        raise ValueError(f"Unknown router: {name}")
+
+    name = os.getenv("ROUTER", "google").lower()
+    if name == "recorded":
+        source = os.getenv("ROUTER_RECORD_FROM")
+        return RecordedRouter(source=provider(source.lower()) if source else None)
+    return provider(name)
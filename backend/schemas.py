@@ -0,0 +1,137 @@
+"""Tool schemas for structured model output.
+
+The item schemas in llm_json are turned into function-calling tools whose
+single argument is {"items": [...]}, so the model returns arguments that
+already match what llm_json validates and the prompts don't have to
+describe the format in prose.
+"""
+import os
+from typing import Dict, Optional
+
+from itinerary_patch import PATCH_OP_SCHEMA
+from llm_json import ITINERARY_ITEM_SCHEMA, SUGGESTION_SCHEMA, Schema
+
+JSON_TYPES = {str: "string", int: "integer", float: "number", bool: "boolean", dict: "object", list: "array"}
+
+ITINERARY_FIELD_DESCRIPTIONS = {
+    "id": "Unique identifier",
+    "type": "Activity type, e.g. transportation, attraction, food, accommodation",
+    "title": "Short name of the stop",
+    "description": "Detailed description",
+    "address": "Full street address that can be geocoded, e.g. \"123 Main St, City, State, Country\"",
+    "location": "Latitude and longitude as \"lat,lng\", e.g. \"40.7128,-74.0060\"",
+    "time": "Suggested time, e.g. \"10:00 AM\"",
+    "duration": "Estimated duration, e.g. \"2 hours\""
+}
+
+PATCH_FIELD_DESCRIPTIONS = {
+    "op": "One of add, remove, modify, move",
+    "id": "Id of the item to remove, modify or move",
+    "after": "Id of the item to place the added or moved item after; omit for the start",
+    "item": "The new item for add, with the usual itinerary fields",
+    "fields": "For modify, only the fields that change and their new values"
+}
+
+SUGGESTION_FIELD_DESCRIPTIONS = {
+    "name": "Name of the place",
+    "category": "Type of place, e.g. restaurant, landmark, gas station",
+    "address": "Address of the place",
+    "estimated_time_minutes": "Estimated travel time in minutes",
+    "description": "Brief description of the place",
+    "worth_visiting": "Why it's worth visiting"
+}
+
+
+def structured_output_enabled() -> bool:
+    """LLM_OUTPUT_MODE=prose turns tool calling off for models without it."""
+    return os.getenv("LLM_OUTPUT_MODE", "structured").lower() != "prose"
+
+
+# Request parameters a model without tool calling rejects
+TOOL_PARAMS = ("tools", "tool_choice", "functions", "function_call")
+
+
+def tools_unsupported(error: Exception) -> bool:
+    """Whether error means the model can't call tools, rather than a problem with this one request.
+
+    Only those errors should switch to prose prompts; context length,
+    content filter and other bad requests would fail the same way there.
+    """
+    if isinstance(error, NotImplementedError):
+        return True
+    param = getattr(error, "param", None) or ""
+    if any(name in str(param) for name in TOOL_PARAMS):
+        return True
+    code = getattr(error, "code", None) or ""
+    message = str(getattr(error, "message", "") or error).lower()
+    return code in ("unsupported_parameter", "unsupported_value") and "tool" in message
+
+
+def item_json_schema(schema: Schema, descriptions: Optional[Dict[str, str]] = None) -> Dict:
+    """JSON Schema for one item of an llm_json schema."""
+    descriptions = descriptions or {}
+    properties = {}
+    required = []
+    for field, expected in schema.items():
+        name = field.rstrip("?")
+        properties[name] = {"type": JSON_TYPES[expected]}
+        if name in descriptions:
+            properties[name]["description"] = descriptions[name]
+        if not field.endswith("?"):
+            required.append(name)
+    return {"type": "object", "properties": properties, "required": required}
+
+
+def list_tool(name: str, description: str, schema: Schema, descriptions: Optional[Dict[str, str]] = None) -> Dict:
+    """OpenAI function tool taking {"items": [item, ...]}."""
+    return {
+        "type": "function",
+        "function": {
+            "name": name,
+            "description": description,
+            "parameters": {
+                "type": "object",
+                "properties": {"items": {"type": "array", "items": item_json_schema(schema, descriptions)}},
+                "required": ["items"]
+            }
+        }
+    }
+
+
+def tool_choice(tool: Dict) -> Dict:
+    """Force the model to call tool."""
+    return {"type": "function", "function": {"name": tool["function"]["name"]}}
+
+
+def tool_arguments(message) -> str:
+    """Raw JSON arguments of the first tool call in a LangChain or OpenAI message, or ""."""
+    calls = getattr(message, "tool_calls", None) or []
+    if calls and hasattr(calls[0], "function"):
+        return calls[0].function.arguments or ""
+    raw_calls = getattr(message, "additional_kwargs", {}).get("tool_calls") or []
+    if raw_calls:
+        return raw_calls[0]["function"].get("arguments") or ""
+    return ""
+
+
+# The model is asked for every field; llm_json stays lenient about missing ones
+ITINERARY_TOOL = list_tool(
+    "save_itinerary",
+    "Save the planned itinerary items in visiting order.",
+    {field.rstrip("?"): expected for field, expected in ITINERARY_ITEM_SCHEMA.items()},
+    ITINERARY_FIELD_DESCRIPTIONS
+)
+
+PATCH_TOOL = list_tool(
+    "edit_itinerary",
+    "Apply the requested change as a list of operations on the current itinerary.",
+    PATCH_OP_SCHEMA,
+    PATCH_FIELD_DESCRIPTIONS
+)
+
+SUGGESTIONS_TOOL = list_tool(
+    "suggest_places",
+    "Return the suggested places.",
+    SUGGESTION_SCHEMA,
+    SUGGESTION_FIELD_DESCRIPTIONS
+)
@@ -0,0 +1,79 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Optional
+
+
+class Session:
+    def __init__(self, value: Any):
+        self.value = value
+        self.lock = threading.RLock()
+        self.last_used = time.time()
+
+
+class SessionStore:
+    """Per-client state keyed by session id, with LRU and idle-TTL eviction.
+
+    factory() builds the state for a new session. Each session has its own
+    lock so concurrent requests from one client are serialized while
+    different clients proceed in parallel.
+    """
+
+    def __init__(
+        self,
+        factory: Callable[[], Any],
+        maxsize: Optional[int] = None,
+        ttl: Optional[float] = None
+    ):
+        self.factory = factory
+        self.maxsize = int(maxsize if maxsize is not None else os.getenv("SESSION_STORE_SIZE", 1000))
+        self.ttl = float(ttl if ttl is not None else os.getenv("SESSION_TTL", 60 * 60))
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def _evict(self):
+        now = time.time()
+        # Sessions are kept in last-used order, so idle ones sit at the front
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if len(self._sessions) <= self.maxsize and now - session.last_used < self.ttl:
+                break
+            del self._sessions[session_id]
+            self.evictions += 1
+
+    def get(self, session_id: str) -> Session:
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None or time.time() - session.last_used >= self.ttl:
+                session = Session(self.factory())
+                self._sessions[session_id] = session
+            session.last_used = time.time()
+            self._sessions.move_to_end(session_id)
+            self._evict()
+            return session
+
+    @contextmanager
+    def session(self, session_id: str):
+        """Hold a session's lock and yield its state."""
+        session = self.get(session_id)
+        with session.lock:
+            yield session.value
+
+    def discard(self, session_id: str):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._sessions)
+
+    def stats(self) -> Dict:
+        return {
+            "sessions": len(self),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "evictions": self.evictions
+        }
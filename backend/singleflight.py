@@ -0,0 +1,59 @@
+"""Coalescing of identical in-flight calls.
+
+When many requests ask for the same thing at once, e.g. a trending route
+on a cold cache, only the first makes the upstream call and the rest wait
+for its result. Use the normalized cache key of what is being fetched as
+the flight key, so every call that would fill the same cache entry shares
+one flight.
+"""
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Hashable
+
+
+class SingleFlight:
+    """Runs at most one call per key at a time; callers with the same key share its outcome."""
+
+    def __init__(self):
+        self.calls = 0
+        self.coalesced = 0
+        self._flights: Dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: Hashable, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """Return fn(*args, **kwargs), or the result of the call already running for key.
+
+        An exception raised by the call is raised in every caller sharing it.
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = Future()
+                self.calls += 1
+            else:
+                self.coalesced += 1
+        if not leader:
+            return flight.result()
+
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            flight.set_exception(e)
+            raise
+        else:
+            flight.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._flights[key]
+
+    def stats(self) -> Dict:
+        with self._lock:
+            requests = self.calls + self.coalesced
+            return {
+                "in_flight": len(self._flights),
+                "calls": self.calls,
+                "coalesced": self.coalesced,
+                "coalesced_rate": round(self.coalesced / requests, 4) if requests else 0.0
+            }
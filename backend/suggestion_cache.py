@@ -0,0 +1,135 @@
+import os
+import re
+import threading
+from typing import Dict, List, Optional
+
+from cache import LRUCache
+from geocode_cache import normalize_address
+from http_clients import openai_http_client
+from vector_index import HashingEmbedder, cosine_similarity
+
+
+def normalize_message(message: str) -> str:
+    text = re.sub(r"[^\w\s]", " ", str(message or "").lower())
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def _normalize_stops(stops) -> str:
+    if not stops:
+        return ""
+    if isinstance(stops, (list, tuple)):
+        return "|".join(normalize_address(stop) for stop in stops)
+    return normalize_address(stops)
+
+
+class SuggestionCache:
+    """Response cache for /llm_chat place suggestions.
+
+    Exact tier: keyed on normalized (start, end, stops, message). Optional
+    semantic tier: a message on the same route whose embedding is at least
+    similarity_threshold similar to a cached one reuses that answer.
+    """
+
+    def __init__(
+        self,
+        maxsize: Optional[int] = None,
+        ttl: Optional[float] = None,
+        embeddings=None,
+        similarity_threshold: Optional[float] = None
+    ):
+        maxsize = int(maxsize if maxsize is not None else os.getenv("SUGGESTION_CACHE_SIZE", 1024))
+        ttl = float(ttl if ttl is not None else os.getenv("SUGGESTION_CACHE_TTL", 24 * 60 * 60))
+        self.entries = LRUCache(maxsize=maxsize, ttl=ttl or None)
+        self.embeddings = embeddings
+        self.similarity_threshold = float(
+            similarity_threshold if similarity_threshold is not None
+            else os.getenv("SUGGESTION_SIMILARITY_THRESHOLD", 0.9)
+        )
+        # route key -> [(message vector, exact key)] for the semantic tier
+        self._vectors: Dict[tuple, List[tuple]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+    def _route_key(self, data: Dict) -> tuple:
+        return (
+            normalize_address(data.get("start") or ""),
+            normalize_address(data.get("end") or ""),
+            _normalize_stops(data.get("stops"))
+        )
+
+    def make_key(self, data: Dict) -> tuple:
+        return self._route_key(data) + (normalize_message(data.get("message", "")),)
+
+    def get(self, data: Dict) -> Optional[List[Dict]]:
+        key = self.make_key(data)
+        suggestions = self.entries.get(key)
+        if suggestions is not None:
+            self._count("hits")
+            return suggestions
+        suggestions = self._get_similar(data, key) if self.embeddings is not None else None
+        self._count("misses" if suggestions is None else "semantic_hits")
+        return suggestions
+
+    def _count(self, counter: str):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _get_similar(self, data: Dict, key: tuple) -> Optional[List[Dict]]:
+        route_key = self._route_key(data)
+        with self._lock:
+            candidates = [
+                (vector, cached_key) for vector, cached_key in self._vectors.get(route_key, [])
+                if cached_key in self.entries
+            ]
+            self._vectors[route_key] = candidates
+        if not candidates:
+            return None
+        query = self.embeddings.embed_query(key[-1])
+        score, best_key = max(((cosine_similarity(query, vector), cached_key) for vector, cached_key in candidates),
+                              key=lambda pair: pair[0])
+        if score < self.similarity_threshold:
+            return None
+        return self.entries.get(best_key)
+
+    def set(self, data: Dict, suggestions: List[Dict]):
+        key = self.make_key(data)
+        self.entries.set(key, suggestions)
+        if self.embeddings is None:
+            return
+        vector = self.embeddings.embed_query(key[-1])
+        with self._lock:
+            self._vectors.setdefault(self._route_key(data), []).append((vector, key))
+
+    def clear(self):
+        self.entries.clear()
+        with self._lock:
+            self._vectors = {}
+
+    def stats(self) -> Dict:
+        with self._lock:
+            hits, semantic_hits, misses = self.hits, self.semantic_hits, self.misses
+        lookups = hits + semantic_hits + misses
+        return {
+            "size": len(self.entries),
+            "maxsize": self.entries.maxsize,
+            "semantic_enabled": self.embeddings is not None,
+            "hits": hits,
+            "semantic_hits": semantic_hits,
+            "misses": misses,
+            "hit_rate": round((hits + semantic_hits) / lookups, 4) if lookups else 0.0
+        }
+
+
+def create_suggestion_cache() -> SuggestionCache:
+    """Build the cache configured by SUGGESTION_CACHE_EMBEDDINGS (off, local or openai)."""
+    provider = os.getenv("SUGGESTION_CACHE_EMBEDDINGS", "off").lower()
+    embeddings = None
+    if provider == "local":
+        embeddings = HashingEmbedder()
+    elif provider == "openai":
+        from langchain_openai import OpenAIEmbeddings
+        # The shared client's transport queues and retries through the scheduler
+        embeddings = OpenAIEmbeddings(http_client=openai_http_client(), max_retries=0)
+    return SuggestionCache(embeddings=embeddings)
@@ -0,0 +1,261 @@
+"""Central scheduling and retries for calls to upstream APIs.
+
+Every OpenAI, Google Maps, OSRM and Nominatim call goes through
+scheduler.call(), by way of the HTTP transports in http_clients.
+Calls are queued per upstream key:
+
+- an optional token bucket per key (UPSTREAM_<KEY>_QPS) smooths bursts to
+  the quota instead of letting them turn into 429s
+- waiting calls are served by priority class, then in arrival order, so
+  interactive chat goes ahead of batch planning and background work
+- 429 and 5xx answers are retried with exponential backoff and jitter;
+  a 429 or Retry-After pauses the whole key, since the quota is shared, as
+  does a quota error reported in the body (throttled_if), like Google
+  Maps' OVER_QUERY_LIMIT
+
+Priority follows the calling context: wrap work in priority(BATCH) and use
+ContextThreadPoolExecutor for pools so tasks inherit the submitter's class.
+"""
+import contextvars
+import heapq
+import itertools
+import os
+import random
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Optional, Tuple, Type
+
+from rate_limiter import TokenBucket
+
+INTERACTIVE = 0
+BATCH = 1
+BACKGROUND = 2
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BATCH: "batch", BACKGROUND: "background"}
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Calls per second for keys without UPSTREAM_<KEY>_QPS; Google Maps
+# allows 50 per second per project by default
+DEFAULT_QPS = {"google_maps": 50}
+
+_priority = contextvars.ContextVar("upstream_priority", default=INTERACTIVE)
+
+
+@contextmanager
+def priority(level: int):
+    """Run upstream calls made inside the block with the given priority class."""
+    token = _priority.set(level)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def current_priority() -> int:
+    return _priority.get()
+
+
+class ContextThreadPoolExecutor(ThreadPoolExecutor):
+    """ThreadPoolExecutor whose tasks run in a copy of the submitter's context.
+
+    Tasks keep the submitter's priority class instead of falling back to
+    interactive on the pool's threads.
+    """
+
+    def submit(self, fn, /, *args, **kwargs):
+        return super().submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+def retryable_response(response) -> bool:
+    return getattr(response, "status_code", None) in RETRY_STATUSES
+
+
+def _status(outcome) -> Optional[int]:
+    status = getattr(outcome, "status_code", None)
+    if status is None:
+        status = getattr(getattr(outcome, "response", None), "status_code", None)
+    return status
+
+
+def _retry_after(outcome) -> Optional[float]:
+    """Seconds the upstream asked us to wait, from a Retry-After header or attribute."""
+    value = getattr(outcome, "retry_after", None)
+    if value is None:
+        headers = getattr(outcome, "headers", None)
+        if headers is None:
+            headers = getattr(getattr(outcome, "response", None), "headers", None)
+        value = headers.get("Retry-After") if headers is not None else None
+    try:
+        return max(0.0, float(value)) if value is not None else None
+    except (TypeError, ValueError):
+        # HTTP-date form; fall back to our own backoff
+        return None
+
+
+class UpstreamQueue:
+    """Admission queue for one upstream key."""
+
+    def __init__(self, name: str, rate: Optional[float] = None, burst: Optional[float] = None):
+        self.name = name
+        self.bucket = TokenBucket(rate, burst) if rate else None
+        self.in_flight = 0
+        self.max_queued = 0
+        self.calls = 0
+        self.retries = 0
+        self.throttled = 0
+        self.failures = 0
+        self._waited = 0.0
+        self._paused_until = 0.0
+        self._waiting = []
+        self._sequence = itertools.count()
+        self._changed = threading.Condition()
+
+    def acquire(self, level: int = INTERACTIVE):
+        """Wait until it is this caller's turn and the rate limit allows a call."""
+        entry = (level, next(self._sequence))
+        started = time.monotonic()
+        with self._changed:
+            heapq.heappush(self._waiting, entry)
+            self.max_queued = max(self.max_queued, len(self._waiting))
+            # A new head of the queue has to start watching the clock
+            self._changed.notify_all()
+            while True:
+                delay = None
+                if self._waiting[0] == entry:
+                    delay = self._paused_until - time.monotonic()
+                    if delay <= 0:
+                        if self.bucket is None or self.bucket.try_acquire():
+                            break
+                        delay = self.bucket.wait_time()
+                self._changed.wait(timeout=delay)
+            heapq.heappop(self._waiting)
+            self.in_flight += 1
+            self.calls += 1
+            self._waited += time.monotonic() - started
+            self._changed.notify_all()
+
+    def release(self):
+        with self._changed:
+            self.in_flight -= 1
+
+    def pause(self, seconds: float):
+        """Hold every queued call for seconds, e.g. after a 429."""
+        with self._changed:
+            self.throttled += 1
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._changed.notify_all()
+
+    def count(self, counter: str):
+        with self._changed:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def stats(self) -> Dict:
+        with self._changed:
+            queued = Counter(level for level, _ in self._waiting)
+            return {
+                "qps": self.bucket.rate if self.bucket else None,
+                "queued": {name: queued.get(level, 0) for level, name in PRIORITY_NAMES.items()},
+                "max_queued": self.max_queued,
+                "in_flight": self.in_flight,
+                "calls": self.calls,
+                "retries": self.retries,
+                "throttled": self.throttled,
+                "failures": self.failures,
+                "avg_wait_ms": round(self._waited / self.calls * 1000, 1) if self.calls else 0.0
+            }
+
+
+class UpstreamScheduler:
+    """Queues, rate-limits and retries upstream calls by key."""
+
+    def __init__(
+        self,
+        max_retries: Optional[int] = None,
+        backoff_base: Optional[float] = None,
+        backoff_max: Optional[float] = None
+    ):
+        self.max_retries = int(max_retries if max_retries is not None else os.getenv("UPSTREAM_MAX_RETRIES", 4))
+        self.backoff_base = float(backoff_base if backoff_base is not None else os.getenv("UPSTREAM_BACKOFF_BASE", 0.5))
+        self.backoff_max = float(backoff_max if backoff_max is not None else os.getenv("UPSTREAM_BACKOFF_MAX", 20))
+        self._queues: Dict[str, UpstreamQueue] = {}
+        self._lock = threading.Lock()
+
+    def queue(self, key: str) -> UpstreamQueue:
+        with self._lock:
+            if key not in self._queues:
+                prefix = f"UPSTREAM_{key.upper()}"
+                rate = os.getenv(f"{prefix}_QPS", DEFAULT_QPS.get(key))
+                burst = os.getenv(f"{prefix}_BURST")
+                self._queues[key] = UpstreamQueue(
+                    key,
+                    rate=float(rate) if rate else None,
+                    burst=float(burst) if burst else None
+                )
+            return self._queues[key]
+
+    def backoff(self, attempt: int) -> float:
+        """Exponential backoff for a retry, with half of it randomized."""
+        ceiling = min(self.backoff_max, self.backoff_base * 2 ** attempt)
+        return ceiling / 2 + random.uniform(0, ceiling / 2)
+
+    def call(
+        self,
+        key: str,
+        fn: Callable[..., Any],
+        *args,
+        retry_if: Optional[Callable[[Any], bool]] = None,
+        retry_on: Tuple[Type[BaseException], ...] = (),
+        throttled_if: Optional[Callable[[Any], bool]] = None,
+        **kwargs
+    ) -> Any:
+        """Run fn(*args, **kwargs) as a call to upstream key.
+
+        Results for which retry_if is true and exceptions of the retry_on
+        types are retried up to max_retries times; after that the last
+        result is returned or the exception raised. Results for which
+        throttled_if is true are retried too, and pause the whole key like
+        a 429. Results that are retried are closed if they have a close()
+        method.
+        """
+        queue = self.queue(key)
+        for attempt in itertools.count():
+            queue.acquire(current_priority())
+            throttled = False
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                queue.release()
+                if not isinstance(e, retry_on) or attempt >= self.max_retries:
+                    queue.count("failures")
+                    raise
+                outcome = e
+            else:
+                queue.release()
+                throttled = throttled_if is not None and throttled_if(result)
+                retry = throttled or (retry_if is not None and retry_if(result))
+                if not retry or attempt >= self.max_retries:
+                    return result
+                outcome = result
+
+            retry_after = _retry_after(outcome)
+            delay = max(self.backoff(attempt), retry_after or 0)
+            queue.count("retries")
+            print(f"Retrying {key} call in {delay:.1f}s ({_status(outcome) or type(outcome).__name__})")
+            if not isinstance(outcome, BaseException) and hasattr(outcome, "close"):
+                outcome.close()
+            if throttled or _status(outcome) == 429 or retry_after is not None:
+                # The quota is shared, so everyone waits
+                queue.pause(delay)
+            else:
+                time.sleep(delay)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            queues = list(self._queues.values())
+        return {queue.name: queue.stats() for queue in queues}
+
+
+scheduler = UpstreamScheduler()
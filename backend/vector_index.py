@@ -0,0 +1,126 @@
+import hashlib
+import json
+import math
+import os
+import re
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+# Embedding runs off the request path on a small pool shared by all sessions
+_embedding_pool = ThreadPoolExecutor(
+    max_workers=int(os.getenv("EMBEDDING_WORKERS", 2)),
+    thread_name_prefix="embed"
+)
+
+
+class HashingEmbedder:
+    """Deterministic local embedder (feature hashing of word tokens).
+
+    Has the same embed_documents/embed_query interface as the langchain
+    embeddings, so it can stand in for OpenAIEmbeddings in tests or offline.
+    """
+
+    def __init__(self, dimensions: int = 256):
+        self.dimensions = dimensions
+
+    def embed_query(self, text: str) -> List[float]:
+        vector = [0.0] * self.dimensions
+        for token in re.findall(r"\w+", str(text).lower()):
+            digest = hashlib.md5(token.encode("utf-8")).digest()
+            index = int.from_bytes(digest[:4], "little") % self.dimensions
+            vector[index] += 1.0 if digest[4] % 2 else -1.0
+        norm = math.sqrt(sum(value * value for value in vector))
+        return [value / norm for value in vector] if norm else vector
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self.embed_query(text) for text in texts]
+
+
+def item_text(item: Dict) -> str:
+    """Text embedded for one itinerary item."""
+    fields = ("title", "type", "description", "address", "time")
+    return ". ".join(str(item[field]) for field in fields if item.get(field))
+
+
+def content_hash(item: Dict) -> str:
+    return hashlib.sha1(json.dumps(item, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def cosine_similarity(a: List[float], b: List[float]) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+
+class ItineraryIndex:
+    """Incremental vector index over itinerary items.
+
+    Items are keyed by content hash, so update() only embeds items that are
+    new or changed since the last call. Embedding happens in the background
+    unless background=False; search() only sees items already embedded.
+    """
+
+    def __init__(self, embeddings, background: bool = True):
+        self.embeddings = embeddings
+        self.background = background
+        self._items: Dict[str, Dict] = {}
+        self._vectors: Dict[str, List[float]] = {}
+        self._lock = threading.Lock()
+        self._pending: Optional[Future] = None
+
+    def update(self, itinerary: Optional[List[Dict]]):
+        items = {content_hash(item): item for item in itinerary or [] if isinstance(item, dict)}
+        with self._lock:
+            self._items = items
+            for key in list(self._vectors):
+                if key not in items:
+                    del self._vectors[key]
+            changed = [key for key in items if key not in self._vectors]
+        if not changed:
+            return
+        if self.background:
+            self._pending = _embedding_pool.submit(self._embed, changed)
+        else:
+            self._embed(changed)
+
+    def _embed(self, keys: List[str]):
+        with self._lock:
+            texts = [item_text(self._items[key]) for key in keys if key in self._items]
+            keys = [key for key in keys if key in self._items]
+        if not keys:
+            return
+        try:
+            vectors = self.embeddings.embed_documents(texts)
+        except Exception as e:
+            print(f"Error embedding itinerary items: {str(e)}")
+            return
+        with self._lock:
+            for key, vector in zip(keys, vectors):
+                # Skip items replaced while the embedding call was running
+                if key in self._items:
+                    self._vectors[key] = vector
+
+    def wait(self, timeout: Optional[float] = None):
+        """Block until the latest background update has been applied."""
+        if self._pending is not None:
+            self._pending.result(timeout)
+
+    def search(self, query: str, k: int = 3) -> List[Dict]:
+        """Return up to k itinerary items most similar to query."""
+        with self._lock:
+            candidates = [(self._items[key], vector) for key, vector in self._vectors.items()]
+        if not candidates:
+            return []
+        query_vector = self.embeddings.embed_query(query)
+        ranked = sorted(candidates, key=lambda pair: cosine_similarity(query_vector, pair[1]), reverse=True)
+        return [item for item, _ in ranked[:k]]
+
+    def clear(self):
+        with self._lock:
+            self._items = {}
+            self._vectors = {}
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._vectors)
@@ -4,6 +4,10 @@ import { Link } from 'react-router-dom';
 import axios from 'axios';
 import './ItineraryPage.css';
 
+// Lets the backend keep this tab's itinerary and chat history separate from other users'
+const SESSION_ID = window.crypto?.randomUUID?.() || `${Date.now()}-${Math.random().toString(36).slice(2)}`;
+const SESSION_HEADERS = { headers: { "X-Session-Id": SESSION_ID } };
+
 function ItineraryPage() {
   const [itineraryItems, setItineraryItems] = useState([]);
   const [routeData, setRouteData] = useState(null);
@@ -116,7 +120,7 @@ function ItineraryPage() {
       const response = await axios.post("http://127.0.0.1:5000/update_itinerary", {
         user_request: "Update route based on modified itinerary",
         current_itinerary: items
-      });
+      }, SESSION_HEADERS);
       
       if (response.data.route && !response.data.route.error) {
         setRouteData(response.data.route);
@@ -134,7 +138,7 @@ function ItineraryPage() {
 
   const handleClearItinerary = async () => {
     try {
-      const response = await axios.post("http://127.0.0.1:5000/clear_itinerary");
+      const response = await axios.post("http://127.0.0.1:5000/clear_itinerary", {}, SESSION_HEADERS);
       setItineraryItems([]);
       setRouteData(null);
       setChatHistory([]);
@@ -170,7 +174,7 @@ function ItineraryPage() {
         start_location: startLocation || "Times Square, New York, NY",
         end_location: endLocation || startLocation || "Times Square, New York, NY",
         current_location: { lat: 40.7580, lng: -73.9855 }
-      });
+      }, SESSION_HEADERS);
 
       console.log("Backend response:", response.data);
 
@@ -0,0 +1,10 @@
+import os
+import sys
+
+# Backend modules import each other by bare name (they are run from backend/),
+# so make that directory importable for the tests as well.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
+
+# Keep the on-disk caches out of the working tree during tests
+os.environ.setdefault("GEOCODE_CACHE_PATH", "")
+os.environ.setdefault("PLACE_INDEX_PATH", "")
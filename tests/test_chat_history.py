@@ -0,0 +1,41 @@
+import json
+
+from backend import chat_history as core
+
+
+def test_history_stays_within_token_budget():
+    history = core.ChatHistory(max_tokens=80, keep_turns=3)
+    for i in range(200):
+        history.add_turn(f"please add stop number {i} near the lake", "Updating itinerary")
+    rendered = history.render()
+    assert history.token_count() <= 80
+    assert "stop number 199" in rendered
+    assert "stop number 0 " not in rendered
+    assert len(history.turns) == 3
+
+
+def test_older_turns_are_summarized():
+    history = core.ChatHistory(max_tokens=500, keep_turns=1)
+    history.add_turn("start in Urbana", "Generating new itinerary")
+    history.add_turn("add a coffee stop", "Updating itinerary")
+    rendered = history.render()
+    assert rendered.startswith("Earlier requests: start in Urbana")
+    assert "User: add a coffee stop" in rendered
+
+
+def test_compact_itinerary_drops_unused_fields():
+    itinerary = [{"id": "1", "title": "Lunch", "marker": {"lat": 1}, "duration": "", "time": "12:00 PM"}]
+    assert json.loads(core.compact_itinerary(itinerary)) == [{"id": "1", "title": "Lunch", "time": "12:00 PM"}]
+
+
+def test_restore_fields_keeps_what_the_prompt_left_out():
+    original = [
+        {"id": "1", "title": "Lunch", "marker": {"lat": 1}, "duration": "", "time": "12:00 PM"},
+        {"id": "2", "title": "Museum", "time": "2:00 PM"}
+    ]
+    rewritten = json.loads(core.compact_itinerary(original))
+    rewritten[0]["time"] = "1:00 PM"
+    rewritten.append({"id": "3", "title": "Dinner"})
+    restored = core.restore_fields(original, rewritten)
+    assert restored[0] == {"id": "1", "title": "Lunch", "marker": {"lat": 1}, "duration": "", "time": "1:00 PM"}
+    assert restored[2] == {"id": "3", "title": "Dinner"}
@@ -0,0 +1,44 @@
+import time
+
+from backend import geocode_cache as core
+
+
+def test_normalize_address():
+    assert core.normalize_address("  123 Main St.,Urbana ,  IL ") == "123 main st, urbana, il"
+    assert core.normalize_address("Times Square") == core.normalize_address("times   square")
+
+
+def test_get_or_fetch_caches_results(tmp_path):
+    cache = core.GeocodeCache(path=str(tmp_path / "geo.sqlite3"))
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        return {"lat": 40.0, "lng": -88.0, "formatted_address": "Urbana, IL"}
+
+    assert cache.get_or_fetch("Urbana, IL", fetch)["lat"] == 40.0
+    assert cache.get_or_fetch("urbana,  il", fetch)["lng"] == -88.0
+    assert len(calls) == 1
+    assert cache.stats()["hits"] == 1
+
+
+def test_failed_lookups_are_not_cached(tmp_path):
+    cache = core.GeocodeCache(path="")
+    assert cache.get_or_fetch("Nowhere", lambda: None) is None
+    assert cache.get("Nowhere") is None
+
+
+def test_disk_tier_survives_restart(tmp_path):
+    path = str(tmp_path / "geo.sqlite3")
+    core.GeocodeCache(path=path).set("Chicago, IL", {"lat": 41.9, "lng": -87.6}, provider="nominatim")
+    cache = core.GeocodeCache(path=path)
+    assert cache.get("Chicago, IL", provider="nominatim") == {"lat": 41.9, "lng": -87.6}
+    assert cache.get("Chicago, IL", provider="google") is None
+    assert cache.stats()["disk_hits"] == 1
+
+
+def test_entries_expire(tmp_path):
+    cache = core.GeocodeCache(path=str(tmp_path / "geo.sqlite3"), ttl=0.01)
+    cache.set("Champaign, IL", {"lat": 40.1, "lng": -88.2})
+    time.sleep(0.02)
+    assert cache.get("Champaign, IL") is None
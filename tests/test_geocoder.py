@@ -0,0 +1,44 @@
+import time
+
+from backend import geocoder as core
+from backend.geocode_cache import GeocodeCache
+from backend.rate_limiter import CircuitBreaker, TokenBucket
+
+
+def _provider(name, lookup, breaker=None):
+    return core.GeocodeProvider(name, lookup, TokenBucket(100), breaker=breaker)
+
+
+def _answer(lat):
+    return lambda address: {"lat": lat, "lng": -88.0, "formatted_address": address}
+
+
+def test_slow_primary_is_hedged_to_secondary():
+    def slow(address):
+        time.sleep(0.5)
+        return _answer(1.0)(address)
+
+    geocoder = core.Geocoder(
+        [_provider("google", slow), _provider("nominatim", _answer(2.0))],
+        cache=GeocodeCache(path=""),
+        hedge_delay=0.05
+    )
+    assert geocoder.geocode("Urbana, IL")["lat"] == 2.0
+    assert geocoder.stats()["hedge_wins"] == 1
+    # The answer is cached under the provider that gave it
+    assert geocoder.cached("urbana, il")["lat"] == 2.0
+
+
+def test_failing_primary_fails_over_and_opens_breaker():
+    def broken(address):
+        raise RuntimeError("503")
+
+    breaker = CircuitBreaker(failure_threshold=2, reset_after=60)
+    primary = _provider("google", broken, breaker)
+    geocoder = core.Geocoder([primary, _provider("nominatim", _answer(2.0))], cache=GeocodeCache(path=""))
+    for address in ("a", "b", "c"):
+        assert geocoder.geocode(address)["lat"] == 2.0
+    assert breaker.state == "open"
+    # The third lookup skipped the broken provider altogether
+    assert primary.calls == 2
+    assert geocoder.stats()["failovers"] == 2
@@ -0,0 +1,37 @@
+import numpy as np
+import polyline
+import pytest
+
+from backend import geometry as core
+
+
+def test_decode_polyline_matches_reference_decoder():
+    encoded = "_p~iF~ps|U_ulLnnqC_mqNvxq`@"
+    assert core.decode_polyline(encoded).tolist() == [list(point) for point in polyline.decode(encoded)]
+    assert core.decode_polyline("").shape == (0, 2)
+
+
+@pytest.mark.parametrize("encoded", ["_p~iF~ps|U_ulLnnqC_mqNvxq", "_p~iF~ps|U_ulL", "_p~iF~ps|U\n"])
+def test_decode_polyline_rejects_truncated_input(encoded):
+    with pytest.raises(ValueError, match="Invalid polyline"):
+        core.decode_polyline(encoded)
+
+
+def test_cumulative_distances():
+    distances = core.cumulative_distances([(0, 0), (0, 1), (0, 2)])
+    assert distances[0] == 0
+    assert distances[-1] == pytest.approx(2 * 111195, rel=1e-3)
+
+
+def test_resample_at_fixed_interval():
+    points = core.resample([(40.0, -88.0), (40.0, -87.0)], 1000)
+    steps = np.diff(core.cumulative_distances(points))
+    assert np.allclose(steps[:-1], 1000)
+    assert points[-1].tolist() == [40.0, -87.0]
+
+
+def test_douglas_peucker_keeps_corners():
+    line = [(40.0, -88.0 + i * 0.01) for i in range(50)] + [(40.0 + i * 0.01, -87.51) for i in range(1, 50)]
+    simplified = core.douglas_peucker(line, 5)
+    assert len(simplified) == 3
+    assert simplified[1].tolist() == [40.0, pytest.approx(-87.51)]
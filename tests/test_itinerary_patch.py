@@ -0,0 +1,49 @@
+import pytest
+
+from backend import itinerary_patch as core
+
+
+def itinerary():
+    return [{"id": str(i), "title": f"Stop {i}", "location": f"Place {i}"} for i in range(1, 5)]
+
+
+def test_ops_apply_in_order_without_touching_original():
+    original = itinerary()
+    patched = core.apply_patch(original, [
+        {"op": "remove", "id": "2"},
+        {"op": "modify", "id": "3", "fields": {"time": "1:00 PM", "id": "99"}},
+        {"op": "add", "item": {"id": "1", "title": "Lunch", "description": "Lunch", "address": "Main St"}, "after": "3"},
+        {"op": "move", "id": "4"},
+    ])
+    assert [item["id"] for item in patched] == ["4", "1", "3", "5"]
+    assert patched[2]["time"] == "1:00 PM" and patched[3]["title"] == "Lunch"
+    assert original == itinerary()
+
+
+@pytest.mark.parametrize("op", [
+    {"op": "remove", "id": "9"},
+    {"op": "modify", "id": "1"},
+    {"op": "add", "item": {"title": "Nowhere", "description": "No place given"}},
+    {"op": "add", "item": {"title": "Lunch", "address": "Main St"}},
+    {"op": "add", "item": {"description": "Lunch", "address": "Main St", "time": {"at": "noon"}}},
+    {"op": "modify", "id": "1", "fields": {"time": ["noon"]}},
+    {"op": "modify", "id": "1", "fields": {"location": None}},
+    {"op": "move", "id": "1", "after": "1"},
+    {"op": "rename", "id": "1"},
+])
+def test_invalid_ops_are_rejected(op):
+    with pytest.raises(core.PatchError):
+        core.apply_patch(itinerary(), [op])
+
+
+def test_missing_and_duplicate_ids_are_filled():
+    assert [item["id"] for item in core.ensure_ids([{"id": 2}, {}, {"id": "2"}])] == ["2", "3", "4"]
+
+
+def test_added_and_modified_fields_are_coerced():
+    patched = core.apply_patch(itinerary(), [
+        {"op": "add", "item": {"description": "Lunch", "location": {"lat": 40.1, "lng": -88.2}}},
+        {"op": "modify", "id": "2", "fields": {"location": [40.2, -88.3], "duration": 90}},
+    ])
+    assert patched[0]["location"] == "40.1,-88.2"
+    assert patched[2]["location"] == "40.2,-88.3" and patched[2]["duration"] == "90"
@@ -0,0 +1,23 @@
+import json
+
+from backend import json_stream as core
+
+
+def test_items_are_emitted_as_they_complete():
+    items = [{"id": "1", "description": "braces } and ] in \"text\""}, {"id": "2", "tags": ["a", {"b": 1}]}]
+    text = "Here you go:\n```json\n" + json.dumps(items) + "\n```"
+    parser = core.JSONArrayStream()
+    emitted = []
+    for i in range(0, len(text), 5):
+        emitted.append(parser.feed(text[i:i + 5]))
+    assert [item for batch in emitted for item in batch] == items
+    assert parser.finished
+    # the first item is available before the stream ends
+    first = next(i for i, batch in enumerate(emitted) if batch)
+    assert first < len(emitted) - 1
+
+
+def test_truncated_item_is_not_emitted():
+    parser = core.JSONArrayStream()
+    assert parser.feed('[{"id": "1"}, {"id": "2", "title": "Unfin') == [{"id": "1"}]
+    assert not parser.finished
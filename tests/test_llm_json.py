@@ -0,0 +1,83 @@
+import pytest
+
+from backend import llm_json as core
+
+
+def test_fenced_array_with_prose_and_trailing_comma():
+    text = 'Here is your plan:\n```json\n[{"id": 1, "description": "Lunch", "location": "Urbana, IL"},]\n```\nEnjoy!'
+    items = core.parse_json_array(text, core.ITINERARY_ITEM_SCHEMA)
+    assert items == [{"id": "1", "description": "Lunch", "location": "Urbana, IL"}]
+
+
+def test_truncated_array_keeps_complete_items():
+    text = '[{"name": "A"}, {"name": "B"}, {"name": "C", "desc'
+    items, truncated = core.extract_array(text)
+    assert items == [{"name": "A"}, {"name": "B"}] and truncated
+
+
+def test_object_wrapper_and_single_item():
+    assert core.extract_array('{"itinerary": [{"a": 1}]}') == ([{"a": 1}], False)
+    assert core.extract_array('Sure! {"a": 1}') == ([{"a": 1}], False)
+
+
+def test_invalid_items_are_dropped_and_numbers_coerced():
+    text = '[{"name": "A", "category": "cafe", "address": "x", "estimated_time_minutes": "15 minutes", ' \
+           '"description": "d", "worth_visiting": "w"}, {"name": "B"}]'
+    items = core.parse_json_array(text, core.SUGGESTION_SCHEMA)
+    assert [item["name"] for item in items] == ["A"]
+    assert items[0]["estimated_time_minutes"] == 15
+
+
+def test_repair_is_tried_once():
+    prompts = []
+
+    def repair(prompt):
+        prompts.append(prompt)
+        return '[{"description": "Fixed", "address": "Chicago"}]'
+
+    items = core.parse_with_repair("Sorry, I can't do that.", repair, core.ITINERARY_ITEM_SCHEMA)
+    assert items[0]["description"] == "Fixed" and len(prompts) == 1
+    assert "description" in prompts[0]
+    with pytest.raises(core.LLMJSONError):
+        core.parse_with_repair("nope", lambda prompt: "still nope")
+
+
+def test_tool_arguments_parse_against_the_same_schema():
+    from backend import schemas
+    from langchain_core.messages import AIMessage
+
+    parameters = schemas.SUGGESTIONS_TOOL["function"]["parameters"]
+    item = parameters["properties"]["items"]["items"]
+    assert item["properties"]["estimated_time_minutes"]["type"] == "integer"
+    assert set(item["required"]) == {field.rstrip("?") for field in core.SUGGESTION_SCHEMA}
+
+    arguments = '{"items": [{"description": "Lunch", "address": "Urbana"}]}'
+    message = AIMessage(content="", additional_kwargs={"tool_calls": [
+        {"id": "call", "type": "function", "function": {"name": "save_itinerary", "arguments": arguments}}
+    ]})
+    assert core.parse_json_array(schemas.tool_arguments(message), core.ITINERARY_ITEM_SCHEMA) == [
+        {"description": "Lunch", "address": "Urbana"}
+    ]
+
+
+def test_only_tool_errors_switch_to_prose():
+    import httpx
+    import openai
+    from backend import schemas
+
+    def bad_request(message, code=None, param=None):
+        response = httpx.Response(400, request=httpx.Request("POST", "https://api.openai.com/v1/chat/completions"))
+        return openai.BadRequestError(message, response=response, body={"code": code, "param": param})
+
+    assert schemas.tools_unsupported(NotImplementedError())
+    assert schemas.tools_unsupported(bad_request("tools is not supported with this model", "unsupported_parameter", "tools"))
+    assert not schemas.tools_unsupported(bad_request("maximum context length exceeded", "context_length_exceeded", "messages"))
+    assert not schemas.tools_unsupported(bad_request("content filtered", "content_filter"))
+
+
+def test_coordinate_objects_are_normalized_and_bad_optional_fields_dropped():
+    text = '[{"description": "A", "location": {"lat": 40.1, "lng": -88.2}}, ' \
+           '{"description": "B", "location": [40.2, -88.3], "time": {"at": "noon"}}]'
+    items = core.parse_json_array(text, core.ITINERARY_ITEM_SCHEMA)
+    assert [item["location"] for item in items] == ["40.1,-88.2", "40.2,-88.3"]
+    assert "time" not in items[1]
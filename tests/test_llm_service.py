@@ -0,0 +1,73 @@
+import json
+
+import pytest
+
+from backend import llm_service as core
+from backend.vector_index import HashingEmbedder
+
+
+class Message:
+    def __init__(self, content):
+        self.content = content
+
+
+class FakeChat:
+    """Chat model that answers every prompt with the same text."""
+
+    def __init__(self, text):
+        self.text = text
+        self.prompts = []
+
+    def invoke(self, prompt):
+        self.prompts.append(prompt)
+        return Message(self.text)
+
+    def stream(self, prompt):
+        self.prompts.append(prompt)
+        for start in range(0, len(self.text), 7):
+            yield Message(self.text[start:start + 7])
+
+
+@pytest.fixture
+def make_service(monkeypatch):
+    monkeypatch.setenv("VECTOR_INDEX_ENABLED", "false")
+
+    def make(text, repair_text="[]"):
+        service = core.LLMService(llm=FakeChat(text), repair_llm=FakeChat(repair_text), embeddings=HashingEmbedder())
+        service.structured_output = False
+        return service
+
+    return make
+
+
+def test_streamed_items_are_validated(make_service):
+    text = json.dumps([
+        {"description": "Breakfast", "location": {"lat": 40.1, "lng": -88.2}},
+        {"title": "No description", "address": "1 Main St, Urbana, IL"},
+        {"description": "Nowhere in particular"},
+        {"id": "9", "description": "Museum", "address": "500 S Goodwin Ave, Urbana, IL", "time": {"at": "noon"}}
+    ])
+    items = list(make_service(text).stream_itinerary("a day in Urbana"))
+    assert items == [
+        {"id": "1", "description": "Breakfast", "location": "40.1,-88.2"},
+        {"id": "9", "description": "Museum", "address": "500 S Goodwin Ave, Urbana, IL"}
+    ]
+
+
+def test_stream_with_no_usable_items_is_repaired(make_service):
+    repaired = json.dumps([{"description": "Lunch", "address": "1 Main St, Urbana, IL"}])
+    service = make_service('[{"title": "Lunch"}]', repair_text=repaired)
+    assert list(service.stream_itinerary("lunch in Urbana")) == [
+        {"id": "1", "description": "Lunch", "address": "1 Main St, Urbana, IL"}
+    ]
+
+
+def test_new_session_edits_the_itinerary_it_is_sent(make_service):
+    service = make_service('[{"op": "remove", "id": "2"}]')
+    itinerary = [
+        {"id": "1", "description": "Lunch", "address": "1 Main St, Urbana, IL"},
+        {"id": "2", "description": "Museum", "address": "500 S Goodwin Ave, Urbana, IL"}
+    ]
+    assert service.current_itinerary is None
+    assert service.update_itinerary("skip the museum", itinerary) == itinerary[:1]
+    assert service.current_itinerary == itinerary[:1]
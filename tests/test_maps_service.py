@@ -0,0 +1,192 @@
+import polyline
+import pytest
+
+from backend import maps_service as core
+
+
+def _latlng(point):
+    lat, lng = map(float, point.split(","))
+    return {"lat": lat, "lng": lng}
+
+
+class FakeGoogleMaps:
+    def __init__(self):
+        self.directions_calls = []
+        self.matrix_calls = []
+
+    def geocode(self, address):
+        return [{"geometry": {"location": {"lat": 40.0 + len(address) / 100, "lng": -88.0}}}]
+
+    def distance_matrix(self, origins, destinations, **kwargs):
+        assert len(origins) <= 25 and len(destinations) <= 25 and len(origins) * len(destinations) <= 100
+        self.matrix_calls.append((origins, destinations))
+        return {"rows": [
+            {"elements": [
+                {"status": "OK", "duration": {"value": 60}, "distance": {"value": 1000}}
+                for _ in destinations
+            ]}
+            for _ in origins
+        ]}
+
+    def directions(self, origin, destination, waypoints=None, **kwargs):
+        self.directions_calls.append((origin, destination, waypoints))
+        points = [origin, *(waypoints or []), destination]
+        legs = []
+        for start, end in zip(points, points[1:]):
+            line = polyline.encode([tuple(_latlng(start).values()), tuple(_latlng(end).values())])
+            legs.append({
+                "start_location": _latlng(start),
+                "end_location": _latlng(end),
+                "distance": {"text": "1 km", "value": 1000},
+                "duration": {"text": "1 min", "value": 60},
+                "steps": [{
+                    "html_instructions": "Drive",
+                    "distance": {"text": "1 km", "value": 1000},
+                    "duration": {"text": "1 min", "value": 60},
+                    "start_location": _latlng(start),
+                    "end_location": _latlng(end),
+                    "polyline": {"points": line}
+                }]
+            })
+        return [{
+            "legs": legs,
+            "bounds": {"northeast": {"lat": 41, "lng": -87}, "southwest": {"lat": 40, "lng": -88}},
+            "overview_polyline": {"points": "overview"}
+        }]
+
+
+@pytest.fixture
+def service(monkeypatch):
+    monkeypatch.setenv("GOOGLE_MAPS_KEY", "AIzaFAKE")
+    monkeypatch.setenv("GEOCODE_CACHE_PATH", "")
+    maps = core.MapsService()
+    maps.gmaps = FakeGoogleMaps()
+    maps.router = core.routing.GoogleRouter(maps.gmaps)
+    return maps
+
+
+def test_route_data_keeps_itinerary_order(service):
+    itinerary = [{"address": "a" * i, "title": f"Stop {i}"} for i in range(1, 5)]
+    route = service.get_route_data(itinerary)
+    assert [marker["title"] for marker in route["markers"]] == ["Stop 1", "Stop 2", "Stop 3", "Stop 4"]
+    assert len(route["legs"]) == 3
+
+
+def test_text_only_edit_is_served_from_cache(service):
+    itinerary = [{"address": "a"}, {"address": "bb", "title": "Old"}, {"address": "ccc"}]
+    service.get_route_data(itinerary)
+    calls = len(service.gmaps.directions_calls)
+    itinerary[1]["title"] = "New"
+    route = service.get_route_data(itinerary)
+    assert len(service.gmaps.directions_calls) == calls
+    assert route["markers"][1]["title"] == "New"
+
+
+def test_changed_stop_only_fetches_its_legs(service):
+    itinerary = [{"address": "a" * i} for i in range(1, 9)]
+    service.get_route_data(itinerary)
+    itinerary[4] = {"address": "z" * 20}
+    route = service.get_route_data(itinerary)
+    fetched = service.gmaps.directions_calls[1:]
+    assert len(fetched) == 2
+    assert all(waypoints is None for _, _, waypoints in fetched)
+    assert len(route["legs"]) == 7
+    overview = polyline.decode(route["overview_polyline"])
+    assert overview[0] == (40.01, -88.0) and overview[-1] == (40.08, -88.0)
+    assert route["bounds"]["northeast"]["lat"] == pytest.approx(40.2)
+
+
+def test_geocode_batch_looks_up_each_location_once(service):
+    geocoded = []
+    geocode = service.gmaps.geocode
+    service.gmaps.geocode = lambda address: geocoded.append(address) or geocode(address)
+    geocodes = core.GeocodeBatch(service)
+    trips = [[{"address": "Champaign"}, {"address": "Urbana "}], [{"address": "urbana"}, {"address": "Champaign"}]]
+    routes = [service.submit_route_data(itinerary, geocodes).result() for itinerary in trips]
+    assert sorted(geocoded) == ["Champaign", "Urbana "]
+    assert routes[0]["markers"][1]["position"] == routes[1]["markers"][0]["position"]
+
+
+def test_optimized_route_reports_waypoint_order(service):
+    itinerary = [{"location": "40.0,-88.0"}, {"location": "40.3,-88.0"}, {"location": "40.1,-88.0"}, {"location": "40.4,-88.0"}]
+    route = service.get_route_data(itinerary, optimize=True)
+    assert route["waypoint_order"] == [0, 2, 1, 3]
+    assert [marker["position"]["lat"] for marker in route["markers"]] == [40.0, 40.1, 40.3, 40.4]
+
+
+def test_travel_time_matrix_batches_and_caches_cells(service):
+    origins = [(40.0 + i / 100, -88.0) for i in range(30)]
+    destinations = [(41.0, -88.0 + j / 100) for j in range(8)]
+    result = service.travel_time_matrix(origins, destinations)
+    assert result["durations"].shape == (30, 8) and (result["durations"] == 60).all()
+    assert not result["estimated"].any()
+    assert len(service.gmaps.matrix_calls) == 3
+    # Only the new destination column is fetched next time
+    service.travel_time_matrix(origins, destinations + [(42.0, -88.0)])
+    assert [len(d) for _, d in service.gmaps.matrix_calls[3:]] == [1, 1]
+
+
+def test_travel_time_matrix_estimates_without_api(service):
+    result = service.travel_time_matrix(["40.0,-88.0"], ["40.1,-88.0"], use_api=False)
+    assert result["estimated"].all()
+    assert result["distances"][0, 0] == pytest.approx(11119 * 1.3, rel=0.01)
+    assert service.gmaps.matrix_calls == []
+
+
+def test_pipeline_prefetches_legs_as_stops_resolve(service):
+    from backend import itinerary_pipeline
+
+    pipeline = itinerary_pipeline.ItineraryPipeline(service)
+    for i in range(1, 7):
+        pipeline.add({"address": "a" * i, "title": f"Stop {i}"})
+    route = pipeline.finish()
+    # Every leg came from a single-leg prefetch, none from a full-route call
+    assert len(service.gmaps.directions_calls) == 5
+    assert all(waypoints is None for _, _, waypoints in service.gmaps.directions_calls)
+    assert len(route["legs"]) == 5 and route["markers"][-1]["title"] == "Stop 6"
+
+
+def test_trusted_coordinates_skip_geocoding(service, monkeypatch):
+    calls = []
+    monkeypatch.setattr(service.gmaps, "geocode", lambda address: calls.append(address) or [])
+    service.coordinate_trust.sample_rate = 0
+    itinerary = [
+        {"location": "40.11,-88.24", "address": "1 Green St, Urbana, IL"},
+        {"location": "40.12,-88.23", "address": "2 Main St, Urbana, IL"},
+        {"location": "0,0", "address": "3 Race St, Urbana, IL"}
+    ]
+    coordinates = service.resolve_itinerary(itinerary)
+    assert coordinates[:2] == [(40.11, -88.24), (40.12, -88.23)]
+    assert calls == ["3 Race St, Urbana, IL"]
+
+
+def test_coordinates_far_from_known_area_are_geocoded(service):
+    service.geocode_cache.set("Urbana, IL", {"lat": 40.11, "lng": -88.21})
+    trust = service.coordinate_trust
+    assert trust.check((40.1, -88.2), "1 Green St, Urbana, IL") is None
+    assert "Urbana" in trust.check((34.05, -118.24), "1 Green St, Urbana, IL")
+    assert "nearest other stop" in trust.check((34.05, -118.24), neighbors=[(40.1, -88.2)])
+
+    assert trust.verify((45.0, -88.0), "1 Green St, Urbana, IL") > trust.tolerance_km
+    assert trust.stats()["mismatches"] == 1
+
+
+def test_travel_time_matrix_skips_same_place_cells(service):
+    points = [(40.0, -88.0), (40.1, -88.0), (40.2, -88.0)]
+    result = service.travel_time_matrix(points, points)
+    assert (result["durations"].diagonal() == 0).all() and not result["estimated"].any()
+    # Only the six off-diagonal elements are requested
+    assert sum(len(o) * len(d) for o, d in service.gmaps.matrix_calls) == 6
+
+
+def test_invalidated_location_is_fetched_again(service):
+    itinerary = [{"address": "a"}, {"address": "bb"}, {"address": "ccc"}]
+    service.get_route_data(itinerary)
+    service.travel_time_matrix(["40.01,-88.0", "40.02,-88.0"], ["40.03,-88.0"])
+    calls = len(service.gmaps.directions_calls)
+    assert service.invalidate_routes("bb") > 0
+    service.get_route_data(itinerary)
+    # Both legs touching the invalidated stop are fetched again
+    assert len(service.gmaps.directions_calls) == calls + 2
+    service.travel_time_matrix(["40.01,-88.0", "40.02,-88.0"], ["40.03,-88.0"])
+    assert service.gmaps.matrix_calls[-1] == (["40.02,-88.0"], ["40.03,-88.0"])
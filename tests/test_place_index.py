@@ -0,0 +1,60 @@
+import time
+
+from backend import place_index as core
+
+
+def make_place(place_id, lat, lng):
+    return {"place_id": place_id, "name": place_id, "geometry": {"location": {"lat": lat, "lng": lng}}}
+
+
+def test_query_near_polyline_orders_by_distance():
+    index = core.PlaceIndex(path="")
+    index.add_places_results([
+        make_place("far", 40.05, -88.04),
+        make_place("near", 40.05, -88.001),
+        make_place("outside", 41.0, -88.0),
+    ], "Gas Station")
+    results = index.query_near_polyline([(40.0, -88.0), (40.1, -88.0)], "gas station", radius_km=5)
+    assert [place["place_id"] for place in results] == ["near", "far"]
+    assert results[0]["distance_km"] < results[1]["distance_km"]
+
+
+def test_index_persists_and_expires(tmp_path):
+    path = str(tmp_path / "places.sqlite3")
+    core.PlaceIndex(path=path).add(make_place("p1", 40.0, -88.0), "cafe", 40.0, -88.0)
+    assert len(core.PlaceIndex(path=path)) == 1
+    assert core.PlaceIndex(path=path).match_category("any good cafe nearby?") == "cafe"
+    assert core.PlaceIndex(path=path, ttl=-1).query_near_point(40.0, -88.0, "cafe") == []
+
+
+def test_only_plain_requests_match_exactly():
+    index = core.PlaceIndex(path="")
+    index.add(make_place("p1", 40.0, -88.0), "gas station", 40.0, -88.0)
+    index.add(make_place("p2", 40.0, -88.0), "cafe", 40.0, -88.0)
+    assert index.match_category("coffee near the train station") is None
+    assert index.match_category("Any gas stations along the way?") == "gas station"
+    assert core.plain_request("Any gas stations along the way?", "gas station")
+    # Qualifiers still match the category, but the model should weigh them
+    assert index.match_category("a cheap gas station with clean restrooms") == "gas station"
+    assert not core.plain_request("a cheap gas station with clean restrooms", "gas station")
+    assert not core.plain_request("cafes that are open late", "cafe")
+
+
+def test_expired_places_are_evicted_from_memory():
+    index = core.PlaceIndex(path="", ttl=0.05, sweep_interval=60)
+    index.add_places_results([make_place("a", 40.0, -88.0), make_place("b", 40.01, -88.0)], "cafe")
+    index.add(make_place("c", 45.0, -93.0), "museum", 45.0, -93.0)
+    assert len(index) == 3
+    time.sleep(0.06)
+    # A lookup drops the expired places in the cells it touches
+    assert index.query_near_point(40.0, -88.0, "cafe") == []
+    assert len(index) == 1 and index.categories() == ["museum"]
+    # A sweep drops the rest
+    assert index.prune() == 1
+    assert len(index) == 0 and index.match_category("any museums?") is None
+    # Adding a place sweeps once sweep_interval has passed
+    index = core.PlaceIndex(path="", ttl=0.05, sweep_interval=0)
+    index.add(make_place("a", 40.0, -88.0), "cafe", 40.0, -88.0)
+    time.sleep(0.06)
+    index.add(make_place("c", 45.0, -93.0), "museum", 45.0, -93.0)
+    assert len(index) == 1
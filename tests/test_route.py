@@ -39,4 +39,27 @@ def test_get_stop_nearby(requests_mock):
     }
     requests_mock.get(requests_mock_module.ANY, json=mock_data)
     stop = core.get_stop_nearby(40.0, -88.0, "gas station")
-    assert stop['name'] == 'Mock Stop'
\ No newline at end of file
+    assert stop['name'] == 'Mock Stop'
+
+def test_sample_route_points_spaces_samples_by_distance():
+    # Dense points near the start, one long stretch after them
+    points = [(40.0, -88.0 + i * 0.001) for i in range(10)] + [(40.0, -87.0)]
+    sampled = core.sample_route_points(points, 2)
+    assert sampled[0] == points[0]
+    assert sampled[1] == (40.0, -87.0)
+
+
+def test_find_stops_along_route_dedupes_and_ranks(requests_mock):
+    requests_mock.get(core.DIRECTIONS_URL, json={
+        'status': 'OK',
+        'routes': [{'overview_polyline': {'points': '}_ilFtwvpOwK_A'}}]
+    })
+    near = {'place_id': 'near', 'name': 'Near Stop', 'rating': 4.0,
+            'geometry': {'location': {'lat': 38.882, 'lng': -86.793}}}
+    far = {'place_id': 'far', 'name': 'Far Stop', 'rating': 4.2,
+           'geometry': {'location': {'lat': 39.2, 'lng': -86.79}}}
+    requests_mock.get(core.PLACES_URL, json={'status': 'OK', 'results': [far, near]})
+    result = core.find_stops_along_route("Start", "End", "gas station", num_samples=2)
+    assert [stop['place_id'] for stop in result['stops']] == ['near', 'far']
+    assert result['stops'][0]['detour_km'] < 1
+    assert result['stops'][1]['detour_km'] > 50
@@ -0,0 +1,47 @@
+from itertools import permutations
+
+import numpy as np
+
+from backend import route_optimizer as core
+
+
+def brute_force(matrix):
+    n = len(matrix)
+    orders = ([0, *middle, n - 1] for middle in permutations(range(1, n - 1)))
+    return min(core.route_cost(order, matrix) for order in orders)
+
+
+def test_held_karp_matches_brute_force():
+    rng = np.random.default_rng(1)
+    matrix = rng.uniform(1, 100, size=(8, 8))
+    order = core.optimize_order(matrix)
+    assert order[0] == 0 and order[-1] == 7 and sorted(order) == list(range(8))
+    assert core.route_cost(order, matrix) == brute_force(matrix)
+
+
+def test_local_search_untangles_large_route():
+    # Stops along a line, listed in shuffled order
+    rng = np.random.default_rng(2)
+    lngs = np.concatenate(([0.0], rng.permutation(np.linspace(0.01, 0.39, 18)), [0.4]))
+    matrix = core.estimate_matrix([(40.0, lng) for lng in lngs])
+    order = core.optimize_order(matrix)
+    assert order[0] == 0 and order[-1] == 19
+    assert list(lngs[order]) == sorted(lngs)
+
+
+def test_time_windows_override_shorter_drive():
+    # Stop 2 is on the way but only open later in the day
+    matrix = core.estimate_matrix([(40.0, 0.0), (40.0, 0.2), (40.0, 0.1), (40.0, 0.3)])
+    windows = core.time_windows([None, "9:00 AM", "2:00 PM", None])
+    service = [0, core.parse_duration("1 hour"), core.parse_duration("30 minutes"), 0]
+    assert core.optimize_order(matrix) == [0, 2, 1, 3]
+    assert core.optimize_order(matrix, windows, service) == [0, 1, 2, 3]
+
+
+def test_parse_time_and_duration():
+    assert core.parse_time("10:30 AM") == 10.5 * 3600
+    assert core.parse_time("12pm") == 12 * 3600
+    assert core.parse_time("14:15") == 14.25 * 3600
+    assert core.parse_time("morning") is None
+    assert core.parse_duration("1.5 hours") == 5400
+    assert core.parse_duration("1 hr 20 mins") == 4800
@@ -0,0 +1,46 @@
+from backend import routing as core
+
+OSRM_RESPONSE = {
+    "code": "Ok",
+    "routes": [{
+        "geometry": "_ocsF~nbxO_pR?",
+        "legs": [{
+            "distance": 11119.5,
+            "duration": 600.0,
+            "steps": [
+                {"distance": 11119.5, "duration": 600.0, "geometry": "_ocsF~nbxO_pR?", "name": "Main St",
+                 "maneuver": {"type": "depart", "modifier": "north", "location": [-88.0, 40.0]}},
+                {"distance": 0, "duration": 0, "geometry": "_a|tF~nbxO", "name": "",
+                 "maneuver": {"type": "arrive", "location": [-88.0, 40.1]}}
+            ]
+        }]
+    }]
+}
+
+
+def test_osrm_router_returns_google_format(requests_mock):
+    requests_mock.get("http://osrm.local/route/v1/driving/-88.0,40.0;-88.0,40.1", json=OSRM_RESPONSE)
+    routes = core.OSRMRouter("http://osrm.local").directions("40.0,-88.0", (40.1, -88.0))
+    leg = routes[0]["legs"][0]
+    assert leg["duration"]["value"] == 600 and leg["distance"]["value"] == 11120
+    assert leg["steps"][0]["html_instructions"] == "Depart north onto Main St"
+    assert leg["steps"][0]["end_location"] == {"lat": 40.1, "lng": -88.0}
+    assert routes[0]["bounds"]["northeast"]["lat"] == 40.1
+
+
+def test_recorded_router_records_then_replays(tmp_path):
+    class Source:
+        calls = 0
+
+        def directions(self, origin, destination, **kwargs):
+            Source.calls += 1
+            return [{"legs": [], "summary": f"{origin} to {destination}"}]
+
+    recorder = core.RecordedRouter(str(tmp_path), source=Source())
+    assert recorder.directions("Champaign", "Chicago") == [{"legs": [], "summary": "Champaign to Chicago"}]
+    replay = core.RecordedRouter(str(tmp_path))
+    assert replay.directions("Champaign", "Chicago") == [{"legs": [], "summary": "Champaign to Chicago"}]
+    assert Source.calls == 1
+    # Unrecorded coordinates get a straight-line route, addresses get none
+    assert len(replay.directions("40.0,-88.0", "40.1,-88.0", waypoints=["40.05,-88.0"])[0]["legs"]) == 2
+    assert replay.directions("Urbana", "Chicago") == []
@@ -0,0 +1,56 @@
+import itertools
+import time
+
+from backend import session_store as core
+
+
+def make_store(**kwargs):
+    counter = itertools.count()
+    return core.SessionStore(lambda: {"n": next(counter)}, **kwargs)
+
+
+def test_sessions_are_isolated_and_reused():
+    store = make_store(maxsize=10, ttl=60)
+    with store.session("alice") as state:
+        state["itinerary"] = ["lunch"]
+    with store.session("bob") as state:
+        assert "itinerary" not in state
+    with store.session("alice") as state:
+        assert state == {"n": 0, "itinerary": ["lunch"]}
+    assert len(store) == 2
+
+
+def test_idle_sessions_expire():
+    store = make_store(maxsize=10, ttl=0.01)
+    first = store.get("alice").value
+    time.sleep(0.02)
+    assert store.get("alice").value is not first
+    # Touching another session evicts the idle one
+    time.sleep(0.02)
+    store.get("bob")
+    assert len(store) == 1 and store.stats()["evictions"] == 1
+
+
+def test_least_recently_used_session_is_evicted():
+    store = make_store(maxsize=2, ttl=60)
+    store.get("alice")
+    store.get("bob")
+    store.get("alice")
+    store.get("carol")
+    assert len(store) == 2
+    assert store.get("alice").value["n"] == 0
+    # bob was evicted, so that session starts over
+    assert store.get("bob").value["n"] == 3
+
+
+def test_requests_without_a_session_id_share_the_default(monkeypatch):
+    monkeypatch.setenv("GOOGLE_MAPS_KEY", "AIzaFAKE")
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    from backend import app as server
+
+    with server.app.test_request_context(json={}):
+        assert server.get_session_id() == "default"
+    with server.app.test_request_context(json={"session_id": "body"}, headers={"X-Session-Id": "header"}):
+        assert server.get_session_id() == "header"
+    with server.app.test_request_context(json={"session_id": "body"}):
+        assert server.get_session_id() == "body"
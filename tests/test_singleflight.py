@@ -0,0 +1,50 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from backend import singleflight as core
+
+
+def test_concurrent_calls_with_same_key_share_one_call():
+    flights = core.SingleFlight()
+    calls = []
+    started = threading.Event()
+
+    def fetch(key):
+        calls.append(key)
+        started.set()
+        time.sleep(0.1)
+        return {"route": key}
+
+    with ThreadPoolExecutor(max_workers=5) as pool:
+        first = pool.submit(flights.do, "a", fetch, "a")
+        started.wait()
+        others = [pool.submit(flights.do, "a", fetch, "a") for _ in range(3)]
+        other_key = pool.submit(flights.do, "b", fetch, "b")
+        results = [first.result()] + [future.result() for future in others]
+
+    assert other_key.result() == {"route": "b"}
+    assert sorted(calls) == ["a", "b"]
+    assert all(result is results[0] for result in results)
+    assert flights.stats()["coalesced"] == 3 and flights.stats()["in_flight"] == 0
+
+
+def test_errors_reach_every_waiting_caller_and_are_not_kept():
+    flights = core.SingleFlight()
+    started = threading.Event()
+
+    def fail():
+        started.set()
+        time.sleep(0.05)
+        raise RuntimeError("upstream down")
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        first = pool.submit(flights.do, "a", fail)
+        started.wait()
+        second = pool.submit(flights.do, "a", fail)
+        for future in (first, second):
+            with pytest.raises(RuntimeError):
+                future.result()
+    assert flights.do("a", lambda: "ok") == "ok"
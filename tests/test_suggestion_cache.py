@@ -0,0 +1,77 @@
+import time
+
+from backend import suggestion_cache as core
+
+ROUTE = {"start": "Urbana, IL", "end": "Chicago, IL", "stops": ["Champaign, IL"]}
+SUGGESTIONS = [{"name": "Shell", "category": "gas station"}]
+
+
+class FixedEmbedder:
+    """Embeds known messages to fixed vectors, so similarities are exact."""
+
+    vectors = {
+        "any gas stations": [1.0, 0.0],
+        "where can i fill up": [0.75, 0.25],
+        "where can i get fuel": [0.8, 0.2],
+        "any good museums": [0.0, 1.0],
+    }
+
+    def embed_query(self, text):
+        return self.vectors[text]
+
+
+def ask(message, **route):
+    return {**ROUTE, **route, "message": message}
+
+
+def test_exact_hits_ignore_case_punctuation_and_spacing():
+    cache = core.SuggestionCache()
+    cache.set(ask("Any gas stations?"), SUGGESTIONS)
+    assert cache.get(ask("  any GAS stations ")) == SUGGESTIONS
+    assert cache.get(ask("Any gas stations?", end="Peoria, IL")) is None
+    assert cache.get(ask("Any gas stations?", stops=["Rantoul, IL"])) is None
+
+
+def test_paraphrases_need_to_reach_the_similarity_threshold():
+    # cosine([1, 0], [0.8, 0.2]) ~ 0.970 and cosine([1, 0], [0.75, 0.25]) ~ 0.949
+    cache = core.SuggestionCache(embeddings=FixedEmbedder(), similarity_threshold=0.96)
+    cache.set(ask("Any gas stations?"), SUGGESTIONS)
+    assert cache.get(ask("Where can I get fuel?")) == SUGGESTIONS
+    assert cache.get(ask("Where can I fill up?")) is None
+    assert cache.get(ask("Any good museums?")) is None
+    # Paraphrases only match answers cached for the same route
+    assert cache.get(ask("Where can I get fuel?", end="Peoria, IL")) is None
+
+
+def test_entries_expire_after_ttl():
+    cache = core.SuggestionCache(ttl=0.01, embeddings=FixedEmbedder(), similarity_threshold=0.96)
+    cache.set(ask("Any gas stations?"), SUGGESTIONS)
+    time.sleep(0.02)
+    assert cache.get(ask("Any gas stations?")) is None
+    # An expired answer is not served to paraphrases either
+    assert cache.get(ask("Where can I get fuel?")) is None
+
+
+def test_stats_count_each_kind_of_lookup():
+    cache = core.SuggestionCache(embeddings=FixedEmbedder(), similarity_threshold=0.96)
+    cache.set(ask("Any gas stations?"), SUGGESTIONS)
+    cache.get(ask("Any gas stations?"))
+    cache.get(ask("Where can I get fuel?"))
+    cache.get(ask("Any good museums?"))
+    cache.get(ask("Where can I fill up?"))
+    stats = cache.stats()
+    assert stats["size"] == 1 and stats["semantic_enabled"]
+    assert (stats["hits"], stats["semantic_hits"], stats["misses"]) == (1, 1, 2)
+    assert stats["hit_rate"] == 0.5
+
+
+def test_counters_survive_concurrent_lookups():
+    from concurrent.futures import ThreadPoolExecutor
+
+    cache = core.SuggestionCache()
+    cache.set(ask("Any gas stations?"), SUGGESTIONS)
+    messages = ["Any gas stations?", "Any good museums?"] * 500
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(lambda message: cache.get(ask(message)), messages))
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"]) == (500, 500)
@@ -0,0 +1,114 @@
+import threading
+import time
+
+from backend import upstream_scheduler as core
+
+
+class Response:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def test_throttled_calls_are_retried_with_backoff():
+    scheduler = core.UpstreamScheduler(max_retries=3, backoff_base=0.01, backoff_max=0.05)
+    answers = [Response(429, {"Retry-After": "0"}), Response(503), Response(200)]
+    sent = []
+
+    def send():
+        sent.append(answers[len(sent)])
+        return sent[-1]
+
+    response = scheduler.call("test", send, retry_if=core.retryable_response)
+    assert response.status_code == 200
+    assert [answer.closed for answer in sent] == [True, True, False]
+    stats = scheduler.stats()["test"]
+    assert stats["retries"] == 2 and stats["throttled"] == 1 and stats["in_flight"] == 0
+
+
+def test_interactive_calls_go_ahead_of_queued_batch_calls():
+    queue = core.UpstreamQueue("test", rate=10, burst=1)
+    queue.acquire()
+    order = []
+
+    def call(level, name):
+        queue.acquire(level)
+        order.append(name)
+        queue.release()
+
+    batch = threading.Thread(target=call, args=(core.BATCH, "batch"))
+    batch.start()
+    time.sleep(0.02)
+    interactive = threading.Thread(target=call, args=(core.INTERACTIVE, "interactive"))
+    interactive.start()
+    batch.join()
+    interactive.join()
+    assert order == ["interactive", "batch"]
+    assert queue.stats()["max_queued"] == 2
+
+
+def test_google_over_query_limit_pauses_the_queue(monkeypatch):
+    import googlemaps
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    from backend import http_clients
+
+    scheduler = core.UpstreamScheduler(max_retries=3, backoff_base=0.01, backoff_max=0.05)
+    monkeypatch.setattr(http_clients, "scheduler", scheduler)
+    bodies = [b'{"status": "OVER_QUERY_LIMIT", "results": []}', b'{"status": "OK", "results": []}']
+    sent = []
+
+    def send(adapter, request, **kwargs):
+        response = requests.Response()
+        response.status_code = 200
+        response._content = bodies[len(sent)]
+        response.request = request
+        sent.append(request.url)
+        return response
+
+    monkeypatch.setattr(HTTPAdapter, "send", send)
+    upstream = http_clients.Upstream("google_test", timeout=1, max_connections=1, throttled_if=http_clients.over_query_limit)
+    client = googlemaps.Client(
+        key="AIzaTEST", requests_session=upstream.session, retry_timeout=1, retry_over_query_limit=False
+    )
+    assert client.geocode("Urbana, IL") == []
+    assert len(sent) == 2
+    stats = scheduler.stats()["google_test"]
+    assert stats["retries"] == 1 and stats["throttled"] == 1
+
+
+def test_nominatim_goes_through_the_shared_session(monkeypatch):
+    import requests
+    from geopy.geocoders import Nominatim
+    from requests.adapters import HTTPAdapter
+
+    from backend import http_clients
+
+    scheduler = core.UpstreamScheduler(max_retries=3, backoff_base=0.01, backoff_max=0.05)
+    monkeypatch.setattr(http_clients, "scheduler", scheduler)
+    statuses = [503, 200]
+    sent = []
+
+    def send(adapter, request, **kwargs):
+        response = requests.Response()
+        response.status_code = statuses[len(sent)]
+        response._content = b'[{"lat": "40.11", "lon": "-88.21", "display_name": "Urbana, IL"}]'
+        response._content_consumed = True
+        response.request = request
+        sent.append(adapter)
+        return response
+
+    monkeypatch.setattr(HTTPAdapter, "send", send)
+    upstream = http_clients.Upstream("nominatim_test", timeout=1, max_connections=1)
+    geolocator = Nominatim(
+        user_agent="test", adapter_factory=lambda **kwargs: http_clients.GeopyAdapter(upstream, **kwargs)
+    )
+    location = geolocator.geocode("Urbana, IL")
+    assert (location.latitude, location.longitude) == (40.11, -88.21)
+    assert all(adapter is upstream.session.get_adapter("https://") for adapter in sent)
+    assert scheduler.stats()["nominatim_test"]["retries"] == 1
@@ -0,0 +1,37 @@
+from backend import vector_index as core
+
+
+class CountingEmbedder(core.HashingEmbedder):
+    def __init__(self):
+        super().__init__()
+        self.embedded = []
+
+    def embed_documents(self, texts):
+        self.embedded.extend(texts)
+        return super().embed_documents(texts)
+
+
+def test_only_changed_items_are_embedded():
+    embedder = CountingEmbedder()
+    index = core.ItineraryIndex(embedder, background=False)
+    itinerary = [
+        {"id": "1", "title": "Coffee at Cafe Kopi", "type": "food"},
+        {"id": "2", "title": "Krannert Art Museum", "type": "attraction"}
+    ]
+    index.update(itinerary)
+    assert len(embedder.embedded) == 2
+
+    itinerary[1] = {"id": "2", "title": "Japan House tea ceremony", "type": "attraction"}
+    index.update(itinerary)
+    assert len(embedder.embedded) == 3
+    assert len(index) == 2
+
+
+def test_search_returns_most_similar_item():
+    index = core.ItineraryIndex(core.HashingEmbedder())
+    index.update([
+        {"id": "1", "title": "Coffee at Cafe Kopi", "type": "food"},
+        {"id": "2", "title": "Krannert Art Museum", "type": "attraction"}
+    ])
+    index.wait(timeout=5)
+    assert index.search("art museum", k=1)[0]["id"] == "2"